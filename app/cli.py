@@ -32,9 +32,39 @@ def build_parser() -> argparse.ArgumentParser:
     voro.add_argument("--primitive-type", default="", help="Primitive shape type")
     voro.add_argument("--resolution", type=int, default=300)
     voro.add_argument("--tpb", type=int, default=8)
+    voro.add_argument("--backend", default="auto", choices=["auto", "cuda", "cpu"], help="Kernel backend, auto uses CUDA when available")
+    voro.add_argument("--sdf-method", default="jfa", choices=["jfa", "edt"], help="Signed distance engine, edt is exact")
+    voro.add_argument("--precision", default="float32", choices=["float32", "float16"], help="Storage dtype of the distance fields, kernels always compute in float32")
+    voro.add_argument("--seed-sampler", default="random", choices=["random", "poisson"], help="Voronoi seed placement, poisson gives even cell sizes")
+    voro.add_argument("--seed", type=int, default=-1, help="Fixed random seed, negative draws a fresh one")
+    voro.add_argument("--cell-engine", default="jfa", choices=["jfa", "kdtree"], help="Voronoi cell labelling, kdtree is exact and CPU only")
+    voro.add_argument("--voxel-workers", type=int, default=1, help="Processes used to voxelize STL files, 0 uses every core")
+    voro.add_argument("--direct-sdf", action="store_true", default=False, help="Compute the STL distance field from the triangles instead of a voxel grid")
+    voro.add_argument("--mesh-format", default="ply", choices=["ply", "ply_ascii", "stl"], help="Exported mesh format, ply and stl are binary")
+    voro.add_argument("--mesh-chunk", type=int, default=0, help="Block edge length for chunked marching cubes, 0 meshes the whole grid")
+    voro.add_argument("--mesh-workers", type=int, default=1, help="Processes meshing blocks, 0 uses every core")
+    voro.add_argument("--narrow-band", type=float, default=0.0, help="Half width in voxels of the sparse band used for the model shell and meshes, 0 keeps dense grids")
+    voro.add_argument("--batch", action="store_true", default=False, help="Run without plots or prompts and always generate meshes")
+    voro.add_argument("--out", default="", help="Directory receiving meshes and image stacks")
+    voro.add_argument("--cache-dir", default="", help="Directory caching voxelization and distance fields between runs")
+    voro.add_argument("--cache-size", type=float, default=10.0, help="Size budget of the stage cache in GiB")
     voro.add_argument("--model", action="store_true", default=False)
     voro.add_argument("--support", action="store_true", default=False)
 
+    vbatch = sub.add_parser("voronize-batch", help="Run Voronizer over many STL files")
+    vbatch.add_argument("--inputs", required=True, help="Glob pattern or JSON manifest of STL files")
+    vbatch.add_argument("--out", required=True, help="Directory receiving artifacts and report.json")
+    vbatch.add_argument("--jobs", type=int, default=1, help="Files processed at once, 0 uses every core")
+    vbatch.add_argument("--memory-limit", type=float, default=None, help="Memory ceiling per job in GiB")
+    vbatch.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help="PipelineConfig override applied to every file")
+
+    sweep = sub.add_parser("voronize-sweep", help="Run Voronizer for a grid of cell settings")
+    sweep.add_argument("--file-name", default="", help="STL file name inside Input folder")
+    sweep.add_argument("--primitive-type", default="", help="Primitive shape type")
+    sweep.add_argument("--out", required=True, help="Directory receiving meshes and sweep.json")
+    sweep.add_argument("--grid", action="append", default=[], metavar="KEY=V1,V2", help="Values of MODEL_THRESH, MODEL_CELL, MODEL_SHELL or SUPPORT_CELL to try")
+    sweep.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help="PipelineConfig override shared by every variant")
+
     repair = sub.add_parser("repair", help="Repair a mesh")
     repair.add_argument("--input", required=True, help="Path to input mesh file")
     repair.add_argument("--output", required=True, help="Destination path for repaired mesh")
@@ -81,10 +111,40 @@ def main(args: Sequence[str] | None = None) -> int:
             PRIMITIVE_TYPE=opts.primitive_type,
             RESOLUTION=opts.resolution,
             TPB=opts.tpb,
+            BACKEND=opts.backend,
+            SDF_METHOD=opts.sdf_method,
+            PRECISION=opts.precision,
+            SEED_SAMPLER=opts.seed_sampler,
+            SEED=opts.seed,
+            CELL_ENGINE=opts.cell_engine,
+            VOXEL_WORKERS=opts.voxel_workers,
+            DIRECT_SDF=opts.direct_sdf,
+            MESH_FORMAT=opts.mesh_format,
+            MESH_CHUNK=opts.mesh_chunk,
+            MESH_WORKERS=opts.mesh_workers,
+            NARROW_BAND=opts.narrow_band,
+            BATCH=opts.batch,
+            OUTPUT_DIR=opts.out,
+            CACHE_DIR=opts.cache_dir,
+            CACHE_SIZE=opts.cache_size,
             MODEL=opts.model,
             SUPPORT=opts.support,
         )
         run_pipeline(config)
+    elif opts.command == "voronize-batch":
+        from app.voronizer import PipelineConfig  # lazy import
+        from app.voronizer.batch import parseOverrides, runBatch
+
+        config = PipelineConfig(**parseOverrides(opts.set))
+        runBatch(opts.inputs, opts.out, config, jobs=opts.jobs, memoryLimit=opts.memory_limit)
+    elif opts.command == "voronize-sweep":
+        from app.voronizer import PipelineConfig  # lazy import
+        from app.voronizer.batch import parseOverrides
+        from app.voronizer.sweep import parseGrid, runSweep
+
+        overrides = {"FILE_NAME": opts.file_name, "PRIMITIVE_TYPE": opts.primitive_type, **parseOverrides(opts.set)}
+        config = PipelineConfig(BATCH=True, **overrides)
+        runSweep(config, parseGrid(opts.grid), opts.out)
     elif opts.command == "repair":
         mesh = load_mesh(opts.input)
         if opts.watertight:
@@ -1,31 +1,93 @@
-from numba import cuda
+from numba import cuda, njit, prange
 import numpy as np
 import math
+from .backend import use_cuda
+from .device import download, isHandle, onDevice, result, target
 
 
+@cuda.jit(device = True)
+def rowVoxel(axis, a, b, q):
+    #Index of voxel q of the row along axis through (a, b) of the other axes.
+    if axis == 0:
+        return q, a, b
+    if axis == 1:
+        return a, q, b
+    return a, b, q
+
 @cuda.jit
-def smoothKernel(d_u, d_v, buffer):
-    """Average each voxel with its neighbors ignoring ``buffer`` layers."""
-    i, j, k = cuda.grid(3)
-    count = 0
+def boxPassKernel(d_u, d_v, axis, radius):
+    """Mean of the in-bounds voxels within ``radius`` along ``axis``."""
+    a, b = cuda.grid(2)
     dims = d_u.shape
-    if i>=dims[0]-buffer or j>=dims[1]-buffer or k>=dims[2]-buffer or i<buffer or j<buffer or k<buffer:
+    n = dims[axis]
+    outer = dims[0] if axis != 0 else dims[1]
+    inner = dims[2] if axis != 2 else dims[1]
+    if a >= outer or b >= inner:
         return
-    else:
-        d_v[i,j,k]=0
-        for index in range(27):
-            checkPos = (i+((index//9)%3-1),j+((index//3)%3-1),k+(index%3-1))
-            if checkPos[0]<dims[0] and checkPos[1]<dims[1] and checkPos[2]<dims[2] and min(checkPos)>=0:
-                d_v[i,j,k]+=d_u[checkPos]
-                count+=1
-        d_v[i,j,k] = d_v[i,j,k]/count
-
-def smooth(u, iteration=1, buffer=0, tpb=8):
+    total = 0.0
+    for q in range(min(n, radius)):
+        total += d_u[rowVoxel(axis, a, b, q)]
+    for q in range(n):
+        if q+radius < n:
+            total += d_u[rowVoxel(axis, a, b, q+radius)]
+        if q-radius-1 >= 0:
+            total -= d_u[rowVoxel(axis, a, b, q-radius-1)]
+        d_v[rowVoxel(axis, a, b, q)] = total/(min(n-1, q+radius)-max(0, q-radius)+1)
+
+@njit(cache=True)
+def boxRow(row, out, radius):
+    #Running sum mean of row over windows clipped to the row, O(1) per voxel.
+    n = row.shape[0]
+    total = 0.0
+    for q in range(min(n, radius)):
+        total += row[q]
+    for q in range(n):
+        if q+radius < n:
+            total += row[q+radius]
+        if q-radius-1 >= 0:
+            total -= row[q-radius-1]
+        out[q] = total/(min(n-1, q+radius)-max(0, q-radius)+1)
+
+@njit(parallel=True, cache=True)
+def boxPassCPU(u, axis, radius, iteration):
+    #iteration box passes along axis, in place, each row kept in a buffer.
+    dims = u.shape
+    n = dims[axis]
+    outer = dims[0] if axis != 0 else dims[1]
+    inner = dims[2] if axis != 2 else dims[1]
+    for a in prange(outer):
+        row = np.empty(n, np.float64)
+        out = np.empty(n, np.float64)
+        for b in range(inner):
+            for q in range(n):
+                if axis == 0:
+                    row[q] = u[q,a,b]
+                elif axis == 1:
+                    row[q] = u[a,q,b]
+                else:
+                    row[q] = u[a,b,q]
+            for var in range(iteration):
+                boxRow(row, out, radius)
+                row, out = out, row
+            for q in range(n):
+                if axis == 0:
+                    u[q,a,b] = row[q]
+                elif axis == 1:
+                    u[a,q,b] = row[q]
+                else:
+                    u[a,b,q] = row[q]
+
+def smooth(u, iteration=1, buffer=0, tpb=8, radius=1):
     """Return ``u`` after ``iteration`` smoothing passes.
 
+    Each pass replaces a voxel by the mean of the in-bounds voxels of the
+    ``(2*radius+1)^3`` box around it.  The box is applied as three 1-D
+    running sums, so the cost does not depend on ``radius``, and on the CPU
+    all iterations along one axis run on a row while it is in cache.
+
     Parameters
     ----------
-    u : numpy.ndarray
+    u : numpy.ndarray or DeviceGrid
         Input voxel grid.
     iteration : int, optional
         Number of smoothing iterations.
@@ -33,114 +95,222 @@ def smooth(u, iteration=1, buffer=0, tpb=8):
         Number of boundary layers left unchanged.
     tpb : int, optional
         CUDA threads per block.
+    radius : int, optional
+        Half width of the box, ``1`` averages the 27 neighbours.
 
     Returns
     -------
     numpy.ndarray
         Smoothed voxel grid.
     """
-    TPBX, TPBY, TPBZ = tpb, tpb, tpb
+    #Passes along different axes commute, so all iterations along one axis
+    #can run back to back, unless the fixed boundary layers feed the next one.
+    rounds, perRound = (iteration, 1) if buffer > 0 else (1, iteration)
+    m, n, p = u.shape
+    inner = (slice(buffer, m-buffer), slice(buffer, n-buffer), slice(buffer, p-buffer))
+    if not use_cuda():
+        h_u = download(u, copy=True)
+        h_v = np.array(h_u)
+        for var in range(rounds):
+            for axis in range(3):
+                boxPassCPU(h_v, axis, radius, perRound)
+            h_u[inner] = h_v[inner]
+            h_v[...] = h_u
+        return result(h_u, u)
     dims = u.shape
-    d_u = cuda.to_device(u)
-    d_v = cuda.to_device(u)
-    gridDims = (dims[0]+TPBX-1)//TPBX, (dims[1]+TPBY-1)//TPBY, (dims[2]+TPBZ-1)//TPBZ
-    blockDims = TPBX, TPBY, TPBZ
+    d_w = onDevice(u, copy=True)
+    d_v = cuda.device_array_like(d_w)
+    d_u = onDevice(u, copy=True) if buffer > 0 else d_w
     for var in range(iteration):
-        smoothKernel[gridDims, blockDims](d_u, d_v,buffer)
-        d_u,d_v = d_v,d_u
-    return d_u.copy_to_host()
+        for axis in range(3):
+            outer = dims[0] if axis != 0 else dims[1]
+            rows = dims[2] if axis != 2 else dims[1]
+            boxPassKernel[((outer+tpb-1)//tpb, (rows+tpb-1)//tpb), (tpb, tpb)](d_w, d_v, axis, radius)
+            d_w, d_v = d_v, d_w
+        if buffer > 0:
+            d_u[inner] = d_w[inner]
+            d_w.copy_to_device(d_u)
+    return result(d_w if buffer == 0 else d_u, u)
 
 @cuda.jit
-def boolKernel(d_u,d_v):
+def boolKernel(d_u,d_v,signU,signV,signOut):
+    #Same sign convention as boolKernelCPU, so no negated copies are needed.
     i,j,k = cuda.grid(3)
     dims = d_u.shape
     if i >= dims[0] or j >= dims[1] or k >= dims[2]:
         return
-    d_u[i,j,k] = min(d_u[i,j,k],d_v[i,j,k])
+    d_u[i,j,k] = signOut*min(signU*d_u[i,j,k],signV*d_v[i,j,k])
+
+@njit(parallel=True, cache=True)
+def boolKernelCPU(u, v, signU, signV, signOut):
+    #Writes signOut*min(signU*u, signV*v) into u, which covers union (1,1,1),
+    #intersection (-1,-1,-1) and subtraction (1,-1,-1) without temporaries.
+    m, n, p = u.shape
+    for i in prange(m):
+        for j in range(n):
+            for k in range(p):
+                u[i,j,k] = signOut*min(signU*u[i,j,k], signV*v[i,j,k])
     
-def union(u, v, tpb=8):
+def union(u, v, tpb=8, out=None):
     """Return the voxel-wise union of ``u`` and ``v``.
 
     Parameters
     ----------
-    u, v : numpy.ndarray
+    u, v : numpy.ndarray or DeviceGrid
         Input voxel models.
     tpb : int, optional
         CUDA threads per block.
+    out : numpy.ndarray or DeviceGrid, optional
+        ``float32`` grid of ``u.shape`` receiving the result, it may be
+        ``u`` but not ``v``.
 
     Returns
     -------
     numpy.ndarray
         Combined voxel model.
     """
-    d_u = cuda.to_device(u)
-    d_v = cuda.to_device(v)
+    if not use_cuda():
+        h_u = download(u, copy=True, out=out)
+        boolKernelCPU(h_u, download(v), 1, 1, 1)
+        return result(h_u, u, v, out)
+    d_u = onDevice(u, copy=True, out=out)
+    d_v = onDevice(v)
     dims = u.shape
-    gridSize = [(dims[0]+tpb-1)//tpb, (dims[1]+tpb-1)//tpb, (dims[2]+tpb-1)//tpb]
+    gridSize = [(dims[0] + tpb - 1) // tpb, (dims[1] + tpb - 1) // tpb, (dims[2] + tpb - 1) // tpb]
     blockSize = [tpb, tpb, tpb]
-    boolKernel[gridSize, blockSize](d_u, d_v)
-    return d_u.copy_to_host()
+    boolKernel[gridSize, blockSize](d_u, d_v, 1, 1, 1)
+    return result(d_u, u, v, out)
 
-def intersection(u, v, tpb=8):
+def intersection(u, v, tpb=8, out=None):
     """Return the intersection of ``u`` and ``v``.
 
     Parameters
     ----------
-    u, v : numpy.ndarray
+    u, v : numpy.ndarray or DeviceGrid
         Input voxel models.
     tpb : int, optional
         CUDA threads per block.
+    out : numpy.ndarray or DeviceGrid, optional
+        ``float32`` grid of ``u.shape`` receiving the result, it may be
+        ``u`` but not ``v``.
 
     Returns
     -------
     numpy.ndarray
         Voxel model containing only overlapping cells.
     """
-    d_u = cuda.to_device(-1 * u)
-    d_v = cuda.to_device(-1 * v)
+    if not use_cuda():
+        h_u = download(u, copy=True, out=out)
+        boolKernelCPU(h_u, download(v), -1, -1, -1)
+        return result(h_u, u, v, out)
+    d_u = onDevice(u, copy=True, out=out)
+    d_v = onDevice(v)
     dims = u.shape
     gridSize = [(dims[0] + tpb - 1) // tpb, (dims[1] + tpb - 1) // tpb, (dims[2] + tpb - 1) // tpb]
     blockSize = [tpb, tpb, tpb]
-    boolKernel[gridSize, blockSize](d_u, d_v)
-    return -1 * d_u.copy_to_host()
+    boolKernel[gridSize, blockSize](d_u, d_v, -1, -1, -1)
+    return result(d_u, u, v, out)
 
-def subtract(u, v, tpb=8):
+def subtract(u, v, tpb=8, out=None):
     """Subtract ``u`` from ``v``.
 
     Parameters
     ----------
-    u, v : numpy.ndarray
+    u, v : numpy.ndarray or DeviceGrid
         ``u`` is the cutting tool, ``v`` the base model.
     tpb : int, optional
         CUDA threads per block.
+    out : numpy.ndarray or DeviceGrid, optional
+        ``float32`` grid of ``u.shape`` receiving the result, it may be
+        ``u`` but not ``v``.
 
     Returns
     -------
     numpy.ndarray
         Resulting voxel grid.
     """
-    d_u = cuda.to_device(u)
-    d_v = cuda.to_device(-1 * v)
+    if not use_cuda():
+        h_u = download(u, copy=True, out=out)
+        boolKernelCPU(h_u, download(v), 1, -1, -1)
+        return result(h_u, u, v, out)
+    d_u = onDevice(u, copy=True, out=out)
+    d_v = onDevice(v)
     dims = u.shape
     gridSize = [(dims[0] + tpb - 1) // tpb, (dims[1] + tpb - 1) // tpb, (dims[2] + tpb - 1) // tpb]
     blockSize = [tpb, tpb, tpb]
-    boolKernel[gridSize, blockSize](d_u, d_v)
-    return -1 * d_u.copy_to_host()
+    boolKernel[gridSize, blockSize](d_u, d_v, 1, -1, -1)
+    return result(d_u, u, v, out)
 
 @cuda.jit
-def projectionKernel(d_u,X):
+def projectionKernel(d_u,minX):
+    #One thread per (Y, Z) column scanning down from the top.
     j,k = cuda.grid(2)
     m,n,p = d_u.shape
     if j < n and k < p:
-        if d_u[X+1,j,k]<=0:
-            d_u[X,j,k]=-1    
+        for X in range(m-2, minX-1, -1):
+            if d_u[X+1,j,k]<=0:
+                d_u[X,j,k]=-1
+
+@njit(parallel=True, cache=True)
+def projectionKernelCPU(u, minX):
+    m, n, p = u.shape
+    for j in prange(n):
+        for k in range(p):
+            for X in range(m-2, minX-1, -1):
+                if u[X+1,j,k]<=0:
+                    u[X,j,k]=-1
+
+@cuda.jit
+def solidProfilesKernel(d_u,d_x,d_y,d_z):
+    i,j,k = cuda.grid(3)
+    m,n,p = d_u.shape
+    if i < m and j < n and k < p and d_u[i,j,k]<0:
+        d_x[i] = 1
+        d_y[j] = 1
+        d_z[k] = 1
+
+@njit(parallel=True, cache=True)
+def solidProfilesKernelCPU(u, x, y, z):
+    #Concurrent writes only ever store 1, so the races are harmless.
+    m, n, p = u.shape
+    for i in prange(m):
+        for j in range(n):
+            for k in range(p):
+                if u[i,j,k]<0:
+                    x[i] = 1
+                    y[j] = 1
+                    z[k] = 1
+
+def solidProfiles(u, tpb=8):
+    """Return, per axis, a boolean per layer telling whether it holds a solid voxel.
+
+    All three profiles come from a single pass over ``u``, on the device
+    for CUDA handles.
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+        ``(x, y, z)`` flags of lengths ``u.shape``.
+    """
+    m, n, p = u.shape
+    if isHandle(u) and u.onDevice:
+        flags = [cuda.to_device(np.zeros(size, np.uint8)) for size in (m, n, p)]
+        gridSize = [(m + tpb - 1) // tpb, (n + tpb - 1) // tpb, (p + tpb - 1) // tpb]
+        solidProfilesKernel[gridSize, [tpb, tpb, tpb]](onDevice(u), *flags)
+        return tuple(d_f.copy_to_host().astype(bool) for d_f in flags)
+    flags = [np.zeros(size, np.uint8) for size in (m, n, p)]
+    solidProfilesKernelCPU(download(u), *flags)
+    return tuple(f.astype(bool) for f in flags)
 
 def projection(u, tpb=8):
     """Project ``u`` downwards along the X axis until contact.
 
+    Every column is scanned once from the top, in a single kernel launch on
+    CUDA.
+
     Parameters
     ----------
-    u : numpy.ndarray
+    u : numpy.ndarray or DeviceGrid
         Voxel model to project.
     tpb : int, optional
         CUDA threads per block.
@@ -152,21 +322,19 @@ def projection(u, tpb=8):
     """
     TPBY, TPBZ = tpb, tpb
     m, n, p = u.shape
-    minX = -1
-    i = 0
-    while minX<0:
-        if np.amin(u[i,:,:])<0:
-            minX = i
-        else:
-            i += 1
-    X = m-1
-    d_u = cuda.to_device(u)
+    layers = np.flatnonzero(solidProfiles(u, tpb)[0])
+    if layers.size == 0:
+        return result(download(u, copy=True), u)
+    minX = int(layers[0])
+    if not use_cuda():
+        h_u = download(u, copy=True)
+        projectionKernelCPU(h_u, minX)
+        return result(h_u, u)
+    d_u = onDevice(u, copy=True)
     gridDims = (n + TPBY - 1) // TPBY, (p + TPBZ - 1) // TPBZ
     blockDims = TPBY, TPBZ
-    while X>minX:
-        X -= 1
-        projectionKernel[gridDims, blockDims](d_u,X)
-    return d_u.copy_to_host()
+    projectionKernel[gridDims, blockDims](d_u,minX)
+    return result(d_u, u)
 
 @cuda.jit
 def translateKernel(d_u,d_v,x,y,z):
@@ -175,13 +343,21 @@ def translateKernel(d_u,d_v,x,y,z):
     if i >= m or j >= n or k >= p:
         return
     d_v[i,j,k] = d_u[(i-x)%m,(j-y)%n,(k-z)%p]
+
+@njit(parallel=True, cache=True)
+def translateKernelCPU(u, v, x, y, z):
+    m, n, p = u.shape
+    for i in prange(m):
+        for j in range(n):
+            for k in range(p):
+                v[i,j,k] = u[(i-x)%m,(j-y)%n,(k-z)%p]
     
 def translate(u, x, y, z, tpb=8):
     """Translate ``u`` by integer offsets ``x``, ``y``, ``z``.
 
     Parameters
     ----------
-    u : numpy.ndarray
+    u : numpy.ndarray or DeviceGrid
         Voxel grid to translate.
     x, y, z : int
         Translation in voxels.
@@ -193,35 +369,100 @@ def translate(u, x, y, z, tpb=8):
     numpy.ndarray
         Translated voxel grid.
     """
-    d_u = cuda.to_device(u)
+    if not use_cuda():
+        h_v = np.empty(u.shape, dtype=np.float32)
+        translateKernelCPU(download(u), h_v, x, y, z)
+        return result(h_v, u)
+    d_u = onDevice(u)
     d_v = cuda.device_array(shape=u.shape, dtype=np.float32)
     dims = u.shape
     gridSize = [(dims[0] + tpb - 1) // tpb, (dims[1] + tpb - 1) // tpb, (dims[2] + tpb - 1) // tpb]
     blockSize = [tpb, tpb, tpb]
     translateKernel[gridSize, blockSize](d_u, d_v, x, y, z)
-    return d_v.copy_to_host()
+    return result(d_v, u)
+
+@cuda.jit
+def affineKernel(d_u,d_v,a,b):
+    i,j,k = cuda.grid(3)
+    m,n,p = d_u.shape
+    if i < m and j < n and k < p:
+        d_v[i,j,k] = a*d_u[i,j,k]-b
+
+def affine(u, a, b, tpb=8, out=None):
+    """Return ``a*u - b`` for a :class:`DeviceGrid` ``u`` where it lives."""
+    if not u.onDevice:
+        return result(affineHost(download(u), a, b, target(out, u, False)), u, out)
+    d_u = onDevice(u)
+    dims = u.shape
+    d_v = target(out, u, True)
+    if d_v is None:
+        d_v = cuda.device_array_like(d_u)
+    gridSize = [(dims[0] + tpb - 1) // tpb, (dims[1] + tpb - 1) // tpb, (dims[2] + tpb - 1) // tpb]
+    affineKernel[gridSize, [tpb, tpb, tpb]](d_u, d_v, a, b)
+    return result(d_v, u, out)
+
+def affineHost(u, a, b, out=None):
+    #a*u - b in the dtype of u, scalars do not widen float32 grids.
+    scalar = u.dtype.type if np.issubdtype(u.dtype, np.floating) else np.float32
+    out = np.multiply(u, scalar(a), out=out)
+    return np.subtract(out, scalar(b), out=out)
 
-def thicken(u, weight):
-    """Offset a signed distance field by ``weight`` voxels."""
-    return u - np.ones(u.shape) * weight
+def thicken(u, weight, tpb=8, out=None):
+    """Offset a signed distance field by ``weight`` voxels.
+
+    ``out`` is an optional ``float32`` grid of ``u.shape`` receiving the
+    result, it may be ``u``.
+    """
+    if isHandle(u):
+        return affine(u, 1, weight, tpb, out)
+    return result(affineHost(download(u), 1, weight, target(out, u, False)), out)
     
-def shell(uSDF, sT, tpb=8):
-    """Return a shell of ``uSDF`` with thickness ``sT``."""
-    return intersection(uSDF, -uSDF - np.ones(uSDF.shape) * sT, tpb)
+def shell(uSDF, sT, tpb=8, out=None):
+    """Return a shell of ``uSDF`` with thickness ``sT``.
+
+    ``out`` is an optional ``float32`` grid of ``uSDF.shape`` receiving the
+    result, it must not be ``uSDF``.
+    """
+    if isHandle(uSDF):
+        return intersection(affine(uSDF, -1, sT, tpb, out), uSDF, tpb, out)
+    return intersection(affineHost(download(uSDF), -1, sT, target(out, uSDF, False)), uSDF, tpb, out)
 
 @cuda.jit
 def condenseKernel(d_u,d_uCondensed,buffer,minX,minY,minZ):
     i,j,k = cuda.grid(3)
     m,n,p = d_uCondensed.shape
     if i < m and j < n and k < p:
-        d_uCondensed[i,j,k] = d_u[i+minX-buffer,j+minY-buffer,k+minZ-buffer]
-    
+        dims = d_u.shape
+        a = min(max(i+minX-buffer, 0), dims[0]-1)
+        b = min(max(j+minY-buffer, 0), dims[1]-1)
+        c = min(max(k+minZ-buffer, 0), dims[2]-1)
+        d_uCondensed[i,j,k] = d_u[a,b,c]
+
+@njit(parallel=True, cache=True)
+def condenseKernelCPU(u, uCondensed, buffer, minX, minY, minZ):
+    #Reads falling outside ``u`` (possible once the size is rounded up to a
+    #multiple of tpb) are clamped to the nearest edge voxel.
+    m, n, p = u.shape
+    xSize, ySize, zSize = uCondensed.shape
+    for i in prange(xSize):
+        a = min(max(i+minX-buffer, 0), m-1)
+        for j in range(ySize):
+            b = min(max(j+minY-buffer, 0), n-1)
+            for k in range(zSize):
+                c = min(max(k+minZ-buffer, 0), p-1)
+                uCondensed[i,j,k] = u[a,b,c]
+
 def condense(u, buffer, tpb=8):
     """Crop empty space around ``u`` leaving ``buffer`` voxels.
 
+    The bounds come from :func:`solidProfiles`.  The crop size is rounded
+    up to a multiple of ``tpb``; when that box lies inside a ``float32``
+    host grid the crop is returned as a view of it, otherwise a copy is
+    made with the out of range voxels clamped to the nearest edge.
+
     Parameters
     ----------
-    u : numpy.ndarray
+    u : numpy.ndarray or DeviceGrid
         Input voxel grid.
     buffer : int
         Number of empty layers to retain around geometry.
@@ -232,39 +473,40 @@ def condense(u, buffer, tpb=8):
     -------
     numpy.ndarray
         Condensed voxel grid.
+
+    Raises
+    ------
+    ValueError
+        If ``u`` holds no solid voxel.
     """
-    m, n, p = u.shape
     TPBX, TPBY, TPBZ = tpb, tpb, tpb
-    minX, maxX, minY, maxY, minZ, maxZ = -1,-1,-1,-1,-1,-1
-    i, j, k = 0, 0, 0
-    while minX<0:
-        if np.amin(u[i,:,:])<0:     minX = i
-        else:                       i += 1
-    while minY<0:
-        if np.amin(u[:,j,:])<0:     minY = j
-        else:                       j += 1
-    while minZ<0:
-        if np.amin(u[:,:,k])<0:     minZ = k
-        else:                       k += 1
-    i, j, k = 1, 1, 1
-    while maxX<0:
-        if np.amin(u[m-i,:,:])<0:   maxX = m-i
-        else:                       i += 1
-    while maxY<0:
-        if np.amin(u[:,n-j,:])<0:   maxY = n-j
-        else:                       j += 1
-    while maxZ<0:
-        if np.amin(u[:,:,p-k])<0:   maxZ = p-k
-        else:                       k += 1
+    bounds = []
+    for flags in solidProfiles(u, tpb):
+        solid = np.flatnonzero(flags)
+        if solid.size == 0:
+            raise ValueError("Cannot condense a grid without solid voxels")
+        bounds.append((int(solid[0]), int(solid[-1])))
+    (minX, maxX), (minY, maxY), (minZ, maxZ) = bounds
     xSize = (np.ceil((2 * buffer + maxX - minX) / tpb) * tpb).astype(int)
     ySize = (np.ceil((2 * buffer + maxY - minY) / tpb) * tpb).astype(int)
     zSize = (np.ceil((2 * buffer + maxZ - minZ) / tpb) * tpb).astype(int)
-    d_u = cuda.to_device(u)
+    starts = (minX - buffer, minY - buffer, minZ - buffer)
+    inside = all(start >= 0 and start + size <= dim for start, size, dim in zip(starts, (xSize, ySize, zSize), u.shape))
+    onGPU = isHandle(u) and u.onDevice
+    if inside and not onGPU and u.dtype == np.float32:
+        crop = tuple(slice(start, start + size) for start, size in zip(starts, (xSize, ySize, zSize)))
+        return result(download(u)[crop], u)
+    if not use_cuda():
+        h_u = download(u)
+        h_uCondensed = np.empty((xSize, ySize, zSize), dtype=np.float32)
+        condenseKernelCPU(h_u, h_uCondensed, buffer, minX, minY, minZ)
+        return result(h_uCondensed, u)
+    d_u = onDevice(u)
     d_uCondensed = cuda.device_array(shape = [xSize, ySize, zSize], dtype = np.float32)
     gridDims = (xSize + TPBX - 1) // TPBX, (ySize + TPBY - 1) // TPBY, (zSize + TPBZ - 1) // TPBZ
     blockDims = TPBX, TPBY, TPBZ
     condenseKernel[gridDims, blockDims](d_u, d_uCondensed, buffer, minX, minY, minZ)
-    return d_uCondensed.copy_to_host()
+    return result(d_uCondensed, u)
 
 @cuda.jit
 def heartKernel(d_u, d_x, d_y, d_z,cx,cy,cz):
@@ -276,6 +518,17 @@ def heartKernel(d_u, d_x, d_y, d_z,cx,cy,cz):
         z = d_z[k]-cz
         d_u[i,j,k] = (x**2+9*(y**2)/4+z**2-1)**3-(x**2)*(z**3)-9*(y**2)*(z**3)/80
         
+@njit(parallel=True, cache=True)
+def heartKernelCPU(u, xs, ys, zs, cx, cy, cz):
+    m, n, p = u.shape
+    for i in prange(m):
+        x = xs[i]-cx
+        for j in range(n):
+            y = ys[j]-cy
+            for k in range(p):
+                z = zs[k]-cz
+                u[i,j,k] = (x**2+9*(y**2)/4+z**2-1)**3-(x**2)*(z**3)-9*(y**2)*(z**3)/80
+
 def heart(x, y, z, cx, cy, cz, tpb=8):
     """Generate a heart shaped SDF over ``x``, ``y`` and ``z`` grids.
 
@@ -297,6 +550,10 @@ def heart(x, y, z, cx, cy, cz, tpb=8):
     m = x.shape[0]
     n = y.shape[0]
     p = z.shape[0]
+    if not use_cuda():
+        h_u = np.empty((m, n, p), dtype=np.float32)
+        heartKernelCPU(h_u, x, y, z, cx, cy, cz)
+        return h_u
     d_x = cuda.to_device(x)
     d_y = cuda.to_device(y)
     d_z = cuda.to_device(z)
@@ -316,6 +573,17 @@ def eggKernel(d_u, d_x, d_y, d_z,cx,cy,cz):
         z = d_z[k]-cz
         d_u[i,j,k] = 9*x**2+16*(y**2+z**2)+2*x*(y**2+z**2)+(y**2+z**2)-144
         
+@njit(parallel=True, cache=True)
+def eggKernelCPU(u, xs, ys, zs, cx, cy, cz):
+    m, n, p = u.shape
+    for i in prange(m):
+        x = xs[i]-cx
+        for j in range(n):
+            y = ys[j]-cy
+            for k in range(p):
+                z = zs[k]-cz
+                u[i,j,k] = 9*x**2+16*(y**2+z**2)+2*x*(y**2+z**2)+(y**2+z**2)-144
+
 def egg(x, y, z, cx, cy, cz, tpb=8):
     """Generate an egg shaped SDF.
 
@@ -337,6 +605,10 @@ def egg(x, y, z, cx, cy, cz, tpb=8):
     m = x.shape[0]
     n = y.shape[0]
     p = z.shape[0]
+    if not use_cuda():
+        h_u = np.empty((m, n, p), dtype=np.float32)
+        eggKernelCPU(h_u, x, y, z, cx, cy, cz)
+        return h_u
     d_x = cuda.to_device(x)
     d_y = cuda.to_device(y)
     d_z = cuda.to_device(z)
@@ -356,6 +628,17 @@ def rectKernel(d_u, d_x, d_y, d_z, xl, yl, zl, origin):
         sz = abs(d_z[k]-origin[2]) - zl/2
         d_u[i,j,k]=max(sx,sy,sz)
         
+@njit(parallel=True, cache=True)
+def rectKernelCPU(u, xs, ys, zs, xl, yl, zl, origin):
+    m, n, p = u.shape
+    for i in prange(m):
+        sx = abs(xs[i]-origin[0]) - xl/2
+        for j in range(n):
+            sy = abs(ys[j]-origin[1]) - yl/2
+            for k in range(p):
+                sz = abs(zs[k]-origin[2]) - zl/2
+                u[i,j,k]=max(sx,sy,sz)
+
 def rect(x, y, z, xl, yl, zl, origin=(0, 0, 0), tpb=8):
     """Axis-aligned rectangular prism SDF.
 
@@ -379,6 +662,10 @@ def rect(x, y, z, xl, yl, zl, origin=(0, 0, 0), tpb=8):
     m = x.shape[0]
     n = y.shape[0]
     p = z.shape[0]
+    if not use_cuda():
+        h_u = np.empty((m, n, p), dtype=np.float32)
+        rectKernelCPU(h_u, x, y, z, xl, yl, zl, np.asarray(origin, dtype=np.float64))
+        return h_u
     d_x = cuda.to_device(x)
     d_y = cuda.to_device(y)
     d_z = cuda.to_device(z)
@@ -396,6 +683,14 @@ def sphereKernel(d_u, d_x, d_y, d_z, rad):
     if i < m and j < n and k < p:
         d_u[i,j, k] = math.sqrt(d_x[i]**2+d_y[j]**2+d_z[k]**2)-rad
         
+@njit(parallel=True, cache=True)
+def sphereKernelCPU(u, xs, ys, zs, rad):
+    m, n, p = u.shape
+    for i in prange(m):
+        for j in range(n):
+            for k in range(p):
+                u[i,j,k] = math.sqrt(xs[i]**2+ys[j]**2+zs[k]**2)-rad
+
 def sphere(x, y, z, rad, tpb=8):
     """Generate a sphere SDF.
 
@@ -417,6 +712,10 @@ def sphere(x, y, z, rad, tpb=8):
     m = x.shape[0]
     n = y.shape[0]
     p = z.shape[0]
+    if not use_cuda():
+        h_u = np.empty((m, n, p), dtype=np.float32)
+        sphereKernelCPU(h_u, x, y, z, rad)
+        return h_u
     d_x = cuda.to_device(x)
     d_y = cuda.to_device(y)
     d_z = cuda.to_device(z)
@@ -435,6 +734,16 @@ def cylinderXKernel(d_u, d_x, d_y, d_z, start, stop, rad):
         width = math.sqrt(d_y[j]**2+d_z[k]**2)-rad
         d_u[i,j,k] = max(height,width)
 
+@njit(parallel=True, cache=True)
+def cylinderXKernelCPU(u, xs, ys, zs, start, stop, rad):
+    m, n, p = u.shape
+    for i in prange(m):
+        height = (xs[i]-start)*(xs[i]-stop)
+        for j in range(n):
+            for k in range(p):
+                width = math.sqrt(ys[j]**2+zs[k]**2)-rad
+                u[i,j,k] = max(height,width)
+
 def cylinderX(x, y, z, start, stop, rad, tpb=8):
     """Generate a cylinder aligned to the X axis.
 
@@ -458,6 +767,10 @@ def cylinderX(x, y, z, start, stop, rad, tpb=8):
     m = x.shape[0]
     n = y.shape[0]
     p = z.shape[0]
+    if not use_cuda():
+        h_u = np.empty((m, n, p), dtype=np.float32)
+        cylinderXKernelCPU(h_u, x, y, z, start, stop, rad)
+        return h_u
     d_x = cuda.to_device(x)
     d_y = cuda.to_device(y)
     d_z = cuda.to_device(z)
@@ -476,6 +789,16 @@ def cylinderYKernel(d_u, d_x, d_y, d_z, start, stop, rad):
         width = math.sqrt(d_x[i]**2+d_z[k]**2)-rad
         d_u[i,j,k] = max(height,width)
 
+@njit(parallel=True, cache=True)
+def cylinderYKernelCPU(u, xs, ys, zs, start, stop, rad):
+    m, n, p = u.shape
+    for i in prange(m):
+        for j in range(n):
+            height = (ys[j]-start)*(ys[j]-stop)
+            for k in range(p):
+                width = math.sqrt(xs[i]**2+zs[k]**2)-rad
+                u[i,j,k] = max(height,width)
+
 def cylinderY(x, y, z, start, stop, rad, tpb=8):
     """Generate a cylinder aligned to the Y axis.
 
@@ -499,6 +822,10 @@ def cylinderY(x, y, z, start, stop, rad, tpb=8):
     m = x.shape[0]
     n = y.shape[0]
     p = z.shape[0]
+    if not use_cuda():
+        h_u = np.empty((m, n, p), dtype=np.float32)
+        cylinderYKernelCPU(h_u, x, y, z, start, stop, rad)
+        return h_u
     d_x = cuda.to_device(x)
     d_y = cuda.to_device(y)
     d_z = cuda.to_device(z)
@@ -1,6 +1,8 @@
-from numba import cuda
+from numba import cuda, njit, prange
 import math
 import numpy as np
+from .backend import use_cuda
+from .device import DeviceGrid, download, onDevice, result, upload
 
 @cuda.jit(device = True)
 def norm(i,j,k,m,n,p,order):
@@ -14,9 +16,9 @@ def distance(i,j,k,m,n,p):
 def JFKernel(d_pr,d_pw,stepSize):
     i,j,k = cuda.grid(3)
     dims = d_pr.shape
-    m,n,p,d = d_pr[i,j,k]
     if i>=dims[0] or j>=dims[1] or k>=dims[2]:
         return
+    m,n,p,d = d_pr[i,j,k]
     for index in range(27):
         checkPos = (i+((index//9)%3-1)*stepSize,
                     j+((index//3)%3-1)*stepSize,
@@ -33,9 +35,9 @@ def JFKernel(d_pr,d_pw,stepSize):
 def JFKernelNorm(d_pr,d_pw,stepSize,order):
     i,j,k = cuda.grid(3)
     dims = d_pr.shape
-    m,n,p,d = d_pr[i,j,k]
     if i>=dims[0] or j>=dims[1] or k>=dims[2]:
         return
+    m,n,p,d = d_pr[i,j,k]
     for index in range(27):
         checkPos = (i+((index//9)%3-1)*stepSize,
                     j+((index//3)%3-1)*stepSize,
@@ -48,39 +50,159 @@ def JFKernelNorm(d_pr,d_pw,stepSize,order):
     d_pw[i,j,k,:] = m,n,p,np.float32(d)
     
 @cuda.jit
-def JFSetupKernel(d_u,d_p):
+def JFSetupKernel(d_u,d_p,sign):
     i,j,k = cuda.grid(3)
     dims = d_u.shape
     if i>=dims[0] or j>=dims[1] or k>=dims[2]:
         return
-    if d_u[i,j,k]<=0.0:
+    if sign*d_u[i,j,k]<=0.0:
         d_p[i,j,k,:]=float(i),float(j),float(k),0.0
 
-def jumpFlood(u, norm, tpb=8):
+@njit(parallel=True, cache=True)
+def JFKernelCPU(pr, pw, stepSize, order):
+    #Mirrors JFKernel/JFKernelNorm, including their skip of index 0 probes.
+    dims = pr.shape
+    for i in prange(dims[0]):
+        for j in range(dims[1]):
+            for k in range(dims[2]):
+                m = pr[i,j,k,0]
+                n = pr[i,j,k,1]
+                p = pr[i,j,k,2]
+                d = np.float64(pr[i,j,k,3])
+                for index in range(27):
+                    a = i+((index//9)%3-1)*stepSize
+                    b = j+((index//3)%3-1)*stepSize
+                    c = k+(index%3-1)*stepSize
+                    if a<dims[0] and b<dims[1] and c<dims[2] and min(a,b,c)>0:
+                        m1 = pr[a,b,c,0]
+                        n1 = pr[a,b,c,1]
+                        p1 = pr[a,b,c,2]
+                        if order == 2.0:
+                            d1 = math.sqrt((i-m1)*(i-m1)+(j-n1)*(j-n1)+(k-p1)*(k-p1))
+                        else:
+                            d1 = (abs((i-m1)**order)+abs((j-n1)**order)+abs((k-p1)**order))**(1/order)
+                        if d1<d:
+                            m,n,p,d = m1,n1,p1,d1
+                pw[i,j,k,0] = m
+                pw[i,j,k,1] = n
+                pw[i,j,k,2] = p
+                pw[i,j,k,3] = d
+
+@njit(parallel=True, cache=True)
+def JFSetupKernelCPU(u, pr, sign):
+    dims = u.shape
+    for i in prange(dims[0]):
+        for j in range(dims[1]):
+            for k in range(dims[2]):
+                if sign*u[i,j,k]<=0.0:
+                    pr[i,j,k,0] = i
+                    pr[i,j,k,1] = j
+                    pr[i,j,k,2] = k
+                    pr[i,j,k,3] = 0.0
+
+@cuda.jit
+def JFSetupPointsKernel(d_points,d_p):
+    index = cuda.grid(1)
+    if index>=d_points.shape[0]:
+        return
+    i,j,k = d_points[index,0],d_points[index,1],d_points[index,2]
+    d_p[i,j,k,0] = i
+    d_p[i,j,k,1] = j
+    d_p[i,j,k,2] = k
+    d_p[i,j,k,3] = 0.0
+
+@njit(parallel=True, cache=True)
+def JFSetupPointsKernelCPU(points, pr):
+    for index in prange(points.shape[0]):
+        i = points[index,0]
+        j = points[index,1]
+        k = points[index,2]
+        pr[i,j,k,0] = i
+        pr[i,j,k,1] = j
+        pr[i,j,k,2] = k
+        pr[i,j,k,3] = 0.0
+
+def jumpFlood(u, norm, tpb=8, sign=1):
     """Compute nearest seed distances using jump flooding.
 
     Parameters
     ----------
-    u : numpy.ndarray
+    u : numpy.ndarray or DeviceGrid
         Binary voxel model with seeds marked as negatives.
     norm : float
         Norm order for distance calculation.
     tpb : int, optional
         CUDA threads per block.
+    sign : int, optional
+        ``-1`` floods from the non-negative voxels instead, like passing
+        ``-u`` without the negated copy.
 
     Returns
     -------
-    numpy.ndarray
-        Jump flood result ``(x, y, z, dist)`` for each cell.
+    numpy.ndarray or DeviceGrid
+        Jump flood result ``(x, y, z, dist)`` for each cell, a handle when
+        ``u`` is one.
     """
     dims = u.shape
     gridSize = [(dims[0] + tpb - 1) // tpb, (dims[1] + tpb - 1) // tpb, (dims[2] + tpb - 1) // tpb]
     blockSize = [tpb, tpb, tpb]
+    if not use_cuda():
+        h_r = np.full([dims[0],dims[1],dims[2],4], 1000, np.float32)
+        JFSetupKernelCPU(download(u), h_r, sign)
+        return result(floodPasses(h_r, norm, tpb), u)
     d_r = cuda.to_device(1000*np.ones([dims[0],dims[1],dims[2],4],np.float32))
-    d_w = cuda.to_device(1000*np.ones([dims[0],dims[1],dims[2],4],np.float32))
-    d_u = cuda.to_device(u)
-    JFSetupKernel[gridSize, blockSize](d_u,d_r)
-    n = int(round(np.log2(max(dims)-1)+0.5))
+    JFSetupKernel[gridSize, blockSize](onDevice(u),d_r,sign)
+    return result(floodPasses(d_r, norm, tpb), u)
+
+def jumpFloodPoints(points, shape, norm, tpb=8):
+    """Jump flood from an ``(n, 3)`` array of seed indices.
+
+    Same result as :func:`jumpFlood` on a grid of ``shape`` with the seeds
+    marked, without building that grid.
+
+    Parameters
+    ----------
+    points : numpy.ndarray
+        Integer seed indices, e.g. from :func:`pointGen.poissonPoints`.
+    shape : tuple
+        Shape of the grid to flood.
+    norm : float
+        Norm order for distance calculation.
+    tpb : int, optional
+        CUDA threads per block.
+
+    Returns
+    -------
+    numpy.ndarray
+        Jump flood result ``(x, y, z, dist)`` for each cell.
+    """
+    points = np.ascontiguousarray(points, dtype=np.int32)
+    if not use_cuda():
+        h_r = np.full([shape[0],shape[1],shape[2],4], 1000, np.float32)
+        JFSetupPointsKernelCPU(points, h_r)
+        return floodPasses(h_r, norm, tpb)
+    d_r = cuda.to_device(1000*np.ones([shape[0],shape[1],shape[2],4],np.float32))
+    if len(points):
+        threads = tpb*tpb
+        JFSetupPointsKernel[(len(points)+threads-1)//threads, threads](cuda.to_device(points), d_r)
+    return download(floodPasses(d_r, norm, tpb))
+
+def floodPasses(d_r, norm, tpb=8):
+    #Runs the jump flood passes on a set up (x, y, z, dist) buffer, a host
+    #array on the CPU backend or a device array on CUDA, which stays there.
+    dims = d_r.shape
+    n = int(round(np.log2(max(dims[:3])-1)+0.5))
+    if not use_cuda():
+        h_r = d_r
+        h_w = np.full(dims, 1000, np.float32)
+        steps = [2**(n-count-1) for count in range(n)] + [2, 1]
+        for stepSize in steps:
+            JFKernelCPU(h_r, h_w, stepSize, float(norm))
+            h_r, h_w = h_w, h_r
+        return h_r
+    gridSize = [(dims[0] + tpb - 1) // tpb, (dims[1] + tpb - 1) // tpb, (dims[2] + tpb - 1) // tpb]
+    blockSize = [tpb, tpb, tpb]
+    d_w = cuda.to_device(1000*np.ones(dims,np.float32))
     if norm==2.0:
         for count in range(n):
             stepSize = 2**(n-count-1)
@@ -99,7 +221,7 @@ def jumpFlood(u, norm, tpb=8):
             stepSize = 2-count
             JFKernelNorm[gridSize, blockSize](d_r,d_w,stepSize,norm)
             d_r,d_w = d_w,d_r
-    return d_r.copy_to_host()
+    return d_r
 
 @cuda.jit
 def toSDF(JFpos,JFneg,d_u):
@@ -114,31 +236,186 @@ def toSDF(JFpos,JFneg,d_u):
     else:
         d_u[i,j,k]=-dn
 
-def SDF3D(u, norm=2.0, tpb=8):
-    """Convert a binary volume ``u`` to a signed distance field.
+@njit(parallel=True, cache=True)
+def toSDFCPU(JFpos, JFneg, u):
+    dims = u.shape
+    for i in prange(dims[0]):
+        for j in range(dims[1]):
+            for k in range(dims[2]):
+                dp = JFpos[i,j,k,3]
+                if dp>0:
+                    u[i,j,k]=dp
+                else:
+                    u[i,j,k]=-JFneg[i,j,k,3]
+
+@njit(cache=True)
+def EDTRow(f, d, v, z):
+    #Felzenszwalb & Huttenlocher lower envelope of the parabolas rooted at
+    #the finite samples of f, written into d.  v and z are scratch buffers.
+    n = f.shape[0]
+    k = -1
+    for q in range(n):
+        if f[q] == np.inf:
+            continue
+        if k < 0:
+            k = 0
+            v[0] = q
+            z[0] = -np.inf
+            z[1] = np.inf
+            continue
+        s = ((f[q]+q*q)-(f[v[k]]+v[k]*v[k]))/(2*q-2*v[k])
+        while s <= z[k]:
+            k -= 1
+            s = ((f[q]+q*q)-(f[v[k]]+v[k]*v[k]))/(2*q-2*v[k])
+        k += 1
+        v[k] = q
+        z[k] = s
+        z[k+1] = np.inf
+    if k < 0:
+        d[:] = np.inf
+        return
+    k = 0
+    for q in range(n):
+        while z[k+1] < q:
+            k += 1
+        d[q] = (q-v[k])*(q-v[k])+f[v[k]]
+
+@njit(parallel=True, cache=True)
+def EDTSetupCPU(u, d, sign):
+    dims = u.shape
+    for i in prange(dims[0]):
+        for j in range(dims[1]):
+            for k in range(dims[2]):
+                if sign*u[i,j,k]<=0:
+                    d[i,j,k] = 0
+                else:
+                    d[i,j,k] = np.inf
+
+@njit(parallel=True, cache=True)
+def EDTPassCPU(d, axis):
+    #One 1-D transform per row of d along axis, rows run in parallel.
+    dims = d.shape
+    n = dims[axis]
+    outer = dims[0] if axis != 0 else dims[1]
+    inner = dims[2] if axis != 2 else dims[1]
+    for a in prange(outer):
+        f = np.empty(n, np.float64)
+        v = np.empty(n, np.int64)
+        z = np.empty(n+1, np.float64)
+        for b in range(inner):
+            if axis == 0:
+                row = d[:,a,b]
+            elif axis == 1:
+                row = d[a,:,b]
+            else:
+                row = d[a,b,:]
+            for q in range(n):
+                f[q] = row[q]
+            EDTRow(f, row, v, z)
+
+@njit(parallel=True, cache=True)
+def EDTToSDFCPU(u, d, out, sign):
+    #Writes sign*sqrt(d) into out wherever sign*u is positive.  Grids without
+    #any seed keep the 1000 that an unreached jump flood cell reports.
+    dims = u.shape
+    for i in prange(dims[0]):
+        for j in range(dims[1]):
+            for k in range(dims[2]):
+                if sign*u[i,j,k]>0 or (sign<0 and u[i,j,k]==0):
+                    if d[i,j,k] == np.inf:
+                        out[i,j,k] = sign*1000.0
+                    else:
+                        out[i,j,k] = sign*math.sqrt(d[i,j,k])
+
+def squaredEDT(u, sign=1, out=None):
+    """Exact squared Euclidean distance to the nearest voxel with ``sign*u<=0``.
+
+    Runs the separable linear-time transform of Felzenszwalb and
+    Huttenlocher along X, Y and Z in turn, processing rows in parallel.
 
     Parameters
     ----------
     u : numpy.ndarray
         Input voxel grid.
+    sign : int, optional
+        ``1`` measures the distance to the inside of ``u``, ``-1`` to the
+        outside.
+    out : numpy.ndarray, optional
+        ``float32`` array of ``u.shape`` receiving the result.
+
+    Returns
+    -------
+    numpy.ndarray
+        ``float32`` squared distances in voxels.
+    """
+    if out is None:
+        out = np.empty(u.shape, dtype=np.float32)
+    EDTSetupCPU(u, out, sign)
+    for axis in (2, 1, 0):
+        EDTPassCPU(out, axis)
+    return out
+
+def EDTSDF(u, out=None):
+    """Exact Euclidean signed distance field of ``u``.
+
+    Produces the field :func:`SDF3D` builds by jump flooding using one
+    ``float32`` scratch grid instead of four ``(X, Y, Z, 4)`` buffers.
+    ``out`` may be ``u``: the first pass keeps the signs the second one
+    reads.
+    """
+    host = download(u)
+    h_u = download(u, copy=True, out=out)
+    d = squaredEDT(host, 1)
+    EDTToSDFCPU(host, d, h_u, 1)
+    squaredEDT(host, -1, out=d)
+    EDTToSDFCPU(host, d, h_u, -1)
+    return result(h_u, u, out)
+
+SDF_METHODS = ("jfa", "edt")
+
+def SDF3D(u, norm=2.0, tpb=8, method="jfa", out=None):
+    """Convert a binary volume ``u`` to a signed distance field.
+
+    Parameters
+    ----------
+    u : numpy.ndarray or DeviceGrid
+        Input voxel grid.
     norm : float, optional
         Distance norm order.
     tpb : int, optional
         CUDA threads per block.
+    method : str, optional
+        ``"jfa"`` for the approximate jump flood or ``"edt"`` for the exact
+        Euclidean distance transform.  The EDT only supports ``norm=2`` and
+        always runs on the CPU.
+    out : numpy.ndarray or DeviceGrid, optional
+        ``float32`` grid of ``u.shape`` receiving the result, it may be
+        ``u``.
 
     Returns
     -------
-    numpy.ndarray
-        Signed distance field of ``u``.
+    numpy.ndarray or DeviceGrid
+        Signed distance field of ``u``, a handle when ``u`` is one.
     """
+    if method not in SDF_METHODS:
+        raise ValueError("Unknown SDF method '%s', expected one of %s" % (method, ", ".join(SDF_METHODS)))
+    if method == "edt":
+        if norm != 2.0:
+            raise ValueError("The exact distance transform only supports norm=2.")
+        return EDTSDF(u, out)
+    if not use_cuda():
+        h_u = download(u, copy=True, out=out)
+        toSDFCPU(jumpFlood(h_u, norm, tpb), jumpFlood(h_u, norm, tpb, -1), h_u)
+        return result(h_u, u, out)
     dims = u.shape
     gridSize = [(dims[0] + tpb - 1) // tpb, (dims[1] + tpb - 1) // tpb, (dims[2] + tpb - 1) // tpb]
     blockSize = [tpb, tpb, tpb]
-    d_p = cuda.to_device(jumpFlood(u, norm, tpb))
-    d_n = cuda.to_device(jumpFlood(-u, norm, tpb))
-    d_u = cuda.to_device(u)
+    #Both floods stay on the device instead of a round trip each.
+    d_u = onDevice(u, copy=True, out=out)
+    d_p = jumpFlood(DeviceGrid(d_u), norm, tpb).data
+    d_n = jumpFlood(DeviceGrid(d_u), norm, tpb, -1).data
     toSDF[gridSize, blockSize](d_p,d_n,d_u)
-    return d_u.copy_to_host()
+    return result(d_u, u, out)
 
 @cuda.jit
 def simplifyKernel(d_u,d_v):
@@ -162,29 +439,75 @@ def simplifyKernel(d_u,d_v):
     else:
         d_v[i,j,k]=.01
 
+@njit(parallel=True, cache=True)
+def simplifyKernelCPU(u, v):
+    #Neighbours outside the grid are skipped instead of read out of bounds.
+    dims = u.shape
+    for i in prange(dims[0]):
+        for j in range(dims[1]):
+            for k in range(dims[2]):
+                if u[i,j,k]>0:
+                    v[i,j,k]=.01
+                    continue
+                pos = 0
+                neg = 0
+                v[i,j,k]=-.01
+                for index in range(27):
+                    a = i+((index//9)%3-1)
+                    b = j+((index//3)%3-1)
+                    c = k+(index%3-1)
+                    if index==13 or a<0 or b<0 or c<0 or a>=dims[0] or b>=dims[1] or c>=dims[2]:
+                        continue
+                    if u[a,b,c]>0:
+                        pos=1
+                    if u[a,b,c]<0:
+                        neg=1
+                    if pos+neg==2:
+                        v[i,j,k]=0
+                        break
+
 def simplify(u, tpb=8):
     """Remove thin layers from ``u`` for faster distance computations."""
-    d_u = cuda.to_device(u)
+    if not use_cuda():
+        h_v = np.empty(u.shape, dtype=np.float32)
+        simplifyKernelCPU(download(u), h_v)
+        return result(h_v, u)
+    d_u = onDevice(u)
     dims = u.shape
     d_v = cuda.device_array(dims, dtype=np.float32)
     gridSize = [(dims[0] + tpb - 1) // tpb, (dims[1] + tpb - 1) // tpb, (dims[2] + tpb - 1) // tpb]
     blockSize = [tpb, tpb, tpb]
     simplifyKernel[gridSize, blockSize](d_u, d_v)
-    return d_v.copy_to_host()
+    return result(d_v, u)
 
 @cuda.jit
-def xHeightKernel(d_u,i):
+def xHeightKernel(d_u):
+    #One thread per (Y, Z) column scanning down from the top.
     j,k = cuda.grid(2)
     m,n,p = d_u.shape
-    if j < n and k < p and d_u[i,j,k]<=0:
-            d_u[i,j,k]=min(-1,d_u[i+1,j,k]-1)
+    if j < n and k < p:
+        for i in range(m-2, 0, -1):
+            if d_u[i,j,k]<=0:
+                d_u[i,j,k]=min(-1,d_u[i+1,j,k]-1)
+
+@njit(parallel=True, cache=True)
+def xHeightKernelCPU(u):
+    m, n, p = u.shape
+    for j in prange(n):
+        for k in range(p):
+            for i in range(m-2, 0, -1):
+                if u[i,j,k]<=0:
+                    u[i,j,k]=min(-1,u[i+1,j,k]-1)
 
 def xHeight(u, tpb=8):
     """Cumulative height of solid voxels along X.
 
+    Every column is scanned once from the top, in a single kernel launch on
+    CUDA.
+
     Parameters
     ----------
-    u : numpy.ndarray
+    u : numpy.ndarray or DeviceGrid
         Signed distance field of the model.
     tpb : int, optional
         CUDA threads per block.
@@ -194,13 +517,14 @@ def xHeight(u, tpb=8):
     numpy.ndarray
         Field where each voxel stores the height of material above it.
     """
+    if not use_cuda():
+        h_u = download(simplify(u, tpb))
+        xHeightKernelCPU(h_u)
+        return result(h_u, u)
     m, n, p = u.shape
     TPBY, TPBZ = tpb, tpb
     gridDims = (n + TPBY - 1) // TPBY, (p + TPBZ - 1) // TPBZ
     blockDims = TPBY, TPBZ
-    i = m - 2
-    d_u = cuda.to_device(simplify(u, tpb))
-    while i>0:
-        xHeightKernel[gridDims, blockDims](d_u,i)
-        i -= 1
-    return d_u.copy_to_host()
+    d_u = onDevice(simplify(upload(u), tpb))
+    xHeightKernel[gridDims, blockDims](d_u)
+    return result(d_u, u)
@@ -1,5 +1,6 @@
+from __future__ import annotations
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 from . import main
 
@@ -26,8 +27,40 @@ class PipelineConfig:
     SUPPORT_CELL: float = 0.7
     FILE_NAME: str = ""
     PRIMITIVE_TYPE: str = ""
+    BACKEND: str = "auto"
+    SDF_METHOD: str = "jfa"
+    PRECISION: str = "float32"
+    SEED_SAMPLER: str = "random"
+    SEED: int = -1
+    CELL_ENGINE: str = "jfa"
+    VOXEL_WORKERS: int = 1
+    DIRECT_SDF: bool = False
+    MESH_FORMAT: str = "ply"
+    MESH_CHUNK: int = 0
+    MESH_WORKERS: int = 1
+    NARROW_BAND: float = 0.0
+    BATCH: bool = False
+    OUTPUT_DIR: str = ""
+    CACHE_DIR: str = ""
+    CACHE_SIZE: float = 10.0
 
 
-def run_pipeline(config: PipelineConfig) -> None:
+@dataclass
+class PipelineResult:
+    """In-memory outputs of a pipeline run.
+
+    ``grids`` maps ``"origShape"``, ``"complete"``, ``"objectVoronoi"`` and
+    ``"supportVoronoi"`` to their fields, ``meshes`` maps each generated
+    model name to its ``(verts, faces)`` and ``volumes`` holds the
+    ``findVol`` results in mm^3.
+    """
+
+    grids: dict = field(default_factory=dict)
+    meshes: dict = field(default_factory=dict)
+    volumes: dict = field(default_factory=dict)
+    scale: list = field(default_factory=lambda: [1, 1, 1])
+
+
+def run_pipeline(config: PipelineConfig) -> PipelineResult | None:
     """Execute the voronizer pipeline with ``config``."""
-    main.main(config)
+    return main.main(config)
@@ -1,11 +1,15 @@
 """Helpers for analyzing voxel grids.
 
-This module provides CUDA accelerated utilities to measure the volume and
-mass of generated voxel models.  The functions are primarily used by the
+This module provides CUDA accelerated (or multi-threaded CPU, depending on
+the active :mod:`backend`) utilities to measure the volume and mass of
+generated voxel models.  The functions are primarily used by the
 voronizer pipeline but can be imported directly.
 """
 
-from numba import cuda
+from numba import cuda, njit, prange
+from .backend import use_cuda
+from .device import download, onDevice
+from .occupancy import isOccupancy
 
 
 @cuda.reduce
@@ -18,8 +22,8 @@ def findVol(u, scale, MAT_DENSITY, name, tpb=8):
 
     Parameters
     ----------
-    u : numpy.ndarray
-        Voxel model to analyse.
+    u : numpy.ndarray, DeviceGrid or Occupancy
+        Voxel model to analyse, packed occupancy is counted with a popcount.
     scale : sequence[float]
         Length of each voxel along ``x``, ``y`` and ``z`` in mm.
     MAT_DENSITY : float
@@ -35,17 +39,21 @@ def findVol(u, scale, MAT_DENSITY, name, tpb=8):
         The computed volume in ``mm^3``.
     """
     cellVol = scale[0]*scale[1]*scale[2]
-    d_u = cuda.to_device(u)
-    dims = u.shape
-    gridSize = [
-        (dims[0] + tpb - 1) // tpb,
-        (dims[1] + tpb - 1) // tpb,
-        (dims[2] + tpb - 1) // tpb,
-    ]
-    blockSize = [tpb, tpb, tpb]
-    findVolKernel[gridSize, blockSize](d_u)
-    u = d_u.copy_to_host()
-    count = sum_reduce(cuda.to_device(u.flatten()))
+    if isOccupancy(u):
+        count = u.count()
+    elif use_cuda():
+        d_u = onDevice(u, copy=True)
+        dims = u.shape
+        gridSize = [
+            (dims[0] + tpb - 1) // tpb,
+            (dims[1] + tpb - 1) // tpb,
+            (dims[2] + tpb - 1) // tpb,
+        ]
+        blockSize = [tpb, tpb, tpb]
+        findVolKernel[gridSize, blockSize](d_u)
+        count = sum_reduce(d_u.reshape(d_u.size))
+    else:
+        count = findVolKernelCPU(download(u))
     vol = cellVol*count
     print(name+" Volume = "+str(round(vol,2))+" mm^3")
     print(name+" Mass = "+str(round(MAT_DENSITY*vol/1000,2))+" g")
@@ -63,3 +71,14 @@ def findVolKernel(d_u):
     else:
         d_u[i, j, k] = 1
 
+@njit(parallel=True, cache=True)
+def findVolKernelCPU(u):
+    """Count the voxels of ``u`` that are not positive (outside)."""
+    count = 0
+    dims = u.shape
+    for i in prange(dims[0]):
+        for j in range(dims[1]):
+            for k in range(dims[2]):
+                if not u[i, j, k] > 0:
+                    count += 1
+    return count
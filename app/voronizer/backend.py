@@ -0,0 +1,63 @@
+"""Execution backend selection for the voronizer kernels.
+
+Every voronizer operation ships with a ``numba.cuda`` kernel and a
+multi-threaded CPU twin compiled with ``numba.njit(parallel=True)``.  The
+active backend is a process wide setting: ``"cuda"`` forces the GPU,
+``"cpu"`` forces the CPU kernels and ``"auto"`` (the default) uses CUDA when
+a device is present and falls back to the CPU otherwise.
+
+Typical usage::
+
+    from app.voronizer import backend
+
+    backend.set_backend("cpu")
+    backend.get_backend()  # -> "cpu"
+"""
+
+from numba import cuda
+
+BACKENDS = ("auto", "cuda", "cpu")
+
+_requested = "auto"
+_resolved = None
+
+
+def set_backend(name):
+    """Select the backend used by subsequent voronizer calls.
+
+    Parameters
+    ----------
+    name : str
+        One of ``"auto"``, ``"cuda"`` or ``"cpu"``.
+
+    Raises
+    ------
+    ValueError
+        If ``name`` is not a known backend.
+    RuntimeError
+        If ``"cuda"`` is requested but no CUDA device is available.
+    """
+    global _requested, _resolved
+    name = name.lower()
+    if name not in BACKENDS:
+        raise ValueError("Unknown backend '%s', expected one of %s" % (name, ", ".join(BACKENDS)))
+    if name == "cuda" and not cuda.is_available():
+        raise RuntimeError("The CUDA backend was requested but no CUDA device is available.")
+    _requested = name
+    _resolved = None
+
+
+def get_backend():
+    """Return the resolved backend name, either ``"cuda"`` or ``"cpu"``."""
+    global _resolved
+    if _resolved is None:
+        if _requested == "auto":
+            _resolved = "cuda" if cuda.is_available() else "cpu"
+        else:
+            _resolved = _requested
+    return _resolved
+
+
+def use_cuda():
+    """Return ``True`` when the CUDA kernels should be launched."""
+    return get_backend() == "cuda"
@@ -0,0 +1,154 @@
+"""Batch voronization of many STL files.
+
+:func:`runBatch` expands a glob pattern, a list of paths or a JSON manifest
+into one headless :func:`run_pipeline` job per file and spreads the jobs
+over a process pool.  Each job runs in a fresh spawned process, optionally
+under an address space ceiling, so one oversized model cannot take the
+whole batch down.  A ``report.json`` with per-file status, timings and
+volumes is written to the output directory.
+
+Typical usage::
+
+    from app.voronizer import PipelineConfig
+    from app.voronizer.batch import runBatch
+
+    runBatch("catalog/*.stl", "results", PipelineConfig(RESOLUTION=200), jobs=4)
+
+A manifest is a JSON list of objects holding a ``FILE_NAME`` and any
+:class:`PipelineConfig` fields to override for that file::
+
+    [{"FILE_NAME": "vase.stl", "MODEL_CELL": 1.2}, {"FILE_NAME": "cup.stl"}]
+"""
+
+from __future__ import annotations
+
+import glob
+import json
+import multiprocessing
+import os
+import time
+from dataclasses import fields, replace
+
+from . import PipelineConfig, run_pipeline
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - not available on Windows
+    resource = None
+
+
+def expandInputs(inputs):
+    """Return ``[(path, overrides), ...]`` for ``inputs``.
+
+    ``inputs`` is a glob pattern, a ``.json`` manifest or a list of paths.
+    Manifest paths are resolved relative to the manifest.
+    """
+    if isinstance(inputs, str) and inputs.endswith(".json"):
+        with open(inputs) as manifest:
+            entries = json.load(manifest)
+        root = os.path.dirname(os.path.abspath(inputs))
+        jobs = []
+        for entry in entries:
+            overrides = dict(entry)
+            path = overrides.pop("FILE_NAME")
+            jobs.append((os.path.join(root, path), overrides))
+        return jobs
+    if isinstance(inputs, str):
+        inputs = sorted(glob.glob(inputs))
+    return [(os.path.abspath(path), {}) for path in inputs]
+
+
+def parseOverrides(pairs):
+    """Convert ``["KEY=VALUE", ...]`` into typed :class:`PipelineConfig` overrides.
+
+    Raises
+    ------
+    ValueError
+        If a key is not a configuration field.
+    """
+    types = {field.name: field.type for field in fields(PipelineConfig)}
+    overrides = {}
+    for pair in pairs:
+        key, _, value = pair.partition("=")
+        key = key.strip().upper()
+        if key not in types:
+            raise ValueError("Unknown PipelineConfig field '%s'" % key)
+        kind = types[key] if isinstance(types[key], str) else types[key].__name__
+        if kind == "bool":
+            overrides[key] = value.strip().lower() in ("1", "true", "yes", "y")
+        elif kind == "int":
+            overrides[key] = int(value)
+        elif kind == "float":
+            overrides[key] = float(value)
+        else:
+            overrides[key] = value
+    return overrides
+
+
+def runBatch(inputs, outputDir, config=None, jobs=1, memoryLimit=None):
+    """Voronize every file of ``inputs`` and write a summary report.
+
+    Parameters
+    ----------
+    inputs : str or list
+        Glob pattern, JSON manifest or list of STL paths.
+    outputDir : str
+        Folder receiving one sub folder of artifacts per file and
+        ``report.json``.
+    config : PipelineConfig, optional
+        Settings shared by every job, per-file manifest entries override it.
+    jobs : int, optional
+        Number of files processed at once, ``0`` uses every core.
+    memoryLimit : float, optional
+        Address space ceiling per job in GiB.  Jobs exceeding it fail with
+        a ``MemoryError`` that is recorded in the report.
+
+    Returns
+    -------
+    list[dict]
+        One entry per file with ``file``, ``status``, ``seconds``,
+        ``volumes`` and ``error``, in input order.
+    """
+    config = config or PipelineConfig()
+    os.makedirs(outputDir, exist_ok=True)
+    tasks = []
+    for path, overrides in expandInputs(inputs):
+        name = os.path.splitext(os.path.basename(path))[0]
+        jobConfig = replace(config, **overrides)
+        jobConfig = replace(jobConfig, FILE_NAME=path, PRIMITIVE_TYPE="", BATCH=True, OUTPUT_DIR=os.path.join(outputDir, name))
+        tasks.append((jobConfig, memoryLimit))
+    if jobs == 0:
+        jobs = os.cpu_count()
+    start = time.time()
+    #A fresh spawned process per job releases its grids and keeps numba's
+    #thread pool out of forked children.
+    with multiprocessing.get_context("spawn").Pool(max(1, min(jobs, len(tasks) or 1)), maxtasksperchild=1) as pool:
+        report = pool.map(runJob, tasks, chunksize=1)
+    summary = {"seconds": round(time.time() - start, 2), "jobs": report}
+    with open(os.path.join(outputDir, "report.json"), "w") as out:
+        json.dump(summary, out, indent=2)
+    failed = sum(entry["status"] != "ok" for entry in report)
+    print("Batch complete: "+str(len(report)-failed)+" succeeded, "+str(failed)+" failed.")
+    return report
+
+
+def runJob(task):
+    """Run one pipeline job inside a pool worker and summarise it."""
+    config, memoryLimit = task
+    if memoryLimit and resource is not None:
+        limit = int(memoryLimit * 2**30)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    entry = {"file": config.FILE_NAME, "status": "ok", "seconds": 0.0, "volumes": {}, "error": ""}
+    start = time.time()
+    try:
+        if not os.path.isfile(config.FILE_NAME):
+            raise FileNotFoundError(config.FILE_NAME)
+        result = run_pipeline(config)
+        if result is None:
+            raise ValueError("The configuration was rejected by the pipeline.")
+        entry["volumes"] = {name: float(vol) for name, vol in result.volumes.items()}
+    except Exception as exc:
+        entry["status"] = "failed"
+        entry["error"] = "%s: %s" % (type(exc).__name__, exc)
+    entry["seconds"] = round(time.time() - start, 2)
+    return entry
@@ -0,0 +1,124 @@
+"""Content addressed on-disk cache for expensive pipeline stages.
+
+Stage results are stored as ``.npy`` files named after a SHA-256 of the
+stage name and every parameter that influences it, including the hash of
+the input file.  Hits are memory-mapped copy-on-write, so they load
+lazily and callers may still modify them in place without touching the
+cache.  Once the directory grows past its size budget the least recently
+used entries are deleted.
+
+Typical usage::
+
+    from app.voronizer.cache import StageCache
+
+    cache = StageCache("~/.cache/voronizer", maxBytes=20 * 2**30)
+    sdf = cache.fetch("sdf", {"file": fileHash(path), "res": 300}, compute)
+"""
+
+import hashlib
+import json
+import os
+import uuid
+
+import numpy as np
+
+from .device import download, isHandle
+
+
+def fileHash(path, blockSize=1 << 20):
+    """Return the SHA-256 hex digest of the file at ``path``."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as data:
+        for block in iter(lambda: data.read(blockSize), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class StageCache:
+    """Directory of cached stage outputs with LRU size-based eviction.
+
+    Parameters
+    ----------
+    directory : str
+        Cache folder, created when missing.
+    maxBytes : int, optional
+        Size budget of the folder, the least recently used entries are
+        evicted once it is exceeded.
+    """
+
+    def __init__(self, directory, maxBytes=10 * 2**30):
+        self.directory = os.path.expanduser(directory)
+        self.maxBytes = maxBytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, stage, params):
+        """Hash ``stage`` and the JSON encoded ``params`` into a cache key."""
+        text = json.dumps([stage, params], sort_keys=True, default=str)
+        return stage + "-" + hashlib.sha256(text.encode()).hexdigest()[:32]
+
+    def get(self, key):
+        """Return the cached arrays of ``key`` as a tuple, or ``None``."""
+        meta = os.path.join(self.directory, key + ".json")
+        try:
+            with open(meta) as entry:
+                count = json.load(entry)["count"]
+            arrays = tuple(np.load(self.path(key, index), mmap_mode="c") for index in range(count))
+        except (OSError, ValueError, KeyError):
+            return None
+        for path in [meta] + [self.path(key, index) for index in range(count)]:
+            os.utime(path)
+        return arrays
+
+    def put(self, key, arrays):
+        """Store the tuple ``arrays`` under ``key`` and evict old entries."""
+        for index, array in enumerate(arrays):
+            #Write then rename so concurrent readers never see partial files.
+            temp = os.path.join(self.directory, "." + uuid.uuid4().hex + ".npy")
+            np.save(temp, download(array, stored=True) if isHandle(array) else np.asarray(array))
+            os.replace(temp, self.path(key, index))
+        temp = os.path.join(self.directory, "." + uuid.uuid4().hex + ".json")
+        with open(temp, "w") as entry:
+            json.dump({"count": len(arrays)}, entry)
+        os.replace(temp, os.path.join(self.directory, key + ".json"))
+        self.evict()
+
+    def fetch(self, stage, params, compute):
+        """Return the cached result of ``stage`` or run ``compute`` and store it.
+
+        ``compute`` returns an array or a tuple of arrays; the same shape of
+        result is returned on a hit.
+        """
+        key = self.key(stage, params)
+        arrays = self.get(key)
+        if arrays is not None:
+            print("Loaded "+stage+" from the stage cache.")
+            return arrays if len(arrays) > 1 else arrays[0]
+        result = compute()
+        self.put(key, result if isinstance(result, tuple) else (result,))
+        return result
+
+    def path(self, key, index):
+        return os.path.join(self.directory, "%s-%d.npy" % (key, index))
+
+    def evict(self):
+        """Delete least recently used entries until the budget is met."""
+        entries = {}
+        for name in os.listdir(self.directory):
+            if name.startswith("."):
+                continue
+            key = name.rsplit(".", 1)[0]
+            if name.endswith(".npy"):
+                key = key.rsplit("-", 1)[0]
+            stat = os.stat(os.path.join(self.directory, name))
+            size, used, names = entries.get(key, (0, 0, []))
+            entries[key] = (size + stat.st_size, max(used, stat.st_mtime), names + [name])
+        total = sum(size for size, used, names in entries.values())
+        for key, (size, used, names) in sorted(entries.items(), key=lambda item: item[1][1]):
+            if total <= self.maxBytes:
+                break
+            for name in names:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+            total -= size
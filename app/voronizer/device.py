@@ -0,0 +1,246 @@
+"""Grids that stay on the active backend between voronizer calls.
+
+Every CUDA helper copies its inputs to the device and its result back, so a
+chain of helpers moves each grid over PCIe several times.  Wrapping a grid
+with :func:`upload` gives a :class:`DeviceGrid` handle instead: the
+:mod:`Frep`, :mod:`SDF3D`, :mod:`voronize`, :mod:`pointGen` and
+:mod:`analysis` functions accept it in place of an array, work on the data
+where it lives and return handles again, so nothing crosses the bus until
+:func:`download` (or ``np.asarray``) is called to plot or export.  On the
+CPU backend a handle simply wraps the numpy array.
+
+Handles also apply the storage precision chosen with :func:`set_precision`.
+Scalar fields are kept as ``float32`` by default; with ``"float16"`` every
+handle stores them at half size and :func:`download` and :func:`onDevice`
+widen them back to ``float32`` for the kernels, which always compute in
+single precision.  Seed matrices, labels and flags keep their own integer
+or bool dtypes.
+
+Typical usage::
+
+    from app.voronizer import device
+    from app.voronizer import Frep as f
+
+    u = device.upload(grid)
+    v = f.union(f.thicken(u, 1), f.translate(u, 2, 0, 0))
+    host = device.download(v)
+"""
+
+import numpy as np
+from numba import cuda
+
+from .backend import use_cuda
+
+PRECISIONS = {"float32": np.float32, "float16": np.float16}
+
+_precision = "float32"
+
+
+def set_precision(name):
+    """Select the dtype handles store scalar fields in.
+
+    Parameters
+    ----------
+    name : str
+        One of ``"float32"`` or ``"float16"``.
+
+    Raises
+    ------
+    ValueError
+        If ``name`` is not a known precision.
+    """
+    global _precision
+    name = name.lower()
+    if name not in PRECISIONS:
+        raise ValueError("Unknown precision '%s', expected one of %s" % (name, ", ".join(PRECISIONS)))
+    _precision = name
+
+
+def get_precision():
+    """Return the storage precision name, ``"float32"`` or ``"float16"``."""
+    return _precision
+
+
+@cuda.jit
+def castKernel(d_u, d_v):
+    i, j, k = cuda.grid(3)
+    m, n, p = d_u.shape
+    if i < m and j < n and k < p:
+        d_v[i,j,k] = d_u[i,j,k]
+
+
+def cast(u, dtype, tpb=8):
+    """Return the host or device grid ``u`` as ``dtype``, without a copy when it already is."""
+    if u.dtype == dtype:
+        return u
+    if not cuda.devicearray.is_cuda_ndarray(u):
+        return u.astype(dtype)
+    d_v = cuda.device_array(u.shape, dtype)
+    dims = u.shape
+    gridDims = (dims[0]+tpb-1)//tpb, (dims[1]+tpb-1)//tpb, (dims[2]+tpb-1)//tpb
+    castKernel[gridDims, (tpb, tpb, tpb)](u, d_v)
+    return d_v
+
+
+def compact(u):
+    """Return the 3-D floating grid ``u`` in the storage precision.
+
+    Other arrays, such as jump flood buffers, seed matrices and labels, are
+    returned untouched.
+    """
+    if u.ndim != 3 or not np.issubdtype(u.dtype, np.floating):
+        return u
+    return cast(u, np.dtype(PRECISIONS[_precision]))
+
+
+def widen(u):
+    """Return ``u`` as ``float32`` when it is stored as ``float16``."""
+    if u.dtype == np.float16:
+        return cast(u, np.dtype(np.float32))
+    return u
+
+
+class DeviceGrid:
+    """Handle to a grid kept on the backend it was created on.
+
+    Parameters
+    ----------
+    data : numpy.ndarray or numba.cuda.cudadrv.devicearray.DeviceNDArray
+        The wrapped grid.
+    """
+
+    def __init__(self, data):
+        self.data = data
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    @property
+    def dtype(self):
+        return self.data.dtype
+
+    @property
+    def ndim(self):
+        return len(self.data.shape)
+
+    @property
+    def onDevice(self):
+        """True when the data lives in CUDA memory."""
+        return cuda.devicearray.is_cuda_ndarray(self.data)
+
+    def __array__(self, dtype=None, copy=None):
+        host = download(self)
+        return host if dtype is None else host.astype(dtype)
+
+    def __repr__(self):
+        where = "cuda" if self.onDevice else "cpu"
+        return "DeviceGrid(shape=%s, dtype=%s, %s)" % (self.shape, self.dtype, where)
+
+
+def isHandle(u):
+    """Return True when ``u`` is a :class:`DeviceGrid`."""
+    return isinstance(u, DeviceGrid)
+
+
+def upload(u):
+    """Return ``u`` as a handle on the active backend, handles pass through.
+
+    Scalar fields are converted to the storage precision first.
+    """
+    if isHandle(u):
+        return u
+    u = compact(u)
+    if cuda.devicearray.is_cuda_ndarray(u) or not use_cuda():
+        return DeviceGrid(u)
+    return DeviceGrid(cuda.to_device(u))
+
+
+def download(u, stored=False, copy=False, out=None):
+    """Return ``u`` as a host numpy array.
+
+    Host data is returned without a copy unless ``copy`` is set, for kernels
+    writing into their input; device data is copied back.  ``float16``
+    fields are widened to ``float32`` unless ``stored`` is set, which keeps
+    the storage precision, e.g. for results held after the run.  With
+    ``copy``, a host ``float32`` grid ``out`` of the same shape receives the
+    copy instead of a new array.
+    """
+    if copy and target(out, u, False) is not None:
+        h_out = target(out, u, False)
+        if h_out is not data(u):
+            np.copyto(h_out, download(u, stored=True))
+        return h_out
+    if isHandle(u):
+        u = u.data
+    if cuda.devicearray.is_cuda_ndarray(u):
+        u = u.copy_to_host()
+        copy = False
+    h_u = u if stored else widen(u)
+    if copy and h_u is u:
+        return np.array(u)
+    return h_u
+
+
+def onDevice(u, copy=False, out=None):
+    """Return ``u`` as a CUDA array for a kernel launch.
+
+    Arrays and host handles are copied to the device.  Device handles are
+    used in place unless ``copy`` is set, for kernels writing into their
+    input.  ``float16`` fields are widened to a new ``float32`` array.  With
+    ``copy``, a device ``float32`` grid ``out`` of the same shape receives
+    the copy instead of a new array.
+    """
+    d_out = target(out, u, True) if copy else None
+    if d_out is not None:
+        src = data(u)
+        if not cuda.devicearray.is_cuda_ndarray(src):
+            d_out.copy_to_device(np.ascontiguousarray(src, dtype=np.float32))
+        elif src.dtype == np.float32:
+            if src is not d_out:
+                d_out.copy_to_device(src)
+        else:
+            dims = d_out.shape
+            castKernel[((dims[0]+7)//8, (dims[1]+7)//8, (dims[2]+7)//8), (8, 8, 8)](src, d_out)
+        return d_out
+    if isHandle(u):
+        u = u.data
+    if not cuda.devicearray.is_cuda_ndarray(u):
+        return cuda.to_device(widen(u))
+    if u.dtype == np.float16:
+        return widen(u)
+    if not copy:
+        return u
+    d_u = cuda.device_array_like(u)
+    d_u.copy_to_device(u)
+    return d_u
+
+
+def data(u):
+    """Return the array wrapped by the handle ``u``, arrays pass through."""
+    return u.data if isHandle(u) else u
+
+
+def target(out, u, gpu):
+    """Return the array of ``out`` when kernels may write the result for ``u`` into it.
+
+    That is a ``float32`` grid of ``u``'s shape on the device when ``gpu``
+    is set and on the host otherwise, ``None`` for anything else, such as
+    ``float16`` storage grids, which kernels cannot write.
+    """
+    if out is None:
+        return None
+    out = data(out)
+    if cuda.devicearray.is_cuda_ndarray(out) != gpu or out.dtype != np.float32 or out.shape != u.shape:
+        return None
+    return out
+
+
+def result(d_u, *inputs):
+    """Return ``d_u`` as a handle when any of ``inputs`` is one, else on the host.
+
+    Handles hold ``d_u`` in the storage precision.
+    """
+    if any(isHandle(u) for u in inputs):
+        return upload(d_u)
+    return download(d_u)
@@ -13,21 +13,31 @@ Typical usage::
     run(PipelineConfig(FILE_NAME="model.stl"))
 """
 
+from __future__ import annotations
+
 import os  # Just used to set up file directory
 import time
 import numpy as np
 from . import Frep as f
+from . import device
+from . import occupancy
+from . import sparse
+from . import supportGen
 from .voronize import voronize
 from .SDF3D import SDF3D, xHeight
-from .pointGen import genRandPoints, explode
+from .pointGen import genRandPoints, poissonPoints
 from .meshExport import generateMesh
 from .analysis import findVol
 from .visualizeSlice import slicePlot, contourPlot, generateImageStack
 from .voxelize import voxelize
-from .__init__ import PipelineConfig
+from .meshSDF import meshSDF
+from .cache import StageCache, fileHash
+from .pool import BufferPool
+from . import backend
+from .__init__ import PipelineConfig, PipelineResult
 
 
-def main(config: PipelineConfig) -> None:
+def main(config: PipelineConfig) -> PipelineResult | None:
     """Run the voronizer pipeline with ``config``.
 
     Parameters
@@ -38,15 +48,172 @@ def main(config: PipelineConfig) -> None:
 
     Returns
     -------
-    None
-        This function is executed for its side effects such as writing
-        output files and displaying plots.
+    PipelineResult or None
+        Grids, meshes and volumes of the run, or ``None`` when the
+        configuration is rejected.  Interactive runs also plot slices and
+        ask before meshing; with ``config.BATCH`` nothing is plotted or
+        prompted, meshes are always generated and files are only written
+        when ``config.OUTPUT_DIR`` is set.  With ``config.CACHE_DIR`` the
+        voxelization, distance field, projection and support heights are
+        reused from earlier runs with the same inputs.  Fields are stored
+        with ``config.PRECISION``, the returned grids included.
     """
     start = time.time()
-    try:
-        os.mkdir(os.path.join(os.path.dirname(__file__), 'Output'))
-    except Exception:
-        pass
+    backend.set_backend(config.BACKEND)
+    device.set_precision(config.PRECISION)
+    print("Using the "+backend.get_backend().upper()+" backend.")
+    plot = not config.BATCH
+    #Batch runs without an output folder keep everything in memory.
+    write = not config.BATCH or config.OUTPUT_DIR != ""
+    outputDir = config.OUTPUT_DIR or os.path.join(os.path.dirname(__file__), 'Output')
+    if write:
+        os.makedirs(outputDir, exist_ok=True)
+    result = PipelineResult()
+    cached = stageCache(config)
+    model = loadModel(config, cached)
+    if model is None:
+        return
+    origShape, scale, shortName, modelImport, params = model
+    #Grids stay on the active backend until they are plotted or exported.
+    origShape = device.upload(origShape)
+    #Dead intermediates go back to the pool and later stages write into them.
+    pool = BufferPool()
+    shape = origShape.shape
+
+    if config.SUPPORT:
+        support, projected = supportRegion(origShape, config, cached, params, plot, pool)
+        supportPts = placeSeeds(cached("xHeight", params, lambda: xHeight(support, config.TPB)), config.SUPPORT_THRESH, config)
+        supportVoronoi = voronize(support, supportPts, config.SUPPORT_CELL, 0, scale, name = "Support", sliceAxis = "Z", tpb=config.TPB, sdfMethod=config.SDF_METHOD, plot=plot, engine=config.CELL_ENGINE)
+        pool.release(support)
+        del support
+        profiles = supportGen.perforationProfiles(supportPts, shape) if config.PERFORATE else None
+        del supportPts
+        supportVoronoi = supportGen.finishSupport(supportVoronoi, origShape, projected, profiles, config.TPB, out=supportVoronoi)
+        pool.release(projected)
+        del projected, profiles
+        result.volumes["Support"] = findVol(supportVoronoi,scale,config.MAT_DENSITY,"Support")
+    
+    if config.MODEL:
+        if config.AESTHETIC:
+            seedShape = f.shell(origShape, 5, config.TPB, out=pool.borrow(shape))
+            objectPts = placeSeeds(seedShape, config.MODEL_THRESH, config)
+            pool.release(seedShape)
+            del seedShape
+        else:
+            objectPts = placeSeeds(origShape, config.MODEL_THRESH, config)
+        print("Points Generated!")
+        narrow = config.NARROW_BAND > 0 and config.MODEL_SHELL > 0
+        objectVoronoi = voronize(origShape, objectPts, config.MODEL_CELL, 0 if narrow else config.MODEL_SHELL, scale, name="Object", tpb=config.TPB, sdfMethod=config.SDF_METHOD, plot=plot, engine=config.CELL_ENGINE)
+        del objectPts
+        if narrow:
+            objectVoronoi = narrowBandShell(objectVoronoi, origShape, config)
+        result.volumes["Object"] = findVol(objectVoronoi,scale,config.MAT_DENSITY,"Object") #in mm^3
+        if config.AESTHETIC:
+            thickened = f.thicken(origShape, -5, config.TPB, out=pool.borrow(shape))
+            objectVoronoi = f.union(objectVoronoi, thickened, config.TPB, out=objectVoronoi)
+            pool.release(thickened)
+            del thickened
+    shortName = shortName+"_Voronoi"
+    if config.SUPPORT and config.MODEL:
+        complete = f.union(objectVoronoi, supportVoronoi, config.TPB, out=pool.borrow(shape))
+        if config.IMG_STACK and write:
+            generateImageStack(occupancy.fromField(objectVoronoi),[255,0,0],occupancy.fromField(supportVoronoi),[0,0,255],name = shortName, outputDir = outputDir)
+    elif config.SUPPORT:
+        complete = supportVoronoi
+        if config.IMG_STACK and write:
+            generateImageStack(occupancy.fromField(supportVoronoi),[0,0,0],occupancy.fromField(supportVoronoi),[0,0,255],name = shortName, outputDir = outputDir)
+    elif config.MODEL:
+        complete = objectVoronoi
+        if config.IMG_STACK and write:
+            generateImageStack(occupancy.fromField(objectVoronoi),[255,0,0],occupancy.fromField(objectVoronoi),[0,0,0],name = shortName[:-len("_Voronoi")], outputDir = outputDir)
+    result.grids["origShape"] = device.download(origShape, stored=True)
+    result.grids["complete"] = device.download(complete, stored=True)
+    if config.MODEL:
+        result.grids["objectVoronoi"] = device.download(objectVoronoi, stored=True)
+    if config.SUPPORT:
+        result.grids["supportVoronoi"] = device.download(supportVoronoi, stored=True)
+    result.scale = scale
+    if plot:
+        slicePlot(result.grids["complete"], origShape.shape[0]//2, titlestring='Full Model', axis = "X")
+        slicePlot(result.grids["complete"], origShape.shape[1]//2, titlestring='Full Model', axis = "Y")
+        slicePlot(result.grids["complete"], origShape.shape[2]//2, titlestring='Full Model', axis = "Z")
+    
+    print("That took "+str(round(time.time()-start,2))+" seconds.")
+    if config.BATCH:
+        fn = shortName
+    else:
+        UIP = input("Would you like the .ply for this iteration? [Y/N]")
+        if UIP != "Y" and UIP != "y":
+            return result
+        if modelImport:
+            fn = shortName
+        else:
+            fn = input("What would you like the file to be called?")
+
+    def mesh(u, name):
+        modelName = name if write else ''
+        fvals = device.download(u)
+        if config.NARROW_BAND > 0:
+            #Only the blocks near the surface are meshed.
+            fvals = sparse.fromDense(fvals, config.NARROW_BAND)
+        result.meshes[name] = generateMesh(fvals,scale,modelName=modelName, fileFormat=config.MESH_FORMAT, chunk=config.MESH_CHUNK, workers=config.MESH_WORKERS, outputDir=outputDir)
+
+    print("Generating Model...")
+    if config.SEPARATE_SUPPORTS and config.SUPPORT and config.MODEL:
+        if config.SMOOTH:
+            objectVoronoi = f.smooth(objectVoronoi, tpb=config.TPB)
+        mesh(objectVoronoi, fn)
+        print("Generating Supports...")
+        if config.SMOOTH:
+            supportVoronoi = f.smooth(supportVoronoi, tpb=config.TPB)
+        mesh(supportVoronoi, fn+"Support")
+    else:
+        if config.SMOOTH:
+            complete = f.smooth(complete, tpb=config.TPB)
+        mesh(complete, fn)
+    if config.INVERSE and config.MODEL:
+        print("Generating Inverse...")
+        inv = f.subtract(objectVoronoi, origShape, config.TPB, out=pool.borrow(shape))
+        if config.SMOOTH:
+            inv = f.smooth(inv, tpb=config.TPB)
+        print("Generating Mesh...")
+        mesh(inv, fn+"Inv")
+    pool.clear()
+    return result
+
+def stageCache(config):
+    """Return ``cached(stage, params, compute)`` backed by ``config.CACHE_DIR``.
+
+    Without a cache directory ``compute`` is simply called.
+    """
+    cache = StageCache(config.CACHE_DIR, int(config.CACHE_SIZE * 2**30)) if config.CACHE_DIR else None
+
+    def cached(stage, params, compute):
+        if cache is None:
+            return compute()
+        return cache.fetch(stage, params, compute)
+
+    return cached
+
+
+def loadModel(config, cached):
+    """Voxelize ``config.FILE_NAME`` or build ``config.PRIMITIVE_TYPE``.
+
+    Parameters
+    ----------
+    config : PipelineConfig
+        Pipeline settings.
+    cached : callable
+        Stage cache from :func:`stageCache`.
+
+    Returns
+    -------
+    tuple or None
+        ``(origShape, scale, shortName, modelImport, params)`` with
+        ``origShape`` condensed and converted to a signed distance field and
+        ``params`` the stage cache parameters it was built from, or ``None``
+        when the configuration is rejected.
+    """
     FILE_NAME = config.FILE_NAME
     PRIMITIVE_TYPE = config.PRIMITIVE_TYPE
     modelImport = False
@@ -54,21 +221,29 @@ def main(config: PipelineConfig) -> None:
     if not config.MODEL and not config.SUPPORT:
         print("You need at least the model or the support structure.")
         return
+    if 0 < config.NARROW_BAND <= config.MODEL_SHELL:
+        print("The narrow band has to be wider than the model shell.")
+        return
     if FILE_NAME != "":
-        shortName = FILE_NAME[:-4]
+        shortName = os.path.splitext(os.path.basename(FILE_NAME))[0]
         modelImport = True
         try:    filepath = os.path.join(os.path.dirname(__file__), 'Input',FILE_NAME)
         except: 
             print("Input file not found.") 
             return
         res = config.RESOLUTION - config.BUFFER * 2
-        origShape, objectBox = voxelize(filepath, res, config.BUFFER, config.TPB)
+        params = {"source": fileHash(filepath) if config.CACHE_DIR else filepath, "RESOLUTION": config.RESOLUTION, "BUFFER": config.BUFFER, "DIRECT_SDF": config.DIRECT_SDF}
+        if config.DIRECT_SDF:
+            origShape, objectBox = cached("voxelize", params, lambda: meshSDF(filepath, res, config.BUFFER, config.VOXEL_WORKERS))
+        else:
+            origShape, objectBox = cached("voxelize", params, lambda: voxelize(filepath, res, config.BUFFER, config.TPB, config.VOXEL_WORKERS))
         gridResX, gridResY, gridResZ = origShape.shape
         scale[0] = objectBox[0] / (gridResX - config.BUFFER * 2)
         scale[1] = max(objectBox[1:]) / (gridResY - config.BUFFER * 2)
         scale[2] = scale[1]
     elif PRIMITIVE_TYPE != "":
         shortName = PRIMITIVE_TYPE
+        params = {"source": PRIMITIVE_TYPE, "RESOLUTION": config.RESOLUTION}
         if PRIMITIVE_TYPE == "Heart":
             x0 = np.linspace(-1.5, 1.5, config.RESOLUTION)
             y0, z0 = x0, x0
@@ -100,93 +275,68 @@ def main(config: PipelineConfig) -> None:
         return
 
     print("Initial Bounding Box Dimensions: "+str(origShape.shape))
-    origShape = SDF3D(f.condense(origShape, config.BUFFER, config.TPB), tpb=config.TPB)
+    params = dict(params, BUFFER=config.BUFFER, TPB=config.TPB, SDF_METHOD=config.SDF_METHOD, BACKEND=backend.get_backend(), PRECISION=config.PRECISION)
+
+    def distanceField(u):
+        u = f.condense(u, config.BUFFER, config.TPB)
+        if not (modelImport and config.DIRECT_SDF):
+            u = SDF3D(u, tpb=config.TPB, method=config.SDF_METHOD)
+        return u
+
+    origShape = cached("sdf", params, lambda: distanceField(origShape))
     if config.NET:
         origShape = f.shell(origShape, config.NET_THICKNESS, config.TPB)
+    params = dict(params, NET=config.NET, NET_THICKNESS=config.NET_THICKNESS)
     print("Condensed Bounding Box Dimensions: "+str(origShape.shape))
-    
-    if config.SUPPORT:
-        projected = f.projection(origShape, config.TPB)
-        support = f.subtract(f.thicken(origShape, 1), projected, config.TPB)
-        support = f.intersection(support, f.translate(support, -1, 0, 0, config.TPB), config.TPB)
-        contourPlot(support,30,titlestring='Support',axis ="Z")
-        supportPts = genRandPoints(xHeight(support, config.TPB), config.SUPPORT_THRESH)
-        supportVoronoi = voronize(support, supportPts, config.SUPPORT_CELL, 0, scale, name = "Support", sliceAxis = "Z")
-        if config.PERFORATE: 
-            explosion = f.union(
-                explode(supportPts),
-                f.translate(explode(supportPts), -1, 0, 0, config.TPB),
-                config.TPB,
-            )
-            explosion = f.union(explosion, f.translate(explosion, 0, 1, 0, config.TPB), config.TPB)
-            explosion = f.union(explosion, f.translate(explosion, 0, 0, 1, config.TPB), config.TPB)
-            supportVoronoi = f.subtract(explosion, supportVoronoi, config.TPB)
-        table = f.subtract(
-            f.thicken(origShape, 1),
-            f.intersection(
-                f.translate(f.subtract(origShape, f.translate(origShape, -3, 0, 0, config.TPB), config.TPB), -1, 0, 0, config.TPB),
-                projected,
-                config.TPB,
-            ),
-            config.TPB,
-        )
-        supportVoronoi = f.union(table, supportVoronoi, config.TPB)
-        findVol(supportVoronoi,scale,config.MAT_DENSITY,"Support")
-    
-    if config.MODEL:
-        if config.AESTHETIC:
-            objectPts = genRandPoints(f.shell(origShape, 5, config.TPB), config.MODEL_THRESH)
-        else:
-            objectPts = genRandPoints(origShape,config.MODEL_THRESH)
-        print("Points Generated!")
-        objectVoronoi = voronize(origShape, objectPts, config.MODEL_CELL, config.MODEL_SHELL, scale, name="Object")
-        findVol(objectVoronoi,scale,config.MAT_DENSITY,"Object") #in mm^3
-        if config.AESTHETIC:
-            objectVoronoi = f.union(objectVoronoi, f.thicken(origShape, -5), config.TPB)
-    shortName = shortName+"_Voronoi"
-    if config.SUPPORT and config.MODEL:
-        complete = f.union(objectVoronoi, supportVoronoi, config.TPB)
-        if config.IMG_STACK:
-            generateImageStack(objectVoronoi,[255,0,0],supportVoronoi,[0,0,255],name = shortName)
-    elif config.SUPPORT:
-        complete = supportVoronoi
-        if config.IMG_STACK:
-            generateImageStack(supportVoronoi,[0,0,0],supportVoronoi,[0,0,255],name = shortName)
-    elif config.MODEL:
-        complete = objectVoronoi
-        if config.IMG_STACK:
-            generateImageStack(objectVoronoi,[255,0,0],objectVoronoi,[0,0,0],name = FILE_NAME[:-4])
-    slicePlot(complete, origShape.shape[0]//2, titlestring='Full Model', axis = "X")
-    slicePlot(complete, origShape.shape[1]//2, titlestring='Full Model', axis = "Y")
-    slicePlot(complete, origShape.shape[2]//2, titlestring='Full Model', axis = "Z")
-    
-    print("That took "+str(round(time.time()-start,2))+" seconds.")
-    UIP = input("Would you like the .ply for this iteration? [Y/N]")
-    if UIP == "Y" or UIP == "y":
-        if modelImport:
-            fn = shortName
-        else:
-            fn = input("What would you like the file to be called?")
-        print("Generating Model...")
-        if config.SEPARATE_SUPPORTS and config.SUPPORT and config.MODEL:
-            if config.SMOOTH:
-                objectVoronoi = f.smooth(objectVoronoi, tpb=config.TPB)
-            generateMesh(objectVoronoi,scale,modelName=fn)
-            print("Generating Supports...")
-            if config.SMOOTH:
-                supportVoronoi = f.smooth(supportVoronoi, tpb=config.TPB)
-            generateMesh(supportVoronoi,scale,modelName=fn+"Support")
-        else:
-            if config.SMOOTH:
-                complete = f.smooth(complete, tpb=config.TPB)
-            generateMesh(complete,scale,modelName=fn)
-        if config.INVERSE and config.MODEL:
-            print("Generating Inverse...")
-            inv = f.subtract(objectVoronoi, origShape, config.TPB)
-            if config.SMOOTH:
-                inv = f.smooth(inv, tpb=config.TPB)
-            print("Generating Mesh...")
-            generateMesh(inv,scale,modelName=fn+"Inv")
+    return origShape, scale, shortName, modelImport, params
+
+
+def supportRegion(origShape, config, cached, params, plot=True, pool=None):
+    """Return ``(support, projected)`` for the condensed field ``origShape``.
+
+    ``support`` is the space below the model that gets a Voronoi infill and
+    ``projected`` the model projected down to the build plate, which
+    :func:`supportGen.finishSupport` needs to add the table.  ``params`` are
+    the stage cache parameters returned by :func:`loadModel`.  ``support``
+    is written into a buffer of the :class:`pool.BufferPool` ``pool`` when
+    one is given.
+    """
+    projected = device.upload(cached("projection", params, lambda: f.projection(origShape, config.TPB)))
+    out = pool.borrow(origShape.shape) if pool is not None else None
+    support = supportGen.supportSpace(origShape, projected, config.TPB, out=out)
+    if plot:
+        contourPlot(device.download(support),30,titlestring='Support',axis ="Z")
+    return support, projected
+
+
+def narrowBandShell(voronoi, origShape, config):
+    """Add the ``config.MODEL_SHELL`` shell to ``voronoi`` on sparse grids.
+
+    The shell is cut from the :func:`sparse.narrowBandSDF` of ``origShape``
+    and joined to the Voronoi walls block by block, so none of the dense
+    temporaries of :func:`Frep.shell` are allocated.  The result is the
+    dense field clamped to ``[-NARROW_BAND, NARROW_BAND]``.
+    """
+    band = config.NARROW_BAND
+    walls = sparse.shell(sparse.narrowBandSDF(origShape, band), config.MODEL_SHELL)
+    grid = sparse.union(sparse.fromDense(voronoi, band), walls)
+    return device.upload(grid.toDense())
+
+
+def placeSeeds(u, threshold, config):
+    """Place Voronoi seeds inside ``u`` with ``config.SEED_SAMPLER``.
+
+    ``"random"`` returns the seed matrix of :func:`genRandPoints` and
+    ``"poisson"`` the ``(n, 3)`` array of :func:`poissonPoints`, seeded with
+    ``config.SEED`` when it is not negative.  Both are accepted by
+    :func:`voronize` and :func:`supportGen.perforationProfiles`.
+    """
+    if config.SEED_SAMPLER == "poisson":
+        return poissonPoints(u, threshold, seed=config.SEED if config.SEED >= 0 else None)
+    if config.SEED >= 0:
+        np.random.seed(config.SEED)
+    return genRandPoints(u, threshold, config.TPB)
+
 
 if __name__ == '__main__':
     main(PipelineConfig())
@@ -1,5 +1,7 @@
 import os #Just used to set up file directory
+import multiprocessing
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 import matplotlib.pyplot as plt
 from skimage import measure
 from mpl_toolkits.mplot3d.art3d import Poly3DCollection
@@ -7,16 +9,36 @@ from mpl_toolkits.mplot3d.art3d import Poly3DCollection
 # Create 3d contourplot (and surface tesselation) based on 3d array fvals 
 # sampled on grid with coords determined by xvals, yvals, and zvals
 # Note that tesselator requires inputs corresponding to grid spacings
-def generateMesh(fvals, scale, modelName='', show = False):
+def generateMesh(fvals, scale, modelName='', show = False, fileFormat = 'ply', dtype = np.float64, chunk = 0, workers = 1, outputDir = None):
+    #fileFormat = "ply" (binary), "ply_ascii" or "stl" (binary)
+    #dtype = precision of the returned vertices, float32 halves their size
+    #chunk = edge length of the blocks meshed separately, 0 meshes the grid at once
+    #workers = processes meshing blocks when chunk is set, 0 uses every core
+    #outputDir = destination folder, defaults to the package Output folder
+    #fvals may also be a sparse.SparseGrid, only its blocks near the surface
+    #are meshed and chunk and workers are ignored.
+    #Returns the (verts, faces) of the tesselation.
+    from .sparse import SparseGrid, tesselate as tesselateSparse  #sparse imports this module
+    if fileFormat not in EXPORT_FORMATS:
+        raise ValueError("Unknown export format '%s', expected one of %s" % (fileFormat, ", ".join(EXPORT_FORMATS)))
     i,j,k = fvals.shape
     xvals = np.linspace(0,i-1, i, endpoint=True)
     yvals = np.linspace(0,j-1, j, endpoint=True) 
     zvals = np.linspace(0,k-1, k, endpoint=True)
-    verts, faces = tesselate(fvals, xvals, yvals, zvals, scale)    
+    if isinstance(fvals, SparseGrid):
+        verts, faces = tesselateSparse(fvals, scale, dtype)
+    elif chunk > 0:
+        verts, faces = tesselateChunked(fvals, scale, chunk, workers, dtype)
+    else:
+        verts, faces = tesselate(fvals, xvals, yvals, zvals, scale, dtype)
     print("Done Tesselate")
     if modelName !='':
-        exportPLY(modelName, verts, faces)	
-        print('Object exported to Output folder as '+modelName+'.ply')
+        if fileFormat == 'stl':
+            exportSTL(modelName, verts, faces, outputDir)
+            print('Object exported to '+(outputDir or 'Output folder')+' as '+modelName+'.stl')
+        else:
+            exportPLY(modelName, verts, faces, binary = fileFormat == 'ply', outputDir = outputDir)
+            print('Object exported to '+(outputDir or 'Output folder')+' as '+modelName+'.ply')
     if show:
         fig = plt.figure(figsize=(10, 10))
         ax = fig.add_subplot(111, projection='3d')
@@ -28,38 +50,166 @@ def generateMesh(fvals, scale, modelName='', show = False):
         ax.set_zlim(0, k)
         plt.tight_layout()
         plt.show()    
-    
-def exportPLY(modelName, verts2, faces):
-    filepath = os.path.join(os.path.dirname(__file__),'Output',modelName+'.ply')
-    plyf = open(filepath, 'w')
-    plyf.write( "ply\n")
-    plyf.write( "format ascii 1.0\n")
-    plyf.write( "comment ism.py generated\n")
-    plyf.write( "element vertex " + str(verts2.size/3)+'\n')
-    plyf.write( "property float x\n")
-    plyf.write( "property float y\n")
-    plyf.write( "property float z\n")
-    plyf.write( "element face " + str(faces.size/3)+'\n')
-    plyf.write( "property list uchar int vertex_indices\n")
-    plyf.write( "end_header\n")
-    for i in range(0,verts2.size//3):
-        plyf.write(str(verts2[i][0])+' '+str(verts2[i][1])+' '+str(verts2[i][2])+'\n')
-    for i in range(0,faces.size//3):
-        plyf.write('3 '+str(faces[i][0])+' '+str(faces[i][1])+' '+str(faces[i][2])+'\n') 
-    plyf.close()
+    return verts, faces
+
+EXPORT_FORMATS = ("ply", "ply_ascii", "stl")
+CHUNK = 1 << 20  #Vertices or faces written per block
+
+def exportPLY(modelName, verts2, faces, binary = True, outputDir = None):
+    filepath = os.path.join(outputDir or os.path.join(os.path.dirname(__file__),'Output'),modelName+'.ply')
+    writePLY(filepath, verts2, faces, binary)
+
+def exportSTL(modelName, verts, faces, outputDir = None):
+    filepath = os.path.join(outputDir or os.path.join(os.path.dirname(__file__),'Output'),modelName+'.stl')
+    writeSTL(filepath, verts, faces)
+
+def writePLY(filepath, verts, faces, binary = True):
+    """Write a triangle mesh as a PLY file.
+
+    Binary files are little-endian and streamed in blocks of ``CHUNK``
+    vertices or faces with :meth:`numpy.ndarray.tofile`.
+
+    Parameters
+    ----------
+    filepath : str
+        Destination path.
+    verts : numpy.ndarray
+        ``(n, 3)`` vertex coordinates, stored as float32.
+    faces : numpy.ndarray
+        ``(m, 3)`` vertex indices, stored as int32.
+    binary : bool, optional
+        Write ``binary_little_endian`` instead of ``ascii``.
+    """
+    verts = np.asarray(verts).reshape(-1, 3)
+    faces = np.asarray(faces).reshape(-1, 3)
+    header = ("ply\n"
+              "format " + ("binary_little_endian" if binary else "ascii") + " 1.0\n"
+              "comment ism.py generated\n"
+              "element vertex %d\n"
+              "property float x\n"
+              "property float y\n"
+              "property float z\n"
+              "element face %d\n"
+              "property list uchar int vertex_indices\n"
+              "end_header\n") % (len(verts), len(faces))
+    faceRecord = np.dtype([('count', 'u1'), ('index', '<i4', (3,))])
+    with open(filepath, 'wb') as plyf:
+        plyf.write(header.encode('ascii'))
+        for first in range(0, len(verts), CHUNK):
+            block = verts[first:first+CHUNK]
+            if binary:
+                block.astype('<f4').tofile(plyf)
+            else:
+                np.savetxt(plyf, block, fmt='%.7g')
+        for first in range(0, len(faces), CHUNK):
+            block = faces[first:first+CHUNK]
+            if binary:
+                records = np.empty(len(block), dtype=faceRecord)
+                records['count'] = 3
+                records['index'] = block
+                records.tofile(plyf)
+            else:
+                np.savetxt(plyf, block, fmt='3 %d %d %d')
+
+def writeSTL(filepath, verts, faces):
+    """Write a triangle mesh as a binary STL file, ``CHUNK`` faces at a time."""
+    verts = np.asarray(verts).reshape(-1, 3)
+    faces = np.asarray(faces).reshape(-1, 3)
+    record = np.dtype([('normal', '<f4', (3,)), ('vertices', '<f4', (3, 3)), ('attr', '<u2')])
+    with open(filepath, 'wb') as stlf:
+        stlf.write(b'ism.py generated'.ljust(80, b' '))
+        np.array([len(faces)], dtype='<u4').tofile(stlf)
+        for first in range(0, len(faces), CHUNK):
+            tris = verts[faces[first:first+CHUNK]]
+            normal = np.cross(tris[:, 1] - tris[:, 0], tris[:, 2] - tris[:, 0])
+            length = np.linalg.norm(normal, axis=1, keepdims=True)
+            records = np.zeros(len(tris), dtype=record)
+            records['normal'] = np.divide(normal, length, out=np.zeros_like(normal), where=length > 0)
+            records['vertices'] = tris
+            records.tofile(stlf)
     
 # Compute a tesselation of the zero isosurface
-def tesselate(fvals, xvals, yvals, zvals, scale):
-    #verts,faces,normals,values = measure.marching_cubes_lewiner(fvals,0,spacing=(1.0, 1.0, 1.0),allow_degenerate=False)
-    verts, faces, normals, values = measure.marching_cubes_lewiner(fvals, level = 0,spacing=(1.0, 1.0, 1.0), allow_degenerate = False)    
-    ndex = [0,0,0]
-    frac = [0,0,0]
-    verts2 = np.ndarray(shape=(verts.size//3,3), dtype=float)
-    for i in range(0,verts.size//3):
-        for j in range(0,3):
-            ndex[j] = int(verts[i][j])
-            frac[j] = verts[i][j]%1
-        verts2[i][0] = (xvals[ndex[0]]+frac[0])*scale[0]
-        verts2[i][1] = (yvals[ndex[1]]+frac[1])*scale[1]
-        verts2[i][2] = (zvals[ndex[2]]+frac[2])*scale[2]
-    return tuple([verts2, faces])
+def tesselate(fvals, xvals, yvals, zvals, scale, dtype = np.float64):
+    """Marching cubes tesselation of the zero isosurface of ``fvals``.
+
+    ``xvals``, ``yvals`` and ``zvals`` are the unit spaced sample positions
+    of the grid, only their first entry is used as the origin.  The voxel
+    ``scale`` is passed to :func:`skimage.measure.marching_cubes` as the
+    spacing, so vertices come back in model units without a per-vertex loop.
+
+    Returns
+    -------
+    tuple
+        ``(verts, faces)`` with ``verts`` of ``dtype``.
+    """
+    spacing = tuple(float(s) for s in scale)
+    verts, faces, normals, values = measure.marching_cubes(fvals, level = 0, spacing = spacing, allow_degenerate = False)
+    verts += np.array([xvals[0], yvals[0], zvals[0]]) * spacing
+    return tuple([verts.astype(dtype, copy=False), faces])
+
+def tesselateChunked(fvals, scale, chunk = 64, workers = 1, dtype = np.float64):
+    """Marching cubes over ``chunk``-sized blocks of ``fvals``.
+
+    Neighbouring blocks share one layer of samples so every cell is meshed
+    exactly once.  Blocks without a sign change are skipped, the rest run
+    in a spawned process pool with at most ``2*workers`` blocks in flight,
+    which bounds the extra memory.  Vertices on the shared layers are
+    computed by both blocks and welded by hashing their quantized
+    positions.
+
+    Returns
+    -------
+    tuple
+        ``(verts, faces)`` scaled like :func:`tesselate`.
+    """
+    if workers == 0:
+        workers = os.cpu_count()
+    starts = [range(0, max(n - 1, 1), chunk) for n in fvals.shape]
+    blocks = ((a, b, c) for a in starts[0] for b in starts[1] for c in starts[2])
+    results = []
+    if workers <= 1:
+        for origin in blocks:
+            results.append(tesselateBlock(blockOf(fvals, origin, chunk), origin))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            pending = set()
+            for origin in blocks:
+                block = blockOf(fvals, origin, chunk)
+                if block is None:
+                    continue
+                if len(pending) >= 2 * workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    results.extend(job.result() for job in done)
+                pending.add(pool.submit(tesselateBlock, block, origin))
+            results.extend(job.result() for job in pending)
+    results = [result for result in results if result is not None]
+    if not results:
+        return np.empty((0, 3), dtype=dtype), np.empty((0, 3), dtype=np.int32)
+    offsets = np.cumsum([0] + [len(result[0]) for result in results])
+    verts = np.concatenate([result[0] for result in results])
+    faces = np.concatenate([result[1] + offset for result, offset in zip(results, offsets)])
+    verts, faces = weldVertices(verts, faces)
+    return (verts * np.asarray(scale, dtype=np.float64)).astype(dtype, copy=False), faces
+
+def blockOf(fvals, origin, chunk):
+    #Returns a copy of the block at origin, or None without a sign change.
+    a, b, c = origin
+    block = fvals[a:a+chunk+1, b:b+chunk+1, c:c+chunk+1]
+    if min(block.shape) < 2 or block.min() > 0 or block.max() < 0 or block.min() == block.max():
+        return None
+    return np.array(block)
+
+def tesselateBlock(block, origin):
+    """Mesh one block, vertices offset to ``origin`` in voxel units."""
+    if block is None:
+        return None
+    verts, faces, normals, values = measure.marching_cubes(block, level = 0, allow_degenerate = False)
+    return verts + np.asarray(origin, dtype=np.float64), faces
+
+def weldVertices(verts, faces, tolerance = 1e-5):
+    """Merge vertices closer than ``tolerance`` voxels and drop collapsed faces."""
+    keys = np.round(verts / tolerance).astype(np.int64)
+    keys, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    faces = inverse.reshape(-1)[faces]
+    keep = (faces[:, 0] != faces[:, 1]) & (faces[:, 0] != faces[:, 2]) & (faces[:, 1] != faces[:, 2])
+    return verts[first], faces[keep].astype(np.int32)
@@ -0,0 +1,203 @@
+"""Signed distance fields computed straight from a triangle mesh.
+
+The default STL path rasterizes the mesh to a boolean grid, turns it into a
+±0.01 field and rebuilds distances with :func:`SDF3D.SDF3D`, which loses
+everything below one voxel.  :func:`meshSDF` instead measures the exact
+distance to the nearest triangle for every voxel within ``band`` of the
+surface and fills the far field from the distance transform of that band:
+
+* triangles are binned into ``BLOCK``-sized voxel tiles their bounding box
+  (grown by ``band``) touches, so each voxel only tests nearby triangles;
+* tiles without any triangle are skipped and the remaining tiles are
+  evaluated in parallel;
+* the sign comes from the ray parity fill of :func:`voxelize.rasterizeMesh`,
+  so inside and outside agree voxel for voxel with :func:`voxelize.voxelize`;
+* voxels further than ``band`` get ``sqrt(EDT to the band) + band`` from
+  :func:`SDF3D.squaredEDT`.  This far field is an approximation, an upper
+  bound on the true distance that is off by less than a voxel.
+
+The result has the shape and orientation :func:`voxelize.voxelize` produces
+and can be passed to :func:`Frep.condense` and :func:`voronize.voronize`
+without another :func:`SDF3D.SDF3D` pass.  Everything runs on the CPU; the
+active backend and ``SDF_METHOD`` are ignored.
+"""
+
+import math
+import numpy as np
+from numba import njit, prange
+from .voxelize import loadMesh, rasterizeMesh
+from .SDF3D import squaredEDT
+
+BLOCK = 8
+
+def meshSDF(inputFilePath, resolution, buffer, workers=1, band=3.0):
+    """Signed distance field of an STL file sampled on the voxelize grid.
+
+    Distances within ``band`` of the surface are exact, further ones are the
+    upper bound ``sqrt(EDT to the band) + band``.  Always runs on the CPU.
+
+    Parameters
+    ----------
+    inputFilePath : str
+        Path to the STL file.
+    resolution : int
+        Output XY resolution in voxels.
+    buffer : int
+        Padding applied around the volume.
+    workers : int, optional
+        Processes used for the parity fill, ``0`` uses every core.
+    band : float, optional
+        Distance in voxels within which exact triangle distances are used.
+
+    Returns
+    -------
+    tuple
+        ``(sdf, modelSize)`` where ``sdf`` is a ``float32`` field, negative
+        inside, in voxel units.
+    """
+    triangles, bounding_box, modelSize = loadMesh(inputFilePath, resolution)
+    inside = rasterizeMesh(triangles, bounding_box, workers)
+    resX, resY, layers = bounding_box
+    shape = (layers + 2 * buffer, resX + 2 * buffer, resY + 2 * buffer)
+    #Reorder the vertices to the (z, x, y) axes of the grid.
+    triangles = np.ascontiguousarray(triangles[:, :, [2, 0, 1]] + buffer)
+    sdf = triangleDistance(triangles, shape, band)
+    far = squaredEDT(np.where(np.isfinite(sdf), -1, 1).astype(np.float32))
+    combineKernelCPU(sdf, far, inside, buffer, band)
+    print("Mesh SDF complete!")
+    return sdf, modelSize
+
+def triangleDistance(triangles, shape, band):
+    """Unsigned distance to ``triangles`` for voxels closer than ``band``.
+
+    Parameters
+    ----------
+    triangles : numpy.ndarray
+        ``(n, 3, 3)`` vertices in grid index coordinates.
+    shape : tuple
+        Shape of the output grid.
+    band : float
+        Largest distance recorded, voxels further away hold ``inf``.
+
+    Returns
+    -------
+    numpy.ndarray
+        ``float32`` grid of ``shape``.
+    """
+    blocks = np.array([(n + BLOCK - 1) // BLOCK for n in shape], dtype=np.int64)
+    lo = np.floor((triangles.min(axis=1) - band) / BLOCK).astype(np.int64)
+    hi = np.floor((triangles.max(axis=1) + band) / BLOCK).astype(np.int64)
+    lo = np.clip(lo, 0, blocks - 1)
+    hi = np.clip(hi, 0, blocks - 1)
+    start, members = binTriangles(lo, hi, blocks)
+    active = np.flatnonzero(np.diff(start))
+    dist = np.full(shape, np.inf, dtype=np.float32)
+    nearFieldKernelCPU(triangles, active, start, members, blocks, band, dist)
+    return dist
+
+@njit(cache=True)
+def binTriangles(lo, hi, blocks):
+    #CSR lists of the triangles touching each tile, tiles in C order.
+    nb1 = blocks[1]
+    nb2 = blocks[2]
+    counts = np.zeros(blocks[0]*nb1*nb2, np.int64)
+    for t in range(lo.shape[0]):
+        for a in range(lo[t,0], hi[t,0]+1):
+            for b in range(lo[t,1], hi[t,1]+1):
+                for c in range(lo[t,2], hi[t,2]+1):
+                    counts[(a*nb1+b)*nb2+c] += 1
+    start = np.zeros(counts.size+1, np.int64)
+    start[1:] = np.cumsum(counts)
+    fill = start[:-1].copy()
+    members = np.empty(start[-1], np.int64)
+    for t in range(lo.shape[0]):
+        for a in range(lo[t,0], hi[t,0]+1):
+            for b in range(lo[t,1], hi[t,1]+1):
+                for c in range(lo[t,2], hi[t,2]+1):
+                    block = (a*nb1+b)*nb2+c
+                    members[fill[block]] = t
+                    fill[block] += 1
+    return start, members
+
+@njit(cache=True)
+def pointTriangleDistance(tri, px, py, pz):
+    #Squared distance from p to the closest point of tri, following the
+    #Voronoi region tests of Ericson, Real-Time Collision Detection 5.1.5.
+    ax, ay, az = tri[0,0], tri[0,1], tri[0,2]
+    abx, aby, abz = tri[1,0]-ax, tri[1,1]-ay, tri[1,2]-az
+    acx, acy, acz = tri[2,0]-ax, tri[2,1]-ay, tri[2,2]-az
+    apx, apy, apz = px-ax, py-ay, pz-az
+    d1 = abx*apx+aby*apy+abz*apz
+    d2 = acx*apx+acy*apy+acz*apz
+    if d1 <= 0 and d2 <= 0:
+        return apx*apx+apy*apy+apz*apz
+    bpx, bpy, bpz = px-tri[1,0], py-tri[1,1], pz-tri[1,2]
+    d3 = abx*bpx+aby*bpy+abz*bpz
+    d4 = acx*bpx+acy*bpy+acz*bpz
+    if d3 >= 0 and d4 <= d3:
+        return bpx*bpx+bpy*bpy+bpz*bpz
+    cpx, cpy, cpz = px-tri[2,0], py-tri[2,1], pz-tri[2,2]
+    d5 = abx*cpx+aby*cpy+abz*cpz
+    d6 = acx*cpx+acy*cpy+acz*cpz
+    if d6 >= 0 and d5 <= d6:
+        return cpx*cpx+cpy*cpy+cpz*cpz
+    vc = d1*d4-d3*d2
+    vb = d5*d2-d1*d6
+    va = d3*d6-d5*d4
+    if vc <= 0 and d1 >= 0 and d3 <= 0:
+        v = d1/(d1-d3)
+        w = 0.0
+    elif vb <= 0 and d2 >= 0 and d6 <= 0:
+        v = 0.0
+        w = d2/(d2-d6)
+    elif va <= 0 and d4-d3 >= 0 and d5-d6 >= 0:
+        w = (d4-d3)/((d4-d3)+(d5-d6))
+        v = 1.0-w
+    else:
+        denom = 1.0/(va+vb+vc)
+        v = vb*denom
+        w = vc*denom
+    qx = apx-abx*v-acx*w
+    qy = apy-aby*v-acy*w
+    qz = apz-abz*v-acz*w
+    return qx*qx+qy*qy+qz*qz
+
+@njit(parallel=True, cache=True)
+def nearFieldKernelCPU(triangles, active, start, members, blocks, band, dist):
+    dims = dist.shape
+    limit = band*band
+    for index in prange(active.size):
+        block = active[index]
+        bi = block//(blocks[1]*blocks[2])
+        bj = (block//blocks[2])%blocks[1]
+        bk = block%blocks[2]
+        for i in range(bi*BLOCK, min((bi+1)*BLOCK, dims[0])):
+            for j in range(bj*BLOCK, min((bj+1)*BLOCK, dims[1])):
+                for k in range(bk*BLOCK, min((bk+1)*BLOCK, dims[2])):
+                    best = limit
+                    for m in range(start[block], start[block+1]):
+                        d = pointTriangleDistance(triangles[members[m]], i, j, k)
+                        if d < best:
+                            best = d
+                    if best < limit:
+                        dist[i,j,k] = math.sqrt(best)
+
+@njit(parallel=True, cache=True)
+def combineKernelCPU(sdf, far, inside, buffer, band):
+    #Fills the far field and applies the parity sign.  ``inside`` is the
+    #unpadded rasterized grid, voxels of the padding are always outside.
+    dims = sdf.shape
+    m, n, p = inside.shape
+    for i in prange(dims[0]):
+        for j in range(dims[1]):
+            for k in range(dims[2]):
+                d = sdf[i,j,k]
+                if d == np.inf:
+                    d = math.sqrt(far[i,j,k])+band
+                a = i-buffer
+                b = j-buffer
+                c = k-buffer
+                if a >= 0 and b >= 0 and c >= 0 and a < m and b < n and c < p and inside[a,b,c]:
+                    #Voxels lying on the surface keep the -0.01 of toFRep.
+                    d = -max(d, 0.01)
+                sdf[i,j,k] = d
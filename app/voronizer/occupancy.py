@@ -0,0 +1,112 @@
+"""Bit-packed occupancy grids.
+
+Solid/empty voxel grids need one bit per voxel, yet a bool array spends a
+byte and the float fields built from it four or eight.  An
+:class:`Occupancy` stores the grid with :func:`numpy.packbits` along Z (the
+last axis), eight voxels per byte, and offers the operations the pipeline
+needs without unpacking the whole grid at once:
+
+* :meth:`Occupancy.pad` adds an empty border one X slab at a time;
+* :meth:`Occupancy.count` counts solid voxels with a byte popcount table;
+* :meth:`Occupancy.unpack` and :meth:`Occupancy.layer` expand X layers for
+  image stacks and plots.
+
+:func:`voxelize.toFRep` and :func:`analysis.findVol` take an
+:class:`Occupancy` directly, :func:`visualizeSlice.generateImageStack` takes
+one in place of either grid.
+
+Typical usage::
+
+    from app.voronizer import occupancy
+
+    solid = occupancy.pack(mask).pad(4)
+    voxels = solid.count()
+"""
+
+import numpy as np
+
+from .device import download
+
+SLAB = 64  #X layers expanded at once
+POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+
+class Occupancy:
+    """Solid voxels of a grid, packed eight to a byte along Z.
+
+    Parameters
+    ----------
+    bits : numpy.ndarray
+        ``uint8`` array of shape ``(x, y, ceil(z/8))`` from
+        :func:`numpy.packbits` along the last axis, unused trailing bits
+        zero.
+    shape : tuple of int
+        Shape ``(x, y, z)`` of the unpacked grid.
+    """
+
+    def __init__(self, bits, shape):
+        self.bits = bits
+        self.shape = tuple(int(n) for n in shape)
+
+    @property
+    def nbytes(self):
+        return self.bits.nbytes
+
+    def unpack(self, first=0, stop=None):
+        """Return the X layers ``first .. stop-1`` as a bool array."""
+        return np.unpackbits(self.bits[first:stop], axis=2, count=self.shape[2]).view(bool)
+
+    def layer(self, index):
+        """Return the X layer ``index`` as a ``(y, z)`` bool array."""
+        return self.unpack(index, index + 1)[0]
+
+    def count(self):
+        """Return the number of solid voxels."""
+        total = 0
+        for first in range(0, self.shape[0], SLAB):
+            total += int(POPCOUNT[self.bits[first:first+SLAB]].sum(dtype=np.int64))
+        return total
+
+    def pad(self, padding):
+        """Return a copy with ``padding`` empty voxels on every side."""
+        m, n, p = self.shape
+        shape = (m + 2*padding, n + 2*padding, p + 2*padding)
+        bits = np.zeros((shape[0], shape[1], -(-shape[2] // 8)), dtype=np.uint8)
+        for first in range(0, m, SLAB):
+            layers = self.unpack(first, first + SLAB)
+            grown = np.zeros((len(layers), shape[1], shape[2]), dtype=bool)
+            grown[:, padding:padding+n, padding:padding+p] = layers
+            bits[padding+first:padding+first+len(layers)] = np.packbits(grown, axis=2)
+        return Occupancy(bits, shape)
+
+    def __array__(self, dtype=None, copy=None):
+        mask = self.unpack()
+        return mask if dtype is None else mask.astype(dtype)
+
+    def __repr__(self):
+        return "Occupancy(shape=%s, %d bytes)" % (self.shape, self.nbytes)
+
+
+def pack(mask):
+    """Pack the bool grid ``mask`` into an :class:`Occupancy`."""
+    mask = np.asarray(mask, dtype=bool)
+    return Occupancy(np.packbits(mask, axis=2), mask.shape)
+
+
+def fromField(u):
+    """Pack the voxels where the field ``u`` is negative.
+
+    These are the voxels image stacks and slice plots draw as solid,
+    :func:`analysis.findVol` also counts the zeros.  The bits are built one
+    X slab at a time.
+    """
+    u = download(u)
+    bits = np.empty((u.shape[0], u.shape[1], -(-u.shape[2] // 8)), dtype=np.uint8)
+    for first in range(0, u.shape[0], SLAB):
+        bits[first:first+SLAB] = np.packbits(u[first:first+SLAB] < 0, axis=2)
+    return Occupancy(bits, u.shape)
+
+
+def isOccupancy(u):
+    """Return True when ``u`` is an :class:`Occupancy`."""
+    return isinstance(u, Occupancy)
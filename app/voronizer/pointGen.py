@@ -1,13 +1,13 @@
-from numba import cuda
+from numba import cuda, float32, njit, prange
+import math
 import numpy as np
-from .Frep import union
+from .backend import use_cuda
+from .device import download, isHandle, onDevice, result
 
-@cuda.reduce
-def sum_reduce(a, b):
-    return a + b
+RAND_BLOCK = 1 << 22  #random draws per slab of genRandPoints
 
 @cuda.jit
-def genRandPointsKernel(d_u, d_r, d_v, threshold):
+def genRandPointsKernel(d_u, d_r, d_v, threshold, d_count):
     i,j, k = cuda.grid(3)
     m,n,p = d_u.shape
     if i < m and j < n and k < p:
@@ -15,36 +15,194 @@ def genRandPointsKernel(d_u, d_r, d_v, threshold):
             #Uses a simple function for the thresholding calculation, 
             #threshold/abs(d_u[i,j,k]) can be replaced with any desired function.
             d_v[i,j,k] = 0
+            cuda.atomic.add(d_count, 0, 1)
+
+@njit(parallel=True, cache=True)
+def genRandPointsKernelCPU(u, r, v, threshold):
+    m,n,p = u.shape
+    count = 0
+    for i in prange(m):
+        for j in range(n):
+            for k in range(p):
+                if u[i,j,k] < 0 and r[i,j,k] < threshold/abs(u[i,j,k]):
+                    v[i,j,k] = 0
+                    count += 1
+    return count
 
 def genRandPoints(u, threshold, tpb=8):
     #u = Voxel model of boundary object.
     #threshold = normalized value to determine how likely it is for each voxel to have a point placed in it.
-    #Outputs a matrix with random points within the boundaries of object u.  The random points are set to 0 while the rest of the matrix is ones.
+    #Outputs a uint8 matrix with random points within the boundaries of object u.  The random points are set to 0 while the rest of the matrix is ones.
+    #The random numbers are drawn one X slab at a time, the same sequence as
+    #a single full size draw without ever holding it.
     x,y,z = u.shape
     threshold=threshold/max(x,y,z) 
+    layers = max(1, RAND_BLOCK//(y*z))
+    count = 0
+    if not use_cuda():
+        h_u = download(u)
+        v = np.ones(u.shape, np.uint8)
+        for first in range(0, x, layers):
+            r = np.random.rand(min(layers, x-first), y, z)
+            count += genRandPointsKernelCPU(h_u[first:first+layers], r, v[first:first+layers], threshold)
+        print(str(count)+" Points")
+        return result(v, u)
     TPBX = TPBY = TPBZ = tpb
-    d_r = cuda.to_device(np.random.rand(x,y,z))
-    d_u = cuda.to_device(u)
-    d_v = cuda.to_device(np.ones(u.shape)) #Generates a matrix for us to plot the points in 
-    gridDims = (x+TPBX-1)//TPBX, (y+TPBY-1)//TPBY, (z+TPBZ-1)//TPBZ
+    d_u = onDevice(u)
+    d_v = cuda.to_device(np.ones(u.shape, np.uint8)) #Generates a matrix for us to plot the points in 
+    d_count = cuda.to_device(np.zeros(1, np.int64))
     blockDims = TPBX, TPBY, TPBZ
-    genRandPointsKernel[gridDims, blockDims](d_u, d_r, d_v, threshold)
-    print(str(int((x*y*z-sum_reduce(cuda.to_device(d_v.copy_to_host().flatten())))+0.5))+" Points") #Prints how many random points were generated.
-    return d_v.copy_to_host()
+    for first in range(0, x, layers):
+        d_r = cuda.to_device(np.random.rand(min(layers, x-first), y, z))
+        gridDims = (d_r.shape[0]+TPBX-1)//TPBX, (y+TPBY-1)//TPBY, (z+TPBZ-1)//TPBZ
+        genRandPointsKernel[gridDims, blockDims](d_u[first:first+layers], d_r, d_v[first:first+layers], threshold, d_count)
+    print(str(int(d_count.copy_to_host()[0]))+" Points") #Prints how many random points were generated.
+    return result(d_v, u)
 
-def explode(u):
-    #u = points, negative = internal
-    m,n,p = u.shape
-    x = u.min(0)
-    y = u.min(1)
-    z = u.min(2)
-    x_stretch = np.ones(u.shape)
-    y_stretch = np.ones(u.shape)
-    z_stretch = np.ones(u.shape)
-    for i in range(m):
-        x_stretch[i,:,:] = x
-    for j in range(n):
-        y_stretch[:,j,:] = y
-    for k in range(p):
-        z_stretch[:,:,k] = z
-    return union(union(x_stretch,y_stretch),z_stretch)-np.ones(u.shape)/2
+def poissonPoints(u, threshold, seed=None, tries=30, cell=4):
+    #u = Voxel model of boundary object.
+    #threshold = same density rule as genRandPoints, a voxel at depth |u| gets
+    #a seed with probability threshold/(max(u.shape)*|u|) on average.
+    #seed = fixed RNG seed for repeatable seeds, None draws a fresh one.
+    #Outputs an (n,3) int32 array of seed voxel indices, a Poisson-disk set
+    #(Bridson) whose local spacing gives the same seed density as
+    #genRandPoints without its full-size random and ones grids.
+    if seed is None:
+        seed = np.random.randint(0, 2**31-1)
+    #Bridson sets with spacing r hold about 0.85/r^3 seeds per voxel.
+    spacing = 0.85*max(u.shape)/threshold
+    points = poissonKernelCPU(download(u), spacing, cell, tries, seed)
+    print(str(len(points))+" Points")
+    return points
+
+def pointGrid(points, shape):
+    #points = (n,3) seed indices from poissonPoints
+    #Outputs the genRandPoints style uint8 matrix, 0s at the seeds and 1s elsewhere.
+    v = np.ones(shape, np.uint8)
+    v[points[:,0], points[:,1], points[:,2]] = 0
+    return v
+
+@njit(cache=True)
+def poissonRadius(u, i, j, k, spacing):
+    return max(1.0, (spacing*abs(u[i,j,k]))**(1/3))
+
+@njit(cache=True)
+def poissonFits(u, points, heads, links, cell, i, j, k, r):
+    #True when no accepted seed lies within r of voxel (i,j,k), scanning the
+    #hash cells that overlap the sphere of radius r.
+    reach = int(math.ceil(r/cell))
+    ci, cj, ck = i//cell, j//cell, k//cell
+    for a in range(max(ci-reach, 0), min(ci+reach+1, heads.shape[0])):
+        for b in range(max(cj-reach, 0), min(cj+reach+1, heads.shape[1])):
+            for c in range(max(ck-reach, 0), min(ck+reach+1, heads.shape[2])):
+                q = heads[a,b,c]
+                while q >= 0:
+                    di = points[q,0]-i
+                    dj = points[q,1]-j
+                    dk = points[q,2]-k
+                    if di*di+dj*dj+dk*dk < r*r:
+                        return False
+                    q = links[q]
+    return True
+
+@njit(cache=True)
+def poissonKernelCPU(u, spacing, cell, tries, seed):
+    np.random.seed(seed)
+    m, n, p = u.shape
+    heads = np.full(((m+cell-1)//cell, (n+cell-1)//cell, (p+cell-1)//cell), -1, np.int32)
+    points = np.empty((1024, 3), np.int32)
+    links = np.empty(1024, np.int32)
+    active = np.empty(1024, np.int32)
+    count = 0
+    for start in np.random.permutation(heads.size):
+        #Try to start a new front in every hash cell so disconnected parts
+        #of the model get seeds too.
+        a = start//(heads.shape[1]*heads.shape[2])
+        b = (start//heads.shape[2])%heads.shape[1]
+        c = start%heads.shape[2]
+        for attempt in range(tries):
+            i = min(a*cell+np.random.randint(cell), m-1)
+            j = min(b*cell+np.random.randint(cell), n-1)
+            k = min(c*cell+np.random.randint(cell), p-1)
+            if u[i,j,k] < 0 and poissonFits(u, points, heads, links, cell, i, j, k, poissonRadius(u, i, j, k, spacing)):
+                break
+        else:
+            continue
+        queue = 0
+        while True:
+            if count == points.shape[0]:
+                points = np.concatenate((points, np.empty_like(points)))
+                links = np.concatenate((links, np.empty_like(links)))
+                active = np.concatenate((active, np.empty_like(active)))
+            points[count,0] = i
+            points[count,1] = j
+            points[count,2] = k
+            links[count] = heads[i//cell,j//cell,k//cell]
+            heads[i//cell,j//cell,k//cell] = count
+            active[queue] = count
+            queue += 1
+            count += 1
+            found = False
+            while queue > 0 and not found:
+                slot = np.random.randint(queue)
+                q = active[slot]
+                r = poissonRadius(u, points[q,0], points[q,1], points[q,2], spacing)
+                for attempt in range(tries):
+                    #Uniform direction, distance between r and 2r.
+                    dz = 2*np.random.random()-1
+                    phi = 2*math.pi*np.random.random()
+                    ring = math.sqrt(1-dz*dz)
+                    dist = r*(1+np.random.random())
+                    i = int(round(points[q,0]+dist*dz))
+                    j = int(round(points[q,1]+dist*ring*math.cos(phi)))
+                    k = int(round(points[q,2]+dist*ring*math.sin(phi)))
+                    if i < 0 or j < 0 or k < 0 or i >= m or j >= n or k >= p or u[i,j,k] >= 0:
+                        continue
+                    if poissonFits(u, points, heads, links, cell, i, j, k, poissonRadius(u, i, j, k, spacing)):
+                        found = True
+                        break
+                if not found:
+                    queue -= 1
+                    active[slot] = active[queue]
+            if not found:
+                break
+    return points[:count].copy()
+
+@cuda.jit
+def seedProfilesKernel(d_u, d_x, d_y, d_z):
+    i,j,k = cuda.grid(3)
+    m,n,p = d_u.shape
+    if i < m and j < n and k < p:
+        value = float32(d_u[i,j,k])
+        cuda.atomic.min(d_x, (j,k), value)
+        cuda.atomic.min(d_y, (i,k), value)
+        cuda.atomic.min(d_z, (i,j), value)
+
+def seedProfiles(u, shape=None, tpb=8):
+    #u = seed matrix from genRandPoints, or an (n,3) array from poissonPoints
+    #together with the grid shape.
+    #Outputs the float32 minimum of u along X, Y and Z, the (y,z), (x,z) and
+    #(x,y) profiles that explode stretches back across the grid.
+    if isHandle(u) and u.onDevice:
+        m,n,p = u.shape
+        profiles = [cuda.to_device(np.full(size, np.inf, np.float32)) for size in ((n,p), (m,p), (m,n))]
+        gridDims = (m+tpb-1)//tpb, (n+tpb-1)//tpb, (p+tpb-1)//tpb
+        seedProfilesKernel[gridDims, (tpb, tpb, tpb)](onDevice(u), *profiles)
+        return tuple(d_f.copy_to_host() for d_f in profiles)
+    u = download(u)
+    if u.ndim == 2:
+        m,n,p = shape
+        x, y, z = np.ones((n,p), np.float32), np.ones((m,p), np.float32), np.ones((m,n), np.float32)
+        x[u[:,1], u[:,2]] = 0
+        y[u[:,0], u[:,2]] = 0
+        z[u[:,0], u[:,1]] = 0
+        return x, y, z
+    return tuple(u.min(axis).astype(np.float32, copy=False) for axis in range(3))
+
+def explode(u, shape=None):
+    #u = points, negative = internal, or an (n,3) array from poissonPoints
+    #together with the grid shape.
+    #Outputs the union of the seed columns along X, Y and Z, offset by -1/2,
+    #broadcast from the three profiles in one pass.
+    x, y, z = seedProfiles(u, shape)
+    return result(np.minimum(np.minimum(x[None,:,:], y[:,None,:]), z[:,:,None])-np.float32(0.5), u)
@@ -0,0 +1,100 @@
+"""Reusable buffers for the grids of a pipeline run.
+
+Every :mod:`Frep`, :mod:`SDF3D` and :mod:`supportGen` call allocates a
+fresh output grid, so a run holds each stage's result until the last
+reference to it goes away.  A :class:`BufferPool` lets the pipeline hand
+grids it no longer needs back with :meth:`BufferPool.release` and hand them
+out again with :meth:`BufferPool.borrow` as the ``out=`` argument of the
+next stage, so the grids alive at once stay close to the working set
+instead of growing with the number of stages.
+
+Buffers are ``float32`` grids on the active backend, wrapped in
+:class:`device.DeviceGrid` handles.  Only grids the pool can safely
+overwrite are kept: views of other arrays, memory mapped cache entries and
+``float16`` storage grids are dropped, as is anything beyond ``limit`` idle
+buffers.
+
+Typical usage::
+
+    from app.voronizer.pool import BufferPool
+    from app.voronizer import Frep as f
+
+    pool = BufferPool()
+    v = f.thicken(u, 2, out=pool.borrow(u.shape))
+    ...
+    pool.release(v)
+"""
+
+import numpy as np
+from numba import cuda
+
+from .backend import use_cuda
+from .device import DeviceGrid, data
+
+
+class BufferPool:
+    """Idle grids kept for reuse, keyed by shape, dtype and backend.
+
+    Parameters
+    ----------
+    limit : int, optional
+        Number of idle buffers kept, released grids past it are left to the
+        garbage collector.
+    """
+
+    def __init__(self, limit=4):
+        self.limit = limit
+        self.idle = {}
+        self.allocated = 0
+        self.reused = 0
+
+    @property
+    def nbytes(self):
+        """Bytes held by idle buffers."""
+        return sum(buffer.nbytes for buffers in self.idle.values() for buffer in buffers)
+
+    def __len__(self):
+        return sum(len(buffers) for buffers in self.idle.values())
+
+    def borrow(self, shape, dtype=np.float32):
+        """Return a handle to a grid of ``shape`` whose contents are undefined.
+
+        An idle buffer is reused when one matches, otherwise a new one is
+        allocated on the active backend.
+        """
+        shape = tuple(int(n) for n in shape)
+        buffers = self.idle.get((shape, np.dtype(dtype).str, use_cuda()))
+        if buffers:
+            self.reused += 1
+            return DeviceGrid(buffers.pop())
+        self.allocated += 1
+        if use_cuda():
+            return DeviceGrid(cuda.device_array(shape, dtype))
+        return DeviceGrid(np.empty(shape, dtype))
+
+    def release(self, *grids):
+        """Hand ``grids`` back once nothing reads them any more.
+
+        Arrays, handles and ``None`` are accepted.  The caller must drop its
+        own references, a released grid may be overwritten by the next
+        :meth:`borrow`.
+        """
+        for u in grids:
+            if u is None:
+                continue
+            buffer = data(u)
+            onGPU = cuda.devicearray.is_cuda_ndarray(buffer)
+            if not onGPU and (type(buffer) is not np.ndarray or not buffer.flags.owndata or not buffer.flags.c_contiguous):
+                continue
+            if buffer.dtype != np.float32 or len(self) >= self.limit:
+                continue
+            buffers = self.idle.setdefault((tuple(buffer.shape), buffer.dtype.str, onGPU), [])
+            if not any(buffer is other for other in buffers):
+                buffers.append(buffer)
+
+    def clear(self):
+        """Drop every idle buffer."""
+        self.idle.clear()
+
+    def __repr__(self):
+        return "BufferPool(%d idle, %d bytes, %d allocated, %d reused)" % (len(self), self.nbytes, self.allocated, self.reused)
@@ -0,0 +1,360 @@
+"""Sparse block grids for narrow band signed distance fields.
+
+A dense distance field spends almost all of its memory on voxels far from
+the surface, whose exact value never matters: only the sign does.  A
+:class:`SparseGrid` splits the volume into ``block``-sized cubes (8 by
+default) and stores full ``float32`` leaves only for the *active* blocks
+near the surface.  Every other block is a *tile*, a single value standing
+for the whole block, usually ``+band`` outside and ``-band`` inside.
+
+:func:`narrowBandSDF` builds the exact Euclidean field of
+:func:`SDF3D.EDTSDF`, clamped to ``[-band, band]``, with an exact distance
+transform of each active block and its surroundings, so only the active
+blocks are ever filled.
+:func:`union`, :func:`intersection`, :func:`subtract`, :func:`thicken` and
+:func:`shell` mirror the :mod:`Frep` helpers on leaves and tiles, and
+:func:`tesselate` runs marching cubes on the blocks that hold the surface.
+
+Typical usage::
+
+    from app.voronizer import sparse
+
+    grid = sparse.narrowBandSDF(occupancy, band=4)
+    walls = sparse.shell(grid, 2)
+    verts, faces = sparse.tesselate(walls, scale)
+
+Values stay exact as long as an operation does not reach past the band,
+e.g. ``thicken`` by less than ``band`` voxels.
+
+With ``PipelineConfig.NARROW_BAND`` set, the pipeline cuts the model shell
+from a narrow band field and meshes every output through :func:`tesselate`.
+"""
+
+import numpy as np
+from numba import njit, prange
+
+from .device import download
+from .SDF3D import EDTRow
+from .meshExport import blockOf, tesselateBlock, weldVertices
+
+BLOCK = 8
+BATCH = 4096  #Blocks gathered at once
+
+
+class SparseGrid:
+    """Volume stored as active ``block``-sized leaves plus constant tiles.
+
+    Parameters
+    ----------
+    shape : tuple of int
+        Shape of the dense grid.
+    leaves : numpy.ndarray
+        ``(n, block, block, block)`` values of the active blocks.
+    slots : numpy.ndarray
+        ``int32`` grid of blocks holding the leaf index of every active
+        block and ``-1`` elsewhere.
+    tiles : numpy.ndarray
+        ``float32`` grid of blocks holding the value of every inactive block.
+    block : int, optional
+        Edge length of a block in voxels.
+    """
+
+    def __init__(self, shape, leaves, slots, tiles, block=BLOCK):
+        self.shape = tuple(int(n) for n in shape)
+        self.leaves = leaves
+        self.slots = slots
+        self.tiles = tiles
+        self.block = block
+
+    @property
+    def active(self):
+        """Number of active blocks."""
+        return len(self.leaves)
+
+    @property
+    def nbytes(self):
+        return self.leaves.nbytes + self.slots.nbytes + self.tiles.nbytes
+
+    def coords(self):
+        """Return the ``(n, 3)`` block indices of the leaves, in leaf order."""
+        coords = np.argwhere(self.slots >= 0)
+        return coords[np.argsort(self.slots[tuple(coords.T)], kind="stable")]
+
+    def expand(self, coords):
+        """Return the values of the blocks at ``coords`` as full leaves.
+
+        Indices past the last block are clamped to it.
+        """
+        coords = np.minimum(coords, np.array(self.slots.shape) - 1)
+        index = tuple(coords.T)
+        slots = self.slots[index]
+        b = self.block
+        out = np.empty((len(coords), b, b, b), np.float32)
+        hit = slots >= 0
+        out[hit] = self.leaves[slots[hit]]
+        out[~hit] = self.tiles[index][~hit, None, None, None]
+        return out
+
+    def toDense(self):
+        """Return the grid as a dense ``float32`` array."""
+        b = self.block
+        nb = self.slots.shape
+        out = np.empty((nb[0]*b, nb[1]*b, nb[2]*b), np.float32)
+        blocks = out.reshape(nb[0], b, nb[1], b, nb[2], b).transpose(0, 2, 4, 1, 3, 5)
+        blocks[...] = self.tiles[..., None, None, None]
+        blocks[tuple(self.coords().T)] = self.leaves
+        m, n, p = self.shape
+        return np.ascontiguousarray(out[:m, :n, :p])
+
+    def __array__(self, dtype=None, copy=None):
+        dense = self.toDense()
+        return dense if dtype is None else dense.astype(dtype)
+
+    def __repr__(self):
+        return "SparseGrid(shape=%s, block=%d, active=%d of %d)" % (self.shape, self.block, self.active, self.slots.size)
+
+
+def blockView(u, block, fill):
+    #Pads u to whole blocks with fill and returns the (bx, by, bz, b, b, b)
+    #view of the padded copy.
+    nb = [-(-n // block) for n in u.shape]
+    padded = np.full([n*block for n in nb], fill, np.float32)
+    padded[:u.shape[0], :u.shape[1], :u.shape[2]] = u
+    return padded.reshape(nb[0], block, nb[1], block, nb[2], block).transpose(0, 2, 4, 1, 3, 5)
+
+
+def fromDense(u, band, block=BLOCK):
+    """Convert the dense field ``u`` to a :class:`SparseGrid`.
+
+    Blocks where any value lies inside ``(-band, band)`` stay active, the
+    others become tiles of ``+band`` or ``-band`` after the sign of their
+    first voxel.  Values are clamped to ``[-band, band]``.
+    """
+    u = np.clip(download(u), -band, band)
+    blocks = blockView(u, block, band)
+    near = (np.abs(blocks) < band).any(axis=(3, 4, 5))
+    tiles = np.where(blocks[..., 0, 0, 0] > 0, band, -band).astype(np.float32)
+    return pack(u.shape, blocks, near, tiles, block)
+
+
+def pack(shape, blocks, active, tiles, block):
+    #Builds a SparseGrid from a block view and its mask of active blocks.
+    slots = np.full(active.shape, -1, np.int32)
+    coords = np.argwhere(active)
+    slots[tuple(coords.T)] = np.arange(len(coords), dtype=np.int32)
+    leaves = np.ascontiguousarray(blocks[tuple(coords.T)], dtype=np.float32)
+    return SparseGrid(shape, leaves, slots, tiles, block)
+
+
+def surfaceVoxels(u, sign=1):
+    """Return the ``(n, 3)`` voxels of ``sign*u<=0`` next to a voxel outside it.
+
+    Only these voxels can be the nearest seed of :func:`SDF3D.squaredEDT`,
+    since any other seed has a closer neighbour that is also a seed.  The
+    grid is scanned one X layer at a time.
+    """
+    found = []
+    for i in range(u.shape[0]):
+        layer = sign*u[i] <= 0
+        edge = np.zeros_like(layer)
+        for other in (i - 1, i + 1):
+            if 0 <= other < u.shape[0]:
+                edge |= sign*u[other] > 0
+        edge[1:] |= ~layer[:-1]
+        edge[:-1] |= ~layer[1:]
+        edge[:, 1:] |= ~layer[:, :-1]
+        edge[:, :-1] |= ~layer[:, 1:]
+        j, k = np.nonzero(layer & edge)
+        found.append(np.column_stack((np.full(len(j), i), j, k)))
+    return np.concatenate(found).astype(np.int32)
+
+
+@njit(parallel=True, cache=True)
+def windowEDTCPU(windows, d, sign):
+    #Squared EDT of every (w, w, w) window into d, seeds where sign*u<=0.
+    count, w = windows.shape[0], windows.shape[1]
+    for a in prange(count):
+        f = np.empty(w, np.float64)
+        row = np.empty(w, np.float64)
+        v = np.empty(w, np.int64)
+        z = np.empty(w+1, np.float64)
+        for i in range(w):
+            for j in range(w):
+                for k in range(w):
+                    d[a,i,j,k] = 0 if sign*windows[a,i,j,k]<=0 else np.inf
+        for axis in range(3):
+            for i in range(w):
+                for j in range(w):
+                    for q in range(w):
+                        if axis == 0:
+                            f[q] = d[a,q,i,j]
+                        elif axis == 1:
+                            f[q] = d[a,i,q,j]
+                        else:
+                            f[q] = d[a,i,j,q]
+                    EDTRow(f, row, v, z)
+                    for q in range(w):
+                        if axis == 0:
+                            d[a,q,i,j] = row[q]
+                        elif axis == 1:
+                            d[a,i,q,j] = row[q]
+                        else:
+                            d[a,i,j,q] = row[q]
+
+
+def narrowBandSDF(u, band=4.0, block=BLOCK):
+    """Signed distance field of the binary volume ``u`` within ``band`` voxels.
+
+    Matches :func:`SDF3D.EDTSDF` clamped to ``[-band, band]``, without
+    allocating a dense field.  Blocks holding a surface voxel and the blocks
+    within ``band`` of them are active.  Each is filled by an exact distance
+    transform of the block grown by ``band`` voxels on every side, which
+    holds every seed closer than ``band``.
+
+    Parameters
+    ----------
+    u : numpy.ndarray or DeviceGrid
+        Input voxel grid, negative inside.
+    band : float, optional
+        Half width of the band in voxels, also the magnitude of the tiles.
+    block : int, optional
+        Edge length of a block in voxels.
+
+    Returns
+    -------
+    SparseGrid
+        The clamped distance field.
+    """
+    u = download(u)
+    nb = [-(-n // block) for n in u.shape]
+    #Blocks holding the surface, grown by enough blocks to cover the band.
+    active = np.zeros(nb, bool)
+    for sign in (1, -1):
+        active[tuple((surfaceVoxels(u, sign) // block).T)] = True
+    reach = int(np.ceil(band / block))
+    grown = np.zeros(np.add(nb, 2*reach), bool)
+    for a in range(2*reach + 1):
+        for b in range(2*reach + 1):
+            for c in range(2*reach + 1):
+                grown[a:a+nb[0], b:b+nb[1], c:c+nb[2]] |= active
+    active = grown[reach:reach+nb[0], reach:reach+nb[1], reach:reach+nb[2]]
+
+    corners = np.minimum(np.argwhere(np.ones(nb, bool)) * block, np.array(u.shape) - 1)
+    tiles = np.where(u[tuple(corners.T)] > 0, band, -band).astype(np.float32).reshape(nb)
+    slots = np.full(nb, -1, np.int32)
+    coords = np.argwhere(active)
+    slots[tuple(coords.T)] = np.arange(len(coords), dtype=np.int32)
+    leaves = np.empty((len(coords), block, block, block), np.float32)
+    margin = int(np.ceil(band))
+    span = np.arange(-margin, block + margin)
+    center = slice(margin, margin + block)
+    for first in range(0, len(coords), BATCH):
+        origins = coords[first:first+BATCH] * block
+        #Windows around the blocks, NaN past the grid is a seed of neither sign.
+        axes = [origins[:, axis, None] + span for axis in range(3)]
+        inGrid = [(index >= 0) & (index < n) for index, n in zip(axes, u.shape)]
+        axes = [np.clip(index, 0, n - 1) for index, n in zip(axes, u.shape)]
+        windows = u[axes[0][:, :, None, None], axes[1][:, None, :, None], axes[2][:, None, None, :]].astype(np.float32)
+        windows[~(inGrid[0][:, :, None, None] & inGrid[1][:, None, :, None] & inGrid[2][:, None, None, :])] = np.nan
+        values = windows[:, center, center, center]
+        out = np.zeros(values.shape, np.float32)
+        d = np.empty(windows.shape, np.float32)
+        for sign in (1, -1):
+            #Positive voxels measure to the inside, negative ones to the outside.
+            windowEDTCPU(windows, d, sign)
+            pick = sign*values > 0
+            out[pick] = sign*np.minimum(np.sqrt(d[:, center, center, center][pick]), band)
+        leaves[first:first+len(origins)] = out
+    return SparseGrid(u.shape, leaves, slots, tiles, block)
+
+
+def apply(op, *grids):
+    """Combine grids of the same layout voxel by voxel.
+
+    ``op`` is called once on the stacked leaves of every block active in
+    any input and once on the tiles.  Resulting leaves of a single value
+    are turned back into tiles.
+    """
+    first = grids[0]
+    for grid in grids[1:]:
+        if grid.shape != first.shape or grid.block != first.block:
+            raise ValueError("Sparse grids differ in shape or block size")
+    active = np.logical_or.reduce([grid.slots >= 0 for grid in grids])
+    coords = np.argwhere(active)
+    leaves = op(*(grid.expand(coords) for grid in grids)).astype(np.float32, copy=False)
+    tiles = op(*(grid.tiles for grid in grids)).astype(np.float32, copy=False)
+    flat = leaves.reshape(len(leaves), -1)
+    keep = (flat != flat[:, :1]).any(axis=1)
+    index = tuple(coords[~keep].T)
+    tiles[index] = flat[~keep, 0]
+    slots = np.full(active.shape, -1, np.int32)
+    slots[tuple(coords[keep].T)] = np.arange(int(keep.sum()), dtype=np.int32)
+    return SparseGrid(first.shape, np.ascontiguousarray(leaves[keep]), slots, tiles, first.block)
+
+
+def union(u, v):
+    """Sparse :func:`Frep.union`."""
+    return apply(np.minimum, u, v)
+
+
+def intersection(u, v):
+    """Sparse :func:`Frep.intersection`."""
+    return apply(np.maximum, u, v)
+
+
+def subtract(u, v):
+    """Sparse :func:`Frep.subtract`, ``u`` is the cutting tool, ``v`` the base."""
+    return apply(lambda a, b: np.maximum(-a, b), u, v)
+
+
+def thicken(u, weight):
+    """Sparse :func:`Frep.thicken`, exact while ``|weight|`` stays below the band."""
+    return apply(lambda a: a - np.float32(weight), u)
+
+
+def shell(uSDF, sT):
+    """Sparse :func:`Frep.shell`."""
+    return apply(lambda a: np.maximum(a, -a - np.float32(sT)), uSDF)
+
+
+def tesselate(grid, scale, dtype=np.float64):
+    """Marching cubes on the blocks of ``grid`` that hold the zero level.
+
+    Each active block is meshed with one extra layer of samples from its
+    neighbours, as is the inactive block before it along every axis, since
+    the cells it shares with an active block may cross the surface.  Shared
+    vertices are welded like :func:`meshExport.tesselateChunked`.
+
+    Returns
+    -------
+    tuple
+        ``(verts, faces)`` with vertices in model units.
+    """
+    b = grid.block
+    active = grid.slots >= 0
+    #Blocks whose last layer of cells reaches into an active block.
+    candidates = active.copy()
+    candidates[:-1] |= active[1:]
+    candidates[:, :-1] |= active[:, 1:]
+    candidates[:, :, :-1] |= active[:, :, 1:]
+    coords = np.argwhere(candidates)
+    shifts = np.indices((2, 2, 2)).reshape(3, -1).T
+    results = []
+    for first in range(0, len(coords), BATCH):
+        batch = coords[first:first+BATCH]
+        window = np.empty((len(batch), 2*b, 2*b, 2*b), np.float32)
+        for a, c, d in shifts:
+            window[:, a*b:(a+1)*b, c*b:(c+1)*b, d*b:(d+1)*b] = grid.expand(batch + (a, c, d))
+        for coord, values in zip(batch, window):
+            origin = coord * b
+            size = np.minimum(b + 1, np.array(grid.shape) - origin)
+            block = blockOf(values[:size[0], :size[1], :size[2]], (0, 0, 0), b)
+            if block is not None:
+                results.append(tesselateBlock(block, origin))
+    if not results:
+        return np.empty((0, 3), dtype=dtype), np.empty((0, 3), dtype=np.int32)
+    offsets = np.cumsum([0] + [len(result[0]) for result in results])
+    verts = np.concatenate([result[0] for result in results])
+    faces = np.concatenate([result[1] + offset for result, offset in zip(results, offsets)])
+    verts, faces = weldVertices(verts, faces)
+    return (verts * np.asarray(scale, dtype=np.float64)).astype(dtype, copy=False), faces
@@ -0,0 +1,175 @@
+"""Support structures in two passes over the grid.
+
+The support below a model is built from its signed distance field ``u``
+and its downward :func:`Frep.projection` ``projected``:
+
+* :func:`supportSpace` returns the region that receives the Voronoi
+  infill, ``max(1-u, projected)`` widened by one layer along X;
+* :func:`finishSupport` adds the table holding the model to the support
+  Voronoi and, optionally, cuts the perforations along the seed axes.
+
+Perforations are the union of every seed's X, Y and Z columns, dilated by
+one voxel towards -X, +Y and +Z.  Since each column family only depends
+on two axes, the dilation runs on the three 2-D :func:`seedProfiles` from
+:func:`perforationProfiles` and the columns are broadcast inside the
+kernel, so no full size explosion grid is ever built.
+
+Typical usage::
+
+    from app.voronizer import supportGen
+
+    support = supportGen.supportSpace(u, projected)
+    voronoi = voronize(support, seeds, ...)
+    profiles = supportGen.perforationProfiles(seeds, voronoi.shape)
+    voronoi = supportGen.finishSupport(voronoi, u, projected, profiles)
+
+The results match chaining the :mod:`Frep` helpers the pipeline used
+before, with translations wrapping around like :func:`Frep.translate`.
+"""
+
+from numba import cuda, njit, prange
+import numpy as np
+
+from .backend import use_cuda
+from .device import download, onDevice, result, target
+from .pointGen import seedProfiles
+
+@cuda.jit
+def supportSpaceKernel(d_u, d_p, d_s):
+    i, j, k = cuda.grid(3)
+    m, n, p = d_u.shape
+    if i < m and j < n and k < p:
+        a = (i+1) % m
+        d_s[i,j,k] = max(max(1-d_u[i,j,k], d_p[i,j,k]), max(1-d_u[a,j,k], d_p[a,j,k]))
+
+@njit(parallel=True, cache=True)
+def supportSpaceKernelCPU(u, pr, s):
+    m, n, p = u.shape
+    for i in prange(m):
+        a = (i+1) % m
+        for j in range(n):
+            for k in range(p):
+                s[i,j,k] = max(max(1-u[i,j,k], pr[i,j,k]), max(1-u[a,j,k], pr[a,j,k]))
+
+def supportSpace(u, projected, tpb=8, out=None):
+    """Return the region below ``u`` that receives the support infill.
+
+    Parameters
+    ----------
+    u : numpy.ndarray or DeviceGrid
+        Signed distance field of the model.
+    projected : numpy.ndarray or DeviceGrid
+        :func:`Frep.projection` of ``u``.
+    tpb : int, optional
+        CUDA threads per block.
+    out : numpy.ndarray or DeviceGrid, optional
+        ``float32`` grid of ``u.shape`` receiving the result, neither ``u``
+        nor ``projected``.
+
+    Returns
+    -------
+    numpy.ndarray or DeviceGrid
+        ``float32`` field, negative inside the support region.
+    """
+    dims = u.shape
+    if not use_cuda():
+        s = target(out, u, False)
+        if s is None:
+            s = np.empty(dims, np.float32)
+        supportSpaceKernelCPU(download(u), download(projected), s)
+        return result(s, u, projected, out)
+    d_s = target(out, u, True)
+    if d_s is None:
+        d_s = cuda.device_array(dims, np.float32)
+    gridDims = (dims[0]+tpb-1)//tpb, (dims[1]+tpb-1)//tpb, (dims[2]+tpb-1)//tpb
+    supportSpaceKernel[gridDims, (tpb, tpb, tpb)](onDevice(u), onDevice(projected), d_s)
+    return result(d_s, u, projected, out)
+
+def perforationProfiles(seeds, shape=None):
+    """Return the dilated ``(x, y, z)`` seed profiles of the perforations.
+
+    ``seeds`` is the seed matrix of :func:`pointGen.genRandPoints` or the
+    ``(n, 3)`` array of :func:`pointGen.poissonPoints` with the grid
+    ``shape``.  Each profile is widened by one voxel towards -X, +Y and +Z
+    along the axes it spans.
+    """
+    X, Y, Z = (0, -1), (0, 1), (0, 1)
+    grown = []
+    #The x profile spans (Y, Z), y spans (X, Z) and z spans (X, Y).
+    for profile, (first, second) in zip(seedProfiles(seeds, shape), ((Y, Z), (X, Z), (X, Y))):
+        profile = np.asarray(profile, np.float32)
+        out = np.array(profile)
+        for a in first:
+            for b in second:
+                if a or b:
+                    np.minimum(out, np.roll(profile, (a, b), axis=(0, 1)), out=out)
+        grown.append(out)
+    return tuple(grown)
+
+@cuda.jit
+def finishSupportKernel(d_v, d_u, d_p, d_x, d_y, d_z, perforate, d_out):
+    i, j, k = cuda.grid(3)
+    m, n, p = d_v.shape
+    if i < m and j < n and k < p:
+        table = max(max(1-d_u[i,j,k], d_p[i,j,k]), max(-d_u[(i+1)%m,j,k], d_u[(i+4)%m,j,k]))
+        cell = d_v[i,j,k]
+        if perforate:
+            cell = max(0.5-min(d_x[j,k], min(d_y[i,k], d_z[i,j])), cell)
+        d_out[i,j,k] = min(table, cell)
+
+@njit(parallel=True, cache=True)
+def finishSupportKernelCPU(v, u, pr, x, y, z, perforate, out):
+    m, n, p = v.shape
+    for i in prange(m):
+        a = (i+1) % m
+        b = (i+4) % m
+        for j in range(n):
+            for k in range(p):
+                table = max(max(1-u[i,j,k], pr[i,j,k]), max(-u[a,j,k], u[b,j,k]))
+                cell = v[i,j,k]
+                if perforate:
+                    cell = max(0.5-min(x[j,k], min(y[i,k], z[i,j])), cell)
+                out[i,j,k] = min(table, cell)
+
+def finishSupport(voronoi, u, projected, profiles=None, tpb=8, out=None):
+    """Join the table to the support ``voronoi`` and cut its perforations.
+
+    Parameters
+    ----------
+    voronoi : numpy.ndarray or DeviceGrid
+        Voronoi infill of :func:`supportSpace`.
+    u : numpy.ndarray or DeviceGrid
+        Signed distance field of the model.
+    projected : numpy.ndarray or DeviceGrid
+        :func:`Frep.projection` of ``u``.
+    profiles : tuple, optional
+        :func:`perforationProfiles` of the support seeds, no perforations
+        are cut when omitted.
+    tpb : int, optional
+        CUDA threads per block.
+    out : numpy.ndarray or DeviceGrid, optional
+        ``float32`` grid of ``voronoi.shape`` receiving the result, it may
+        be ``voronoi`` but neither ``u`` nor ``projected``.
+
+    Returns
+    -------
+    numpy.ndarray or DeviceGrid
+        ``float32`` support field.
+    """
+    dims = voronoi.shape
+    perforate = profiles is not None
+    if not perforate:
+        profiles = (np.ones((1, 1), np.float32),)*3
+    if not use_cuda():
+        h_out = target(out, voronoi, False)
+        if h_out is None:
+            h_out = np.empty(dims, np.float32)
+        finishSupportKernelCPU(download(voronoi), download(u), download(projected), *profiles, perforate, h_out)
+        return result(h_out, voronoi, u, projected, out)
+    d_out = target(out, voronoi, True)
+    if d_out is None:
+        d_out = cuda.device_array(dims, np.float32)
+    gridDims = (dims[0]+tpb-1)//tpb, (dims[1]+tpb-1)//tpb, (dims[2]+tpb-1)//tpb
+    d_profiles = [cuda.to_device(profile) for profile in profiles]
+    finishSupportKernel[gridDims, (tpb, tpb, tpb)](onDevice(voronoi), onDevice(u), onDevice(projected), *d_profiles, perforate, d_out)
+    return result(d_out, voronoi, u, projected, out)
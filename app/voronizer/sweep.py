@@ -0,0 +1,147 @@
+"""Parameter sweeps over the Voronoi cell settings of one model.
+
+Trying several cell sizes on a model with :func:`run_pipeline` repeats the
+voxelization, the distance field and the jump flood for every variant
+although only the last, cheap steps depend on the wall and shell
+thickness.  :func:`runSweep` shares that work:
+
+* the model is voxelized and converted to a distance field once;
+* seeds, jump flood and the Voronoi wall field are computed once per
+  ``MODEL_THRESH`` value (and once for the supports);
+* only ``thicken``, ``intersection`` and ``shell`` run per
+  ``MODEL_CELL``/``MODEL_SHELL``/``SUPPORT_CELL`` variant.
+
+Typical usage::
+
+    from app.voronizer import PipelineConfig
+    from app.voronizer.sweep import runSweep
+
+    grid = {"MODEL_THRESH": [0.1, 0.2], "MODEL_CELL": [0.9, 1.2, 1.5]}
+    runSweep(PipelineConfig(FILE_NAME="vase.stl"), grid, "results")
+"""
+
+from __future__ import annotations
+
+import itertools
+import json
+import os
+import time
+from dataclasses import replace
+
+from . import Frep as f
+from . import backend
+from . import device
+from . import supportGen
+from .analysis import findVol
+from .main import loadModel, placeSeeds, stageCache, supportRegion
+from .meshExport import generateMesh
+from .SDF3D import xHeight
+from .voronize import trimVoronoi, voronoiField
+
+SWEEP_FIELDS = ("MODEL_THRESH", "MODEL_CELL", "MODEL_SHELL", "SUPPORT_CELL")
+
+
+def parseGrid(pairs):
+    """Convert ``["KEY=V1,V2", ...]`` into a sweep grid.
+
+    Raises
+    ------
+    ValueError
+        If a key is not one of :data:`SWEEP_FIELDS`.
+    """
+    grid = {}
+    for pair in pairs:
+        key, _, values = pair.partition("=")
+        key = key.strip().upper()
+        if key not in SWEEP_FIELDS:
+            raise ValueError("Cannot sweep '%s', choose from %s" % (key, ", ".join(SWEEP_FIELDS)))
+        kind = int if key == "MODEL_SHELL" else float
+        grid[key] = [kind(value) for value in values.split(",")]
+    return grid
+
+
+def runSweep(config, grid, outputDir=""):
+    """Voronize one model for every combination of ``grid``.
+
+    Parameters
+    ----------
+    config : PipelineConfig
+        Base settings, fields missing from ``grid`` keep their value.
+    grid : dict
+        Maps fields of :data:`SWEEP_FIELDS` to lists of values.
+    outputDir : str, optional
+        Folder receiving one mesh per variant and ``sweep.json``.  Nothing
+        is written when empty.
+
+    Returns
+    -------
+    list[dict] or None
+        One entry per combination with its ``params``, ``volumes`` and
+        ``masses`` (g) and ``meshes`` mapping mesh names to
+        ``(verts, faces)``, or ``None`` when the configuration is rejected.
+    """
+    for key in grid:
+        if key not in SWEEP_FIELDS:
+            raise ValueError("Cannot sweep '%s', choose from %s" % (key, ", ".join(SWEEP_FIELDS)))
+    start = time.time()
+    backend.set_backend(config.BACKEND)
+    device.set_precision(config.PRECISION)
+    if outputDir:
+        os.makedirs(outputDir, exist_ok=True)
+    cached = stageCache(config)
+    model = loadModel(config, cached)
+    if model is None:
+        return
+    origShape, scale, shortName, modelImport, params = model
+    origShape = device.upload(origShape)
+    keys = list(grid)
+    combos = [dict(zip(keys, values)) for values in itertools.product(*(grid[key] for key in keys))]
+
+    #Everything that does not depend on the wall thickness, once per seed set.
+    fields = {}
+    if config.MODEL:
+        seedShape = f.shell(origShape, 5, config.TPB) if config.AESTHETIC else origShape
+        for thresh in dict.fromkeys(combo.get("MODEL_THRESH", config.MODEL_THRESH) for combo in combos):
+            objectPts = placeSeeds(seedShape, thresh, config)
+            fields[thresh] = device.upload(voronoiField(objectPts, tpb=config.TPB, sdfMethod=config.SDF_METHOD, shape=origShape.shape, engine=config.CELL_ENGINE))
+    if config.SUPPORT:
+        support, projected = supportRegion(origShape, config, cached, params, plot=False)
+        supportPts = placeSeeds(cached("xHeight", params, lambda: xHeight(support, config.TPB)), config.SUPPORT_THRESH, config)
+        supportField = device.upload(voronoiField(supportPts, tpb=config.TPB, sdfMethod=config.SDF_METHOD, shape=support.shape, engine=config.CELL_ENGINE))
+        profiles = supportGen.perforationProfiles(supportPts, support.shape) if config.PERFORATE else None
+
+    report = []
+    supports = {}
+    for index, combo in enumerate(combos):
+        variant = replace(config, **combo)
+        label = shortName+"_Voronoi_"+str(index)
+        entry = {"name": label, "params": combo, "volumes": {}, "masses": {}, "meshes": {}}
+        parts = {}
+        if config.MODEL:
+            objectVoronoi = trimVoronoi(fields[variant.MODEL_THRESH], origShape, variant.MODEL_CELL, variant.MODEL_SHELL, config.TPB)
+            entry["volumes"]["Object"] = findVol(objectVoronoi, scale, config.MAT_DENSITY, label)
+            if config.AESTHETIC:
+                objectVoronoi = f.union(objectVoronoi, f.thicken(origShape, -5), config.TPB)
+            parts[label] = objectVoronoi
+        if config.SUPPORT:
+            if variant.SUPPORT_CELL not in supports:
+                supportVoronoi = trimVoronoi(supportField, support, variant.SUPPORT_CELL, 0, config.TPB)
+                supportVoronoi = supportGen.finishSupport(supportVoronoi, origShape, projected, profiles, config.TPB)
+                supports[variant.SUPPORT_CELL] = (supportVoronoi, findVol(supportVoronoi, scale, config.MAT_DENSITY, label+"Support"))
+            supportVoronoi, entry["volumes"]["Support"] = supports[variant.SUPPORT_CELL]
+            if config.MODEL and not config.SEPARATE_SUPPORTS:
+                parts[label] = f.union(parts[label], supportVoronoi, config.TPB)
+            else:
+                parts[label+"Support" if config.MODEL else label] = supportVoronoi
+        entry["masses"] = {name: config.MAT_DENSITY*vol/1000 for name, vol in entry["volumes"].items()}
+        for name, u in parts.items():
+            if config.SMOOTH:
+                u = f.smooth(u, tpb=config.TPB)
+            entry["meshes"][name] = generateMesh(device.download(u), scale, modelName=name if outputDir else '', fileFormat=config.MESH_FORMAT, chunk=config.MESH_CHUNK, workers=config.MESH_WORKERS, outputDir=outputDir)
+        report.append(entry)
+    if outputDir:
+        summary = [{key: entry[key] for key in ("name", "params", "volumes", "masses")} for entry in report]
+        with open(os.path.join(outputDir, "sweep.json"), "w") as out:
+            json.dump({"seconds": round(time.time() - start, 2), "variants": summary}, out, indent=2)
+    print("Sweep of "+str(len(report))+" variants took "+str(round(time.time()-start,2))+" seconds.")
+    return report
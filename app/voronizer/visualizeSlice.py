@@ -1,8 +1,10 @@
 import matplotlib.pyplot as plt
 import os  # Just used to set up file directory
 import numpy as np
-from numba import cuda
+from numba import cuda, njit, prange
 from PIL import Image
+from .backend import use_cuda
+from .occupancy import isOccupancy
 
 def slicePlot(u,sliceLocation,titlestring='Plot',save=False,axis = "x"):
     #Plots a slice of matrix u cut at sliceLocation, with the negative values (voxels inside the object) set to teal.
@@ -35,7 +37,7 @@ def contourPlot(u,sliceLocation,titlestring='Plot',save=False,axis = "x"):
     if save:
         fig.savefig(os.path.join(os.path.dirname(__file__),'Output',titlestring+'.png'))
 
-def generateImageStack(model,modelColor,support,supportColor,sliceLocations=[],background=[0,0,0],name="Model"):
+def generateImageStack(model,modelColor,support,supportColor,sliceLocations=[],background=[0,0,0],name="Model",outputDir=None):
     #model = 3D voxel representation of model
     #modelColor = [R,G,B] color for model
     #support = 3D voxel representation of support
@@ -43,21 +45,39 @@ def generateImageStack(model,modelColor,support,supportColor,sliceLocations=[],b
     #sliceLocations = x indices for slice to be taken from, vector, defaults to all
     #background = [R,G,B] color for non-solid voxels, defaults to black
     #name = name of the model, defaults to Model
+    #outputDir = folder receiving the stack, defaults to the package Output folder
+    #model and support may also be bit-packed Occupancy grids, only the
+    #slices being written are expanded.
     x,y,z = support.shape
     print("Generating image stack...")
-    try: os.mkdir(os.path.join(os.path.dirname(__file__),'Output',name+" image stack"))
-    except: pass
-    imageModel = setColor(model,modelColor,background)
-    imageSupport = setColor(support,supportColor,background)
-    completePicture = imageSupport+imageModel
+    stackDir = os.path.join(outputDir or os.path.join(os.path.dirname(__file__),'Output'),name+" image stack")
+    os.makedirs(stackDir, exist_ok=True)
+    if isOccupancy(model) or isOccupancy(support):
+        colorModel = np.asarray(modelColor, dtype=np.uint8)
+        colorSupport = np.asarray(supportColor, dtype=np.uint8)
+        colorBackground = np.asarray(background, dtype=np.uint8)
+        def slicePicture(val):
+            return np.where(solidLayer(support, val)[:,:,None], colorSupport, colorBackground)+np.where(solidLayer(model, val)[:,:,None], colorModel, colorBackground)
+    else:
+        imageModel = setColor(model,modelColor,background)
+        imageSupport = setColor(support,supportColor,background)
+        completePicture = imageSupport+imageModel
+        def slicePicture(val):
+            return completePicture[val,:,:,:]
     if not sliceLocations:
         sliceLocations = range(x)
     for val in sliceLocations:
-        picture = completePicture[val,:,:,:]
+        picture = slicePicture(val)
         img = Image.fromarray(picture, 'RGB')
-        img.save(os.path.join(os.path.dirname(__file__),'Output',name+" image stack",str(val)+name+'.png'))
+        img.save(os.path.join(stackDir,str(val)+name+'.png'))
     print("Image Stack Complete!")
     
+def solidLayer(u, index):
+    #Bool (y, z) mask of the solid voxels of X layer index.
+    if isOccupancy(u):
+        return u.layer(index)
+    return u[index] < 0
+
 @cuda.jit
 def setColorKernel(d_u,d_v,color,background):
     i,j, k = cuda.grid(3)
@@ -67,12 +87,27 @@ def setColorKernel(d_u,d_v,color,background):
             d_v[i,j,k] = color
         else:
             d_v[i,j,k] = background
+
+@njit(parallel=True, cache=True)
+def setColorKernelCPU(u, image, color, background):
+    m,n,p = u.shape
+    for i in prange(m):
+        for j in range(n):
+            for k in range(p):
+                if u[i,j,k] < 0:
+                    image[i,j,k,:] = color
+                else:
+                    image[i,j,k,:] = background
     
 def setColor(u, color, background, tpb=8):
     #u = 3D voxel representation of model
     #color = [R,G,B] value desired for that model
     #background = [R,G,B] value desired for voxels outside of the model
     x,y,z = u.shape
+    if not use_cuda():
+        image = np.empty([x,y,z,3],dtype=np.uint8)
+        setColorKernelCPU(u, image, np.asarray(color, dtype=np.uint8), np.asarray(background, dtype=np.uint8))
+        return image
     TPBX = TPBY = TPBZ = tpb
     d_u = cuda.to_device(u)
     d_v = cuda.to_device(np.ones([x,y,z],dtype=np.uint8))
@@ -1,7 +1,10 @@
 from .visualizeSlice import slicePlot, contourPlot
 from . import Frep as f
-from .SDF3D import SDF3D, jumpFlood
-from numba import cuda
+from .SDF3D import SDF3D, jumpFlood, jumpFloodPoints
+from .backend import use_cuda
+from .device import download, isHandle, onDevice, result, upload
+from numba import cuda, njit, prange
+from scipy.spatial import cKDTree
 import numpy as np
 
 def voronize(
@@ -15,12 +18,22 @@ def voronize(
     sliceAxis="X",
     order=2,
     tpb=8,
+    sdfMethod="jfa",
+    plot=True,
+    engine="jfa",
 ):
     #origObject = voxel model of original object, negative = inside
-    #seedPoints = same-size matrix with 0s at the location of each seed point, 1s elsewhere
+    #seedPoints = same-size matrix with 0s at the location of each seed point, 1s elsewhere,
+    #   or an (n,3) array of seed indices from poissonPoints
     #wallThickness  = desired minimum thickness of cell walls (mm).
     #shellThickness = desired minimum thickness of shell (mm), 0 if no shell
     #name = If given a value, the name of the model, activates progress plots.
+    #sdfMethod = "jfa" or "edt", the engine used for the wall distance field.
+    #plot = False suppresses the progress plots even when name is given.
+    #engine = "jfa" labels the cells by jump flooding, "kdtree" with exact
+    #   nearest seed queries on the CPU, see labelCells.
+    #origObject and seedPoints may be DeviceGrid handles, the result is then
+    #a handle too and only the progress plots copy data back to the host.
     resX, resY, resZ = origObject.shape
     if sliceLocation == 0:
         if sliceAxis == "X" or sliceAxis == "x":
@@ -29,27 +42,131 @@ def voronize(
             sliceLocation = resY//2
         else:
             sliceLocation = resZ//2
-    seedPoints = jumpFlood(seedPoints, order)
-    if name !="":
-        contourPlot(seedPoints[:,:,:,3],sliceLocation,titlestring="SDF of the Points for "+name,axis = sliceAxis)
-    voronoi = wallFinder(seedPoints)
-    voronoi = SDF3D(voronoi)
-    if name !="":
-        slicePlot(voronoi,sliceLocation,titlestring="Voronoi Structure for "+name,axis = sliceAxis)
+    if engine == "kdtree":
+        voronoi = labelWalls(labelCells(seedPoints, origObject.shape, order))
+    else:
+        seedPoints = flood(seedPoints, origObject.shape, order, tpb)
+        if name !="" and plot:
+            contourPlot(download(seedPoints)[:,:,:,3],sliceLocation,titlestring="SDF of the Points for "+name,axis = sliceAxis)
+        voronoi = wallFinder(seedPoints, tpb)
+    if isHandle(origObject):
+        voronoi = upload(voronoi)
+    #The wall grid is fresh, every step below writes back into it.
+    voronoi = SDF3D(voronoi, tpb=tpb, method=sdfMethod, out=voronoi)
+    if name !="" and plot:
+        slicePlot(download(voronoi),sliceLocation,titlestring="Voronoi Structure for "+name,axis = sliceAxis)
     wallThickness=cellThickness/2-1
-    voronoi = f.intersection(f.thicken(voronoi,wallThickness),origObject)
-    if name !="":
-        slicePlot(voronoi, sliceLocation, titlestring=(name+' Trimmed and Thinned'),axis = sliceAxis)
+    voronoi = f.intersection(f.thicken(voronoi,wallThickness, tpb, out=voronoi),origObject, tpb, out=voronoi)
+    if name !="" and plot:
+        slicePlot(download(voronoi), sliceLocation, titlestring=(name+' Trimmed and Thinned'),axis = sliceAxis)
     if shellThickness>0:
-        u_shell = f.shell(origObject,shellThickness)
-        voronoi = f.union(u_shell,voronoi)
-        if name !="":
-            slicePlot(voronoi, sliceLocation, titlestring=name+' With Shell',axis = sliceAxis)
+        u_shell = f.shell(origObject,shellThickness, tpb)
+        voronoi = f.union(voronoi,u_shell, tpb, out=voronoi)
+        if name !="" and plot:
+            slicePlot(download(voronoi), sliceLocation, titlestring=name+' With Shell',axis = sliceAxis)
     if name =="":
         name = "Model"
     print("Voronize for " + name + " Complete!")
     return voronoi
 
+def voronoiField(seedPoints, order=2, tpb=8, sdfMethod="jfa", shape=None, engine="jfa"):
+    #seedPoints = same-size matrix with 0s at the location of each seed point, 1s elsewhere,
+    #   or an (n,3) array of seed indices together with the grid shape
+    #Outputs the signed distance to the cell walls of the seeds, the part of
+    #voronize that does not depend on the wall or shell thickness.
+    if engine == "kdtree":
+        voronoi = labelWalls(labelCells(seedPoints, shape, order))
+    else:
+        voronoi = wallFinder(flood(seedPoints, shape, order, tpb), tpb)
+    return SDF3D(voronoi, tpb=tpb, method=sdfMethod, out=voronoi)
+
+def trimVoronoi(voronoi, origObject, cellThickness, shellThickness, tpb=8):
+    #voronoi = output of voronoiField
+    #Thickens the walls, trims them to origObject and adds the shell, giving
+    #the same result as voronize for the seeds voronoi was built from.
+    voronoi = f.intersection(f.thicken(voronoi,cellThickness/2-1),origObject, tpb)
+    if shellThickness>0:
+        voronoi = f.union(f.shell(origObject,shellThickness, tpb),voronoi, tpb)
+    return voronoi
+
+def flood(seedPoints, shape, order=2, tpb=8):
+    #Jump floods a seed matrix or an (n,3) seed array on a grid of shape.
+    if seedPoints.ndim == 2:
+        return jumpFloodPoints(seedPoints, shape, order, tpb)
+    return jumpFlood(seedPoints, order, tpb)
+
+def labelCells(seedPoints, shape=None, order=2, workers=-1, block=1<<20):
+    """Label every voxel with the index of its nearest seed.
+
+    An exact alternative to jump flooding: the seeds go into a
+    ``scipy.spatial.cKDTree`` that is queried for the voxel coordinates a
+    block of X layers at a time with ``workers`` threads.  Only the int32
+    label volume is kept instead of two four channel float32 buffers.
+
+    Parameters
+    ----------
+    seedPoints : numpy.ndarray
+        Seed matrix with 0s at the seeds, or an ``(n, 3)`` array of seed
+        indices.
+    shape : tuple, optional
+        Grid shape, required for a seed array.
+    order : float, optional
+        Minkowski norm of the distance.
+    workers : int, optional
+        Query threads, ``-1`` uses every core.
+    block : int, optional
+        Approximate number of voxels queried at once.
+
+    Returns
+    -------
+    numpy.ndarray
+        ``int32`` labels of ``shape``.
+    """
+    seedPoints = download(seedPoints)
+    if seedPoints.ndim == 2:
+        points = seedPoints
+    else:
+        shape = seedPoints.shape
+        points = np.argwhere(seedPoints <= 0)
+    labels = np.zeros(shape, np.int32)
+    if len(points) == 0:
+        return labels
+    tree = cKDTree(points)
+    layers = max(1, block//(shape[1]*shape[2]))
+    j, k = np.indices(shape[1:])
+    for first in range(0, shape[0], layers):
+        stop = min(first+layers, shape[0])
+        coords = np.empty((stop-first, shape[1], shape[2], 3), np.float32)
+        coords[..., 0] = np.arange(first, stop)[:, None, None]
+        coords[..., 1] = j
+        coords[..., 2] = k
+        labels[first:stop] = tree.query(coords.reshape(-1, 3), p=order, workers=workers)[1].reshape(coords.shape[:3])
+    return labels
+
+def labelWalls(labels):
+    """Mark voxels next to a different cell as walls.
+
+    Compares ``labels`` with its 26 shifted neighbours, half of them
+    through shifted views that flag both sides of each mismatch.
+
+    Returns
+    -------
+    numpy.ndarray
+        ``float32`` grid, -1 on the walls and 1 elsewhere, like
+        :func:`wallFinder`.
+    """
+    walls = np.zeros(labels.shape, bool)
+    m, n, p = labels.shape
+    for a, b, c in [(1,0,0),(0,1,0),(0,0,1),(1,1,0),(1,-1,0),(1,0,1),(1,0,-1),(0,1,1),(0,1,-1),(1,1,1),(1,1,-1),(1,-1,1),(1,-1,-1)]:
+        #here and there are the overlapping views of a voxel and its
+        #neighbour at offset (a, b, c).
+        here = (slice(0, m-a), slice(max(0, -b), n-max(0, b)), slice(max(0, -c), p-max(0, c)))
+        there = (slice(a, m), slice(max(0, b), n-max(0, -b)), slice(max(0, c), p-max(0, -c)))
+        differ = labels[here] != labels[there]
+        walls[here] |= differ
+        walls[there] |= differ
+    return np.where(walls, np.float32(-1), np.float32(1))
+
 @cuda.jit
 def wallFinderKernel(d_points,d_walls):
     i,j,k = cuda.grid(3)
@@ -63,15 +180,37 @@ def wallFinderKernel(d_points,d_walls):
             m1,n1,p1,d1 = d_points[checkPos]
             if m!=m1 or n!=n1 or p!=p1:
                 d_walls[i,j,k]=-1
+
+@njit(parallel=True, cache=True)
+def wallFinderKernelCPU(points, walls):
+    dims = walls.shape
+    for i in prange(dims[0]):
+        for j in range(dims[1]):
+            for k in range(dims[2]):
+                m = points[i,j,k,0]
+                n = points[i,j,k,1]
+                p = points[i,j,k,2]
+                for index in range(27):
+                    a = i+((index//9)%3-1)
+                    b = j+((index//3)%3-1)
+                    c = k+(index%3-1)
+                    if a<dims[0] and b<dims[1] and c<dims[2] and min(a,b,c)>0:
+                        if m!=points[a,b,c,0] or n!=points[a,b,c,1] or p!=points[a,b,c,2]:
+                            walls[i,j,k]=-1
+                            break
         
-def wallFinder(voxel):
+def wallFinder(voxel, tpb=8):
     #voxel = the original voxel model of the object
     #gradient = the gradient field of the object
     #Outputs a voxel model with material where the gradient was below the 
     #threshold.
     dims = voxel.shape
-    d_points = cuda.to_device(voxel)
-    d_walls = cuda.to_device(np.ones(dims[:3]))
+    if not use_cuda():
+        walls = np.ones(dims[:3], np.float32)
+        wallFinderKernelCPU(download(voxel), walls)
+        return result(walls, voxel)
+    d_points = onDevice(voxel)
+    d_walls = cuda.to_device(np.ones(dims[:3], np.float32))
     gridSize = [
         (dims[0] + tpb - 1) // tpb,
         (dims[1] + tpb - 1) // tpb,
@@ -79,4 +218,4 @@ def wallFinder(voxel):
     ]
     blockSize = [tpb, tpb, tpb]
     wallFinderKernel[gridSize, blockSize](d_points, d_walls)
-    return d_walls.copy_to_host()
+    return result(d_walls, voxel)
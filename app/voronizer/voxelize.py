@@ -1,12 +1,17 @@
-from numba import cuda
+from numba import cuda, njit, prange
 import math
+import os
 import numpy as np
+import ctypes
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from struct import unpack
-from operator import itemgetter
+from .backend import use_cuda
+from .occupancy import isOccupancy, pack
 
 # From https://github.com/cpederkoff/stl-to-voxel
 
-def voxelize(inputFilePath, resolution, buffer, tpb=8):
+def voxelize(inputFilePath, resolution, buffer, tpb=8, workers=1):
     """Voxelize an STL file and convert to a signed distance field.
 
     Parameters
@@ -19,32 +24,219 @@ def voxelize(inputFilePath, resolution, buffer, tpb=8):
         Padding applied around the volume.
     tpb : int, optional
         CUDA threads per block.
+    workers : int, optional
+        Number of processes rasterizing Z slabs, ``0`` uses every core.
 
     Returns
     -------
     tuple
         ``(frep, modelSize)`` where ``frep`` is the voxelized field.
+
+    The occupancy is bit-packed right after rasterizing and only expanded
+    into the ``float32`` field by :func:`toFRep`.
     """
-    mesh = list(read_stl_verticies(inputFilePath))
-    modelSize = np.array([0,0,0])
-    pointList = list(map(list,sum(mesh,())))
-    for i in range(3):
-        pointList = sorted(pointList, key=itemgetter(i))
-        modelSize[2-i] = pointList[-1][i]-pointList[0][i]
-    (scale, shift, bounding_box) = calculateScaleAndShift(mesh, resolution)
-    mesh = list(scaleAndShiftMesh(mesh, scale, shift))
-    vol = np.zeros((bounding_box[2],bounding_box[0],bounding_box[1]), dtype=bool)
-    for height in range(bounding_box[2]):
-        lines = toIntersectingLines(mesh, height)
-        prepixel = np.zeros((bounding_box[0], bounding_box[1]), dtype=bool)
-        linesToVoxels(lines, prepixel)
-        vol[height] = prepixel
-        if height%50<1:
-            print("On layer "+str(height)+" of "+str(bounding_box[2]))
+    triangles, bounding_box, modelSize = loadMesh(inputFilePath, resolution)
+    vol = pack(rasterizeMesh(triangles, bounding_box, workers))
     vol = padVoxelArray(vol, buffer)
     print("Voxelize complete!")
     return toFRep(vol, tpb), modelSize
 
+def loadMesh(inputFilePath, resolution):
+    """Read an STL file and scale it into voxel units.
+
+    Parameters
+    ----------
+    inputFilePath : str
+        Path to the STL file.
+    resolution : int
+        Output XY resolution in voxels.
+
+    Returns
+    -------
+    tuple
+        ``(triangles, bounding_box, modelSize)`` where ``triangles`` holds
+        the ``(n, 3, 3)`` scaled vertices, ``bounding_box`` is
+        ``[resX, resY, layers]`` and ``modelSize`` the unscaled extent of
+        the model ordered ``(z, y, x)``.
+    """
+    mesh = readSTL(inputFilePath)
+    points = mesh.reshape(-1, 3).astype(np.float64)
+    modelSize = np.array([0,0,0])
+    modelSize[::-1] = points.max(axis=0) - points.min(axis=0)
+    (scale, shift, bounding_box) = calculateScaleAndShift(mesh, resolution)
+    return scaleAndShiftMesh(mesh, scale, shift), bounding_box, modelSize
+
+def rasterizeMesh(triangles, bounding_box, workers=1):
+    """Fill the interior of a scaled and shifted triangle mesh.
+
+    Vectorized equivalent of running :func:`toIntersectingLines` and
+    :func:`linesToVoxels` on every layer, producing the identical grid.
+    With several ``workers`` the layers are split into Z slabs, triangles
+    are binned per slab once and the slabs are rasterized by a process pool
+    writing straight into a shared memory volume that is returned
+    without a copy.
+
+    Parameters
+    ----------
+    triangles : numpy.ndarray
+        ``(n, 3, 3)`` vertex coordinates in voxel units.
+    bounding_box : sequence[int]
+        ``[resX, resY, layers]`` as returned by :func:`calculateScaleAndShift`.
+    workers : int, optional
+        Number of processes, ``0`` uses every core.
+
+    Returns
+    -------
+    numpy.ndarray
+        Boolean occupancy grid of shape ``(layers, resX, resY)``.
+    """
+    resX, resY, layers = bounding_box
+    shape = (layers, resX, resY)
+    if workers == 0:
+        workers = os.cpu_count()
+    if workers <= 1 or layers < 2:
+        height, start, end = sliceMesh(triangles, layers)
+        return scanlineFill(height, start, end, shape)
+    bounds = np.linspace(0, layers, min(layers, 4 * workers) + 1).astype(int)
+    z = triangles[:, :, 2]
+    low = np.ceil(z.min(axis=1))
+    high = np.floor(z.max(axis=1))
+    #Forking once numba has started its thread pool hangs the interpreter,
+    #so the workers are spawned and receive the volume at start up.
+    context = multiprocessing.get_context("spawn")
+    volume = context.RawArray(ctypes.c_bool, max(int(np.prod(shape)), 1))
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=initSlabWorker, initargs=(volume, shape)) as pool:
+        jobs = []
+        for first, stop in zip(bounds[:-1], bounds[1:]):
+            inSlab = (low <= stop - 1) & (high >= first)
+            jobs.append(pool.submit(rasterizeSlab, triangles[inSlab], first, stop))
+        for job in jobs:
+            job.result()
+    return np.frombuffer(volume, dtype=bool, count=int(np.prod(shape))).reshape(shape)
+
+_slabVolume = None
+
+def initSlabWorker(volume, shape):
+    """Attach a pool worker to the shared output ``volume``."""
+    global _slabVolume
+    _slabVolume = np.frombuffer(volume, dtype=bool, count=int(np.prod(shape))).reshape(shape)
+
+def rasterizeSlab(triangles, first, stop):
+    """Rasterize layers ``first .. stop-1`` into the shared volume."""
+    height, start, end = sliceMesh(triangles, stop, first)
+    _slabVolume[first:stop] = scanlineFill(height - first, start, end, (stop - first,) + _slabVolume.shape[1:])
+
+def sliceMesh(triangles, layers, first=0):
+    """Intersect every triangle with every integer Z plane it touches.
+
+    Parameters
+    ----------
+    triangles : numpy.ndarray
+        ``(n, 3, 3)`` vertex coordinates in voxel units.
+    layers : int
+        Number of Z planes, the planes are ``first .. layers-1``.
+    first : int, optional
+        Lowest plane to slice.
+
+    Returns
+    -------
+    tuple
+        ``(height, start, end)`` where ``height`` holds the layer index of
+        each segment and ``start``/``end`` its ``(x, y)`` endpoints, ordered
+        exactly as :func:`triangleToIntersectingLines` orders them.
+    """
+    z = triangles[:, :, 2]
+    low = np.maximum(np.ceil(z.min(axis=1)), first).astype(np.int64)
+    high = np.minimum(np.floor(z.max(axis=1)), layers - 1).astype(np.int64)
+    counts = np.maximum(high - low + 1, 0)
+    tri = np.repeat(np.arange(len(triangles)), counts)
+    offsets = np.cumsum(counts) - counts
+    height = low[tri] + np.arange(len(tri)) - offsets[tri]
+    tris = triangles[tri]
+    z = tris[:, :, 2]
+    h = height[:, None].astype(np.float64)
+    above = z > h
+    below = z < h
+    same = z == h
+    nAbove = above.sum(axis=1)
+    nBelow = below.sum(axis=1)
+    nSame = same.sum(axis=1)
+    keep = ((nSame == 2) | ((nAbove > 0) & (nBelow > 0))) & (nSame != 3)
+    tris, height, above, below, same = tris[keep], height[keep], above[keep], below[keep], same[keep]
+    nAbove, nBelow, nSame = nAbove[keep], nBelow[keep], nSame[keep]
+    rows = np.arange(len(tris))
+    #First and last vertex of each class, in the original vertex order.
+    a0 = np.argmax(above, axis=1)
+    a1 = 2 - np.argmax(above[:, ::-1], axis=1)
+    b0 = np.argmax(below, axis=1)
+    b1 = 2 - np.argmax(below[:, ::-1], axis=1)
+    s0 = np.argmax(same, axis=1)
+    s1 = 2 - np.argmax(same[:, ::-1], axis=1)
+    h = height.astype(np.float64)
+
+    def crossing(lower, upper):
+        p1 = tris[rows, lower]
+        p2 = tris[rows, upper]
+        #Rows without a crossing divide by zero here and are discarded below.
+        with np.errstate(divide='ignore', invalid='ignore'):
+            distance = (h - p1[:, 2]) / (p2[:, 2] - p1[:, 2])
+            return p1[:, :2] - distance[:, None] * (p1[:, :2] - p2[:, :2])
+
+    side1 = crossing(b0, a0)
+    side2 = crossing(np.where(nBelow == 2, b1, b0), np.where(nBelow == 2, a0, a1))
+    start = np.where((nSame == 2)[:, None], tris[rows, s0, :2], side1)
+    end = np.where((nSame == 2)[:, None], tris[rows, s1, :2], np.where((nSame == 1)[:, None], tris[rows, s0, :2], side2))
+    return height, start, end
+
+def scanlineFill(height, start, end, shape):
+    """Parity fill the rows crossed by the sliced segments.
+
+    Every segment toggles the row ``x`` at ``int(y)`` for each integer ``x``
+    with ``min(x0, x1) <= x < max(x0, x1)``; a pixel is solid if it is
+    toggled or lies after an odd number of toggles in its row, which is the
+    rule :func:`linesToVoxels` applies one pixel at a time.
+
+    Parameters
+    ----------
+    height : numpy.ndarray
+        Layer index of each segment.
+    start, end : numpy.ndarray
+        ``(n, 2)`` segment endpoints.
+    shape : tuple
+        ``(layers, resX, resY)`` of the output grid.
+
+    Returns
+    -------
+    numpy.ndarray
+        Boolean occupancy grid of ``shape``.
+    """
+    layers, resX, resY = shape
+    x0, y0 = start[:, 0], start[:, 1]
+    x1, y1 = end[:, 0], end[:, 1]
+    first = np.maximum(np.ceil(np.minimum(x0, x1)), 0).astype(np.int64)
+    last = np.minimum(np.ceil(np.maximum(x0, x1)), resX).astype(np.int64)
+    counts = np.maximum(last - first, 0)
+    seg = np.repeat(np.arange(len(height)), counts)
+    offsets = np.cumsum(counts) - counts
+    x = first[seg] + np.arange(len(seg)) - offsets[seg]
+    ratio = (x - x0[seg]) / (x1[seg] - x0[seg])
+    y = np.trunc(y0[seg] + ratio * (y1[seg] - y0[seg])).astype(np.int64)
+    #Same bounds test as onLine, which can reject a rounding overshoot.
+    ya, yb = y0[seg], y1[seg]
+    offLine = (np.trunc(ya) != y) & (np.trunc(yb) != y) & ((np.maximum(ya, yb) < y) | (np.minimum(ya, yb) > y))
+    valid = (y >= 0) & (y < resY) & ~offLine
+    flat = (height[seg][valid] * resX + x[valid]) * resY + y[valid]
+    hits, hitCounts = np.unique(flat, return_counts=True)
+    hit = np.zeros(shape, dtype=bool)
+    hit.flat[hits] = True
+    toggle = np.zeros(shape, dtype=np.uint8)
+    toggle.flat[hits[hitCounts % 2 == 1]] = 1
+    inside = np.bitwise_xor.accumulate(toggle, axis=2)
+    if inside[:, :, -1].any():
+        print("an error has occured in "+str(int(inside[:, :, -1].sum()))+" rows")
+    inside ^= toggle
+    return hit | inside.astype(bool)
+
 def linesToVoxels(lineList, pixels):
     for x in range(len(pixels)):
         isBlack = False
@@ -147,11 +339,64 @@ def AsciiSTL(fname):
 def IsAsciiStl(fname):
     with open(fname,'rb') as input_data:
         line = input_data.readline()
+        input_data.seek(80)
+        count = input_data.read(4)
+        #Binary headers may start with "solid" too, trust a matching size.
+        if len(count) == 4 and os.path.getsize(fname) == 84 + 50 * unpack('<I', count)[0]:
+            return False
         if line[:5] == b'solid':
             return True
         else:
             return False
 
+STL_RECORD = np.dtype([
+    ('normal', '<f4', (3,)),
+    ('vertices', '<f4', (3, 3)),
+    ('attr', '<u2'),
+])
+
+def readSTL(fname, chunkSize=1 << 26):
+    """Read the triangles of a binary or ASCII STL file.
+
+    Binary files are memory-mapped and their vertices copied out in one
+    step.  ASCII files are parsed in chunks of about ``chunkSize`` bytes,
+    each chunk tokenized and converted with NumPy.
+
+    Parameters
+    ----------
+    fname : str
+        Path to the STL file.
+    chunkSize : int, optional
+        Bytes of ASCII text parsed at once.
+
+    Returns
+    -------
+    numpy.ndarray
+        ``(n, 3, 3)`` float32 vertex coordinates.
+    """
+    if IsAsciiStl(fname):
+        return readAsciiSTL(fname, chunkSize)
+    with open(fname, 'rb') as input_data:
+        count = unpack('<I', input_data.read(84)[80:])[0]
+    count = min(count, (os.path.getsize(fname) - 84) // STL_RECORD.itemsize)
+    if count == 0:
+        return np.empty((0, 3, 3), dtype=np.float32)
+    data = np.memmap(fname, dtype=STL_RECORD, mode='r', offset=84, shape=(count,))
+    return np.array(data['vertices'], dtype=np.float32)
+
+def readAsciiSTL(fname, chunkSize=1 << 26):
+    """Vectorized parser for ASCII STL files, see :func:`readSTL`."""
+    chunks = []
+    with open(fname, 'rb') as input_data:
+        while True:
+            lines = input_data.readlines(chunkSize)
+            if not lines:
+                break
+            tokens = np.array(b''.join(lines).split())
+            at = np.flatnonzero(tokens == b'vertex')
+            chunks.append(tokens[at[:, None] + np.arange(1, 4)].astype(np.float32))
+    return np.concatenate(chunks).reshape(-1, 3, 3) if chunks else np.empty((0, 3, 3), dtype=np.float32)
+
 def read_stl_verticies(fname):
     if IsAsciiStl(fname):
         for (i,j,k) in AsciiSTL(fname):
@@ -182,13 +427,13 @@ def padVoxelArray(voxels,padding):
 
 """
 def padVoxelArray(voxels,padding):
+    #Packed occupancy stays packed, arrays keep their dtype.
+    if isOccupancy(voxels):
+        return voxels.pad(padding)
     shape = voxels.shape
     new_shape = (shape[0]+2*padding,shape[1]+2*padding,shape[2]+2*padding)
-    vol = np.zeros(new_shape, dtype=float)
-    for a in range(shape[0]):
-        for b in range(shape[1]):
-            for c in range(shape[2]):
-                vol[a+padding,b+padding,c+padding] = voxels[a,b,c]
+    vol = np.zeros(new_shape, dtype=voxels.dtype)
+    vol[padding:padding+shape[0], padding:padding+shape[1], padding:padding+shape[2]] = voxels
     return vol
 
 def toIntersectingLines(mesh, height):
@@ -276,12 +521,9 @@ def whereLineCrossesZ(p1, p2, z):
     return linearInterpolation(p1, p2, distance)
 
 def calculateScaleAndShift(mesh, resolution):
-    allPoints = [item for sublist in mesh for item in sublist]
-    mins = [0, 0, 0]
-    maxs = [0, 0, 0]
-    for i in range(3):
-        mins[i] = min(allPoints, key=lambda tri: tri[i])[i]
-        maxs[i] = max(allPoints, key=lambda tri: tri[i])[i]
+    points = np.asarray(mesh, dtype=np.float64).reshape(-1, 3)
+    mins = points.min(axis=0).tolist()
+    maxs = points.max(axis=0).tolist()
     shift = [-min for min in mins]
     xyscale = float(resolution - 1) / (max(maxs[0] - mins[0], maxs[1] - mins[1]))
     scale = [xyscale, xyscale, xyscale]
@@ -289,17 +531,16 @@ def calculateScaleAndShift(mesh, resolution):
     return (scale, shift, bounding_box)
 
 def scaleAndShiftMesh(mesh, scale, shift):
-    for tri in mesh:
-        newTri = []
-        for pt in tri:
-            newpt = [0, 0, 0]
-            for i in range(3):
-                newpt[i] = (pt[i] + shift[i]) * scale[i]
-            newTri.append(tuple(newpt))
-        if len(removeDupsFromPointList(newTri)) == 3:
-            yield newTri
-        else:
-            pass
+    """Move ``mesh`` into voxel units and drop degenerate triangles.
+
+    Returns a ``(n, 3, 3)`` float64 array; triangles with two coincident
+    vertices after scaling are removed.
+    """
+    tris = (np.asarray(mesh, dtype=np.float64).reshape(-1, 3, 3) + np.asarray(shift, dtype=np.float64)) * np.asarray(scale, dtype=np.float64)
+    same = np.zeros(len(tris), dtype=bool)
+    for a, b in ((0, 1), (0, 2), (1, 2)):
+        same |= (tris[:, a] == tris[:, b]).all(axis=1)
+    return tris[~same]
 
 def manhattanDistance(p1, p2, d=2):
     assert (len(p1) == len(p2))
@@ -323,12 +564,59 @@ def toFRepKernel(d_u,d_v):
     else:
         d_v[i,j,k]=0.01
 
+@njit(parallel=True, cache=True)
+def toFRepKernelCPU(u, v):
+    dims = u.shape
+    for i in prange(dims[0]):
+        for j in range(dims[1]):
+            for k in range(dims[2]):
+                if u[i,j,k]==1:
+                    v[i,j,k]=-0.01
+                else:
+                    v[i,j,k]=0.01
+
+@cuda.jit
+def toFRepPackedKernel(d_bits,d_v):
+    i,j,k = cuda.grid(3)
+    dims = d_v.shape
+    if i >= dims[0] or j >= dims[1] or k >= dims[2]:
+        return
+    if (d_bits[i,j,k//8] >> (7-k%8)) & 1:
+        d_v[i,j,k]=-0.01
+    else:
+        d_v[i,j,k]=0.01
+
+@njit(parallel=True, cache=True)
+def toFRepPackedKernelCPU(bits, v):
+    dims = v.shape
+    for i in prange(dims[0]):
+        for j in range(dims[1]):
+            for k in range(dims[2]):
+                if (bits[i,j,k//8] >> (7-k%8)) & 1:
+                    v[i,j,k]=-0.01
+                else:
+                    v[i,j,k]=0.01
+
 def toFRep(u, tpb=8):
-    """Convert boolean voxels to a simple FRep field."""
-    d_u = cuda.to_device(u)
+    """Convert boolean voxels to a simple FRep field.
+
+    ``u`` may be an :class:`occupancy.Occupancy`, which is read bit by bit
+    and, on CUDA, copied to the device packed.
+    """
+    packed = isOccupancy(u)
     dims = u.shape
+    if not use_cuda():
+        v = np.empty(dims, dtype=np.float32)
+        if packed:
+            toFRepPackedKernelCPU(u.bits, v)
+        else:
+            toFRepKernelCPU(u, v)
+        return v
     d_v = cuda.device_array(dims, dtype=np.float32)
     gridSize = [(dims[0] + tpb - 1) // tpb, (dims[1] + tpb - 1) // tpb, (dims[2] + tpb - 1) // tpb]
     blockSize = [tpb, tpb, tpb]
-    toFRepKernel[gridSize, blockSize](d_u, d_v)
+    if packed:
+        toFRepPackedKernel[gridSize, blockSize](cuda.to_device(u.bits), d_v)
+    else:
+        toFRepKernel[gridSize, blockSize](cuda.to_device(u), d_v)
     return d_v.copy_to_host()
@@ -0,0 +1,137 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+from dataclasses import replace
+
+import numpy as np
+import pytest
+
+from app.voronizer import PipelineConfig, backend, device, run_pipeline
+from app.voronizer import Frep as f
+from app.voronizer.SDF3D import SDF3D
+from app.voronizer.analysis import findVol
+
+
+@pytest.fixture
+def cpu_backend():
+    backend.set_backend("cpu")
+    yield
+    backend.set_backend("auto")
+
+
+def test_cpu_handle_round_trip(cpu_backend):
+    u = np.arange(24, dtype=np.float32).reshape(2, 3, 4)
+    handle = device.upload(u)
+    assert device.isHandle(handle) and not handle.onDevice
+    assert device.upload(handle) is handle
+    assert handle.shape == u.shape and handle.dtype == u.dtype
+    assert device.download(handle) is u
+    assert np.array_equal(np.asarray(handle), u)
+
+
+def test_cpu_ops_keep_handles(cpu_backend):
+    x = np.linspace(-10, 10, 20)
+    u = f.sphere(x, x, x, 6)
+    v = f.translate(u, 3, 0, 0)
+    handle = device.upload(u)
+    steps = [
+        (f.union(handle, v), f.union(u, v)),
+        (f.subtract(handle, v), f.subtract(u, v)),
+        (f.thicken(handle, 1), f.thicken(u, 1)),
+        (f.shell(handle, 2), f.shell(u, 2)),
+        (SDF3D(handle), SDF3D(u)),
+    ]
+    for out, expected in steps:
+        assert device.isHandle(out)
+        assert np.allclose(device.download(out), expected)
+    assert findVol(handle, [1, 1, 1], 1.0, "Test") == findVol(u, [1, 1, 1], 1.0, "Test")
+    #Inputs are left untouched.
+    assert np.array_equal(device.download(handle), u)
+
+
+@pytest.fixture
+def half_precision(cpu_backend):
+    device.set_precision("float16")
+    yield
+    device.set_precision("float32")
+
+
+def test_host_ops_stay_float32(cpu_backend):
+    x = np.linspace(-10, 10, 20)
+    u = f.sphere(x, x, x, 6)
+    assert u.dtype == np.float32
+    assert f.thicken(u, 1).dtype == np.float32
+    assert f.shell(u, 2).dtype == np.float32
+    assert device.upload(u.astype(np.float64)).dtype == np.float32
+    with pytest.raises(ValueError):
+        device.set_precision("float64")
+
+
+def test_half_precision_storage(half_precision):
+    x = np.linspace(-10, 10, 20)
+    u = f.sphere(x, x, x, 6)
+    v = f.translate(u, 3, 0, 0)
+    handle = device.upload(u)
+    assert handle.dtype == np.float16 and handle.data.nbytes == u.nbytes // 2
+    assert device.download(handle).dtype == np.float32
+    assert device.download(handle, stored=True) is handle.data
+    steps = [
+        (f.union(handle, v), f.union(u, v)),
+        (f.shell(handle, 2), f.shell(u, 2)),
+        (SDF3D(handle), SDF3D(u)),
+    ]
+    for out, expected in steps:
+        assert device.isHandle(out) and out.dtype == np.float16
+        assert np.allclose(device.download(out), expected, atol=0.05, rtol=1e-2)
+    #Seed matrices are not scalar fields and keep their dtype.
+    seeds = device.upload(np.ones((4, 4, 4), np.uint8))
+    assert seeds.dtype == np.uint8
+
+
+def test_run_pipeline_with_half_precision(half_precision):
+    config = PipelineConfig(PRIMITIVE_TYPE="Sphere", RESOLUTION=32, BACKEND="cpu", BATCH=True, SMOOTH=False, SEED=5)
+    full = run_pipeline(config)
+    half = run_pipeline(replace(config, PRECISION="float16"))
+    assert full.grids["complete"].dtype == np.float32
+    assert half.grids["complete"].dtype == np.float16
+    assert np.mean((full.grids["complete"] < 0) != (half.grids["complete"] < 0)) < 0.01
+    assert half.meshes
+
+
+def test_cuda_handles_match_cpu_in_simulator():
+    script = (
+        "import numpy as np\n"
+        "from app.voronizer import backend, device, Frep as f\n"
+        "from app.voronizer.SDF3D import SDF3D\n"
+        "from app.voronizer.analysis import findVol\n"
+        "x = np.linspace(-10, 10, 10)\n"
+        "u = f.sphere(x, x, x, 5)\n"
+        "v = f.translate(u, 2, 0, 0)\n"
+        "backend.set_backend('cpu')\n"
+        "expected = f.union(f.thicken(u, 1), v), f.shell(u, 1), SDF3D(u), findVol(u, [1, 1, 1], 1.0, 'Test')\n"
+        "backend.set_backend('cuda')\n"
+        "h = device.upload(u)\n"
+        "assert h.onDevice\n"
+        "out = f.union(f.thicken(h, 1), v), f.shell(h, 1), SDF3D(h)\n"
+        "assert all(device.isHandle(o) and o.onDevice for o in out)\n"
+        "for o, e in zip(out, expected):\n"
+        "    assert np.allclose(device.download(o), e)\n"
+        "assert findVol(h, [1, 1, 1], 1.0, 'Test') == expected[3]\n"
+        "assert np.array_equal(device.download(h), u)\n"
+        "from app.voronizer.pool import BufferPool\n"
+        "pool = BufferPool()\n"
+        "o = pool.borrow(u.shape)\n"
+        "r = f.union(f.thicken(h, 1), v, out=o)\n"
+        "assert o.onDevice and r.data is o.data and np.allclose(device.download(r), expected[0])\n"
+        "device.set_precision('float16')\n"
+        "h = device.upload(u)\n"
+        "assert h.onDevice and h.dtype == np.float16\n"
+        "assert np.allclose(device.download(f.shell(h, 1)), expected[1], atol=0.05, rtol=1e-2)\n"
+        "r = f.union(f.thicken(h, 1), v, out=pool.borrow(u.shape))\n"
+        "assert r.dtype == np.float16 and np.allclose(device.download(r), expected[0], atol=0.05, rtol=1e-2)\n"
+    )
+    env = dict(os.environ, NUMBA_ENABLE_CUDASIM="1")
+    root = Path(__file__).resolve().parents[1]
+    subprocess.run([sys.executable, "-c", script], check=True, timeout=600, cwd=str(root), env=env)
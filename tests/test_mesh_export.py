@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+import trimesh
+
+from app.voronizer import meshExport
+
+
+@pytest.fixture
+def mesh():
+    return trimesh.creation.icosphere(2)
+
+
+@pytest.mark.parametrize("binary", [True, False])
+def test_write_ply_round_trip(tmp_path, mesh, monkeypatch, binary):
+    monkeypatch.setattr(meshExport, "CHUNK", 100)
+    path = tmp_path / "model.ply"
+    meshExport.writePLY(str(path), mesh.vertices, mesh.faces, binary=binary)
+    header = path.read_bytes().split(b"end_header")[0]
+    assert b"element vertex %d\n" % len(mesh.vertices) in header
+    assert (b"binary_little_endian" in header) == binary
+    loaded = trimesh.load(str(path), process=False)
+    assert np.allclose(loaded.vertices, mesh.vertices, atol=1e-5)
+    assert np.array_equal(loaded.faces, mesh.faces)
+
+
+def test_write_stl_round_trip(tmp_path, mesh, monkeypatch):
+    monkeypatch.setattr(meshExport, "CHUNK", 100)
+    path = tmp_path / "model.stl"
+    meshExport.writeSTL(str(path), mesh.vertices, mesh.faces)
+    assert path.stat().st_size == 84 + 50 * len(mesh.faces)
+    loaded = trimesh.load(str(path), process=False)
+    assert np.allclose(loaded.vertices, mesh.vertices[mesh.faces].reshape(-1, 3), atol=1e-5)
+    assert np.allclose(loaded.face_normals, mesh.face_normals, atol=1e-5)
+
+
+def test_generate_mesh_rejects_unknown_format():
+    with pytest.raises(ValueError):
+        meshExport.generateMesh(np.ones((4, 4, 4)), [1, 1, 1], fileFormat="obj")
+
+
+def test_tesselate_scales_vertices():
+    x = np.linspace(-1, 1, 21)
+    u = np.sqrt(x[:, None, None] ** 2 + x[None, :, None] ** 2 + x[None, None, :] ** 2) - 0.6
+    grid = np.arange(21.0)
+    scale = [0.5, 2.0, 3.0]
+    verts, faces = meshExport.tesselate(u, grid, grid, grid, scale)
+    raw, rawFaces, _, _ = meshExport.measure.marching_cubes(u, level=0, allow_degenerate=False)
+    assert np.array_equal(faces, rawFaces)
+    assert np.allclose(verts, raw * scale)
+    verts32, _ = meshExport.tesselate(u, grid, grid, grid, scale, dtype=np.float32)
+    assert verts32.dtype == np.float32
+    assert np.allclose(verts32, verts, atol=1e-5)
+
+
+def _area(verts, faces):
+    edges = np.cross(verts[faces[:, 1]] - verts[faces[:, 0]], verts[faces[:, 2]] - verts[faces[:, 0]])
+    return np.linalg.norm(edges, axis=1).sum()
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_chunked_tesselation_matches_whole_grid(workers):
+    x = np.linspace(-1, 1, 30)
+    u = np.sqrt(x[:, None, None] ** 2 + x[None, :, None] ** 2 + x[None, None, :] ** 2) - 0.7
+    u[:, :, :4] = 1  #An empty region whose blocks are skipped
+    grid = np.arange(30.0)
+    scale = [0.5, 2.0, 3.0]
+    verts, faces = meshExport.tesselate(u, grid, grid, grid, scale)
+    chunked, chunkedFaces = meshExport.tesselateChunked(u, scale, chunk=8, workers=workers)
+    assert chunked.shape == verts.shape
+    assert chunkedFaces.shape == faces.shape
+    assert np.allclose(chunked[np.lexsort(chunked.T)], verts[np.lexsort(verts.T)], atol=1e-6)
+    assert np.isclose(_area(chunked, chunkedFaces), _area(verts, faces))
+    assert trimesh.Trimesh(chunked, chunkedFaces, process=False).is_watertight
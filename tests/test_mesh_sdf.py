@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+import trimesh
+
+from app.voronizer import backend
+from app.voronizer import voxelize as vx
+from app.voronizer.meshSDF import meshSDF
+
+
+@pytest.fixture(autouse=True)
+def cpu_backend():
+    backend.set_backend("cpu")
+    yield
+    backend.set_backend("auto")
+
+
+def test_mesh_sdf_matches_voxelize_and_sphere(tmp_path):
+    path = tmp_path / "sphere.stl"
+    trimesh.creation.icosphere(4, radius=1.0).export(path)
+    sdf, size = meshSDF(str(path), 32, 2)
+    frep, expectedSize = vx.voxelize(str(path), 32, 2)
+    assert sdf.dtype == np.float32
+    assert sdf.shape == frep.shape
+    assert np.array_equal(size, expectedSize)
+    assert np.array_equal(sdf < 0, frep < 0)
+    #The sphere spans voxels 0..31, its centre sits at (z, x, y) = 15.5 + 2.
+    i, j, k = np.indices(sdf.shape)
+    exact = np.sqrt((i - 17.5) ** 2 + (j - 17.5) ** 2 + (k - 17.5) ** 2) - 15.5
+    #The parity fill marks voxels the surface passes through as solid, so
+    #only compare magnitudes where both agree on the side.
+    agree = (sdf < 0) == (exact < 0)
+    near = agree & (np.abs(exact) < 2)
+    assert np.abs(sdf[near] - exact[near]).max() < 0.05
+    assert np.abs(sdf[agree] - exact[agree]).max() < 1
+    assert np.abs(exact[~agree]).max() < 1
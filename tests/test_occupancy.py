@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from app.voronizer import backend, occupancy
+from app.voronizer import voxelize as vx
+from app.voronizer.analysis import findVol
+from app.voronizer.visualizeSlice import generateImageStack
+
+
+@pytest.fixture
+def mask():
+    backend.set_backend("cpu")
+    rng = np.random.default_rng(0)
+    yield rng.random((7, 9, 13)) < 0.4
+    backend.set_backend("auto")
+
+
+def test_pack_round_trip_and_count(mask):
+    packed = occupancy.pack(mask)
+    assert packed.bits.shape == (7, 9, 2)
+    assert np.array_equal(packed.unpack(), mask)
+    assert np.array_equal(packed.layer(3), mask[3])
+    assert packed.count() == mask.sum()
+    assert findVol(packed, [1, 1, 2], 1.0, "Test") == 2 * mask.sum()
+
+
+def test_pad_and_frep_match_arrays(mask):
+    packed = occupancy.pack(mask).pad(3)
+    padded = vx.padVoxelArray(mask, 3)
+    assert padded.dtype == bool
+    assert packed.shape == padded.shape
+    assert np.array_equal(packed.unpack(), padded)
+    assert np.array_equal(vx.toFRep(packed), vx.toFRep(padded))
+
+
+def test_image_stack_from_packed_fields(mask, tmp_path):
+    model = np.where(mask, -1.0, 1.0).astype(np.float32)
+    support = np.roll(model, 2, axis=2)
+    generateImageStack(model, [255, 0, 0], support, [0, 0, 255], name="dense", outputDir=str(tmp_path))
+    generateImageStack(occupancy.fromField(model), [255, 0, 0], occupancy.fromField(support), [0, 0, 255], name="packed", outputDir=str(tmp_path))
+    for index in range(mask.shape[0]):
+        dense = np.asarray(Image.open(tmp_path / "dense image stack" / ("%ddense.png" % index)))
+        packed = np.asarray(Image.open(tmp_path / "packed image stack" / ("%dpacked.png" % index)))
+        assert np.array_equal(dense, packed)
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from app.voronizer import PipelineConfig, backend, run_pipeline
+from app.voronizer import Frep as f
+from app.voronizer import pointGen
+from app.voronizer.pointGen import explode, genRandPoints, pointGrid, poissonPoints
+from app.voronizer.SDF3D import SDF3D, jumpFlood, jumpFloodPoints
+
+
+@pytest.fixture(autouse=True)
+def cpu_backend():
+    backend.set_backend("cpu")
+    yield
+    backend.set_backend("auto")
+
+
+def test_poisson_points_are_spaced_and_repeatable():
+    u = np.full((40, 40, 40), -4.0, dtype=np.float32)
+    u[:, :, 30:] = 1
+    points = poissonPoints(u, 0.1, seed=7)
+    assert points.dtype == np.int32 and points.shape[1] == 3
+    assert np.array_equal(points, poissonPoints(u, 0.1, seed=7))
+    assert (u[points[:, 0], points[:, 1], points[:, 2]] < 0).all()
+    #Spacing for |u| = 4 is (0.85*40/0.1*4)^(1/3), about 11 voxels.
+    gaps = np.linalg.norm(points[:, None, :] - points[None, :, :], axis=-1)
+    np.fill_diagonal(gaps, np.inf)
+    assert gaps.min() >= (0.85 * 40 / 0.1 * 4) ** (1 / 3)
+    #Roughly the genRandPoints expectation of threshold/(40*|u|) per voxel.
+    expected = 40 * 40 * 30 * 0.1 / (40 * 4)
+    assert 0.5 * expected < len(points) < 2 * expected
+
+
+def test_poisson_points_reach_disconnected_parts():
+    x = np.linspace(-20, 20, 41)
+    u = SDF3D(f.union(f.sphere(x - 12, x, x, 5), f.sphere(x + 12, x, x, 5)))
+    points = poissonPoints(u, 0.5, seed=1)
+    assert (points[:, 0] < 20).any() and (points[:, 0] > 20).any()
+
+
+def test_jump_flood_points_matches_grid():
+    rng = np.random.default_rng(0)
+    points = np.unique(rng.integers(0, 20, (15, 3)), axis=0).astype(np.int32)
+    grid = pointGrid(points, (20, 20, 20))
+    assert np.array_equal(jumpFloodPoints(points, grid.shape, 2), jumpFlood(grid, 2))
+    assert np.array_equal(explode(points, grid.shape), explode(grid))
+
+
+def test_run_pipeline_with_poisson_seeds():
+    config = PipelineConfig(PRIMITIVE_TYPE="Sphere", RESOLUTION=32, BACKEND="cpu", BATCH=True, SMOOTH=False, SEED_SAMPLER="poisson", SEED=5, MODEL_THRESH=0.5)
+    first = run_pipeline(config)
+    second = run_pipeline(config)
+    assert first.volumes["Object"] > 0
+    assert np.array_equal(first.grids["complete"], second.grids["complete"])
+
+
+def test_gen_rand_points_draws_in_slabs(monkeypatch):
+    x = np.linspace(-10, 10, 21)
+    u = SDF3D(f.sphere(x, x, x, 8))
+    np.random.seed(3)
+    r = np.random.rand(*u.shape)
+    with np.errstate(divide="ignore"):
+        expected = np.where((u < 0) & (r < 20 / 21 / np.abs(u)), 0, 1)
+    #Slabs of two X layers give the same seeds as one full size draw.
+    monkeypatch.setattr(pointGen, "RAND_BLOCK", 2 * 21 * 21)
+    np.random.seed(3)
+    v = genRandPoints(u, 20)
+    assert v.dtype == np.uint8
+    assert np.array_equal(v, expected)
+    assert explode(v).dtype == np.float32
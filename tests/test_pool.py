@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from app.voronizer import PipelineConfig, backend, device, run_pipeline, supportGen
+from app.voronizer import Frep as f
+from app.voronizer.pool import BufferPool
+from app.voronizer.SDF3D import SDF3D
+
+
+@pytest.fixture(autouse=True)
+def cpu_backend():
+    backend.set_backend("cpu")
+    yield
+    backend.set_backend("auto")
+
+
+def test_pool_reuses_released_buffers():
+    pool = BufferPool(limit=2)
+    first = pool.borrow((4, 5, 6))
+    assert first.shape == (4, 5, 6) and first.dtype == np.float32
+    pool.release(first, first, None)
+    assert len(pool) == 1
+    assert pool.borrow((4, 5, 6)).data is first.data
+    assert pool.allocated == 1 and pool.reused == 1
+    #Views, float16 grids and anything past the limit are not kept.
+    grid = np.zeros((8, 5, 6), np.float32)
+    pool.release(grid[:4], grid.astype(np.float16), np.zeros((2, 2, 2), np.float32), np.zeros((2, 2, 2), np.float32), grid)
+    assert len(pool) == 2 and pool.nbytes == 2 * 8 * 4
+    pool.clear()
+    assert len(pool) == 0
+
+
+def test_out_matches_fresh_results():
+    x = np.linspace(-10, 10, 20)
+    u = f.sphere(x, x, x, 6)
+    v = f.translate(u, 3, 0, 0)
+    pool = BufferPool()
+    steps = [
+        (lambda out: f.union(u, v, out=out), f.union(u, v)),
+        (lambda out: f.intersection(u, v, out=out), f.intersection(u, v)),
+        (lambda out: f.subtract(u, v, out=out), f.subtract(u, v)),
+        (lambda out: f.thicken(u, 2, out=out), f.thicken(u, 2)),
+        (lambda out: f.shell(u, 2, out=out), f.shell(u, 2)),
+        (lambda out: SDF3D(u, out=out), SDF3D(u)),
+        (lambda out: SDF3D(u, method="edt", out=out), SDF3D(u, method="edt")),
+    ]
+    for step, expected in steps:
+        out = pool.borrow(u.shape)
+        got = step(out)
+        assert device.isHandle(got) and got.data is out.data
+        assert np.array_equal(device.download(got), expected)
+        pool.release(got)
+    #Plain arrays work too, and the first operand may be the output.
+    w = np.array(u)
+    assert f.union(w, v, out=w) is w and np.array_equal(w, f.union(u, v))
+    w = np.array(u)
+    assert SDF3D(w, method="edt", out=w) is w and np.array_equal(w, SDF3D(u, method="edt"))
+
+
+def test_finish_support_in_place():
+    x = np.linspace(-10, 10, 24)
+    u = SDF3D(f.sphere(x, x, x, 6))
+    projected = f.projection(u)
+    support = supportGen.supportSpace(u, projected, out=np.empty(u.shape, np.float32))
+    assert np.array_equal(support, supportGen.supportSpace(u, projected))
+    voronoi = f.thicken(SDF3D(support), 1)
+    expected = supportGen.finishSupport(voronoi, u, projected)
+    assert supportGen.finishSupport(voronoi, u, projected, out=voronoi) is voronoi
+    assert np.array_equal(voronoi, expected)
+
+
+def test_run_pipeline_with_every_stage():
+    config = PipelineConfig(PRIMITIVE_TYPE="Sphere", RESOLUTION=32, BACKEND="cpu", BATCH=True, SMOOTH=False, SEED=5, SUPPORT=True, PERFORATE=True, AESTHETIC=True, INVERSE=True, SEPARATE_SUPPORTS=False)
+    result = run_pipeline(config)
+    assert result.volumes["Object"] > 0 and result.volumes["Support"] > 0
+    complete = result.grids["complete"]
+    assert np.array_equal(complete, np.minimum(result.grids["objectVoronoi"], result.grids["supportVoronoi"]))
+    assert {"Sphere_Voronoi", "Sphere_VoronoiInv"} <= set(result.meshes)
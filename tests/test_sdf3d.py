@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+from scipy import ndimage
+
+from app.voronizer import backend
+from app.voronizer import Frep as f
+from app.voronizer.SDF3D import SDF3D, squaredEDT
+
+
+@pytest.fixture(autouse=True)
+def cpu_backend():
+    backend.set_backend("cpu")
+    yield
+    backend.set_backend("auto")
+
+
+def test_squared_edt_is_exact():
+    rng = np.random.default_rng(0)
+    u = np.where(rng.random((9, 12, 7)) < 0.05, -1.0, 1.0).astype(np.float32)
+    expected = ndimage.distance_transform_edt(u > 0) ** 2
+    assert np.allclose(squaredEDT(u), expected)
+
+
+def test_edt_sdf_matches_reference_and_jump_flood():
+    x = np.linspace(-20, 20, 33)
+    u = f.sphere(x, x, x, 12)
+    sdf = SDF3D(u, method="edt")
+    expected = np.where(
+        u > 0,
+        ndimage.distance_transform_edt(u > 0),
+        -ndimage.distance_transform_edt(u < 0),
+    )
+    assert sdf.dtype == u.dtype
+    assert np.allclose(sdf, expected, atol=1e-4)
+    assert np.abs(sdf - SDF3D(u)).max() < 0.5
+
+
+def test_edt_rejects_other_norms():
+    with pytest.raises(ValueError):
+        SDF3D(np.ones((4, 4, 4), np.float32), norm=1.0, method="edt")
+    with pytest.raises(ValueError):
+        SDF3D(np.ones((4, 4, 4), np.float32), method="fmm")
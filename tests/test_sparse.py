@@ -0,0 +1,65 @@
+from dataclasses import replace
+
+import numpy as np
+import pytest
+
+from app.voronizer import PipelineConfig, backend, run_pipeline, sparse
+from app.voronizer.SDF3D import EDTSDF
+from app.voronizer.meshExport import tesselateChunked
+
+
+@pytest.fixture
+def ball():
+    backend.set_backend("cpu")
+    x, y, z = np.meshgrid(np.arange(46) - 22, np.arange(43) - 21, np.arange(49) - 24, indexing="ij")
+    yield np.where(x**2 + y**2 + z**2 < 121, -1, 1).astype(np.float32)
+    backend.set_backend("auto")
+
+
+def test_narrow_band_matches_clamped_edt(ball):
+    grid = sparse.narrowBandSDF(ball, band=3)
+    assert grid.active < grid.slots.size
+    assert np.array_equal(grid.toDense(), np.clip(EDTSDF(ball), -3, 3))
+
+
+def test_ops_match_dense(ball):
+    u = np.clip(EDTSDF(ball), -3, 3)
+    v = np.roll(u, 4, axis=0)
+    a, b = sparse.narrowBandSDF(ball, band=3), sparse.fromDense(v, 3)
+    assert np.array_equal(sparse.fromDense(u, 3).toDense(), u)
+    assert np.array_equal(sparse.union(a, b).toDense(), np.minimum(u, v))
+    assert np.array_equal(sparse.intersection(a, b).toDense(), np.maximum(u, v))
+    assert np.array_equal(sparse.subtract(a, b).toDense(), np.maximum(-u, v))
+    assert np.allclose(sparse.thicken(a, 1).toDense(), u - 1)
+    walls = sparse.shell(a, 2)
+    assert np.allclose(walls.toDense(), np.maximum(u, -u - 2))
+    #Blocks far outside the shell collapse back into tiles.
+    assert walls.active < a.active
+    with pytest.raises(ValueError):
+        sparse.union(a, sparse.fromDense(u[:-1], 3))
+
+
+def test_tesselate_matches_chunked(ball):
+    u = np.clip(EDTSDF(ball), -3, 3)
+    walls = np.maximum(u, -u - 1)
+    verts, faces = sparse.tesselate(sparse.fromDense(walls, 3), [0.5, 1, 1])
+    expected, expectedFaces = tesselateChunked(walls, [0.5, 1, 1], 8)
+    assert len(faces) == len(expectedFaces)
+    assert np.allclose(np.sort(verts, axis=0), np.sort(expected, axis=0))
+
+
+def test_run_pipeline_with_narrow_band():
+    config = PipelineConfig(PRIMITIVE_TYPE="Sphere", RESOLUTION=40, BACKEND="cpu", BATCH=True, SMOOTH=False, SEED=5, SDF_METHOD="edt")
+    dense = run_pipeline(config)
+    narrow = run_pipeline(replace(config, NARROW_BAND=5))
+    backend.set_backend("auto")
+    #The sparse shell changes values far from the surface, never a sign.
+    solid = dense.grids["objectVoronoi"] < 0
+    assert np.array_equal(narrow.grids["objectVoronoi"] < 0, solid)
+    assert narrow.volumes == dense.volumes
+    verts, faces = narrow.meshes["Sphere_Voronoi"]
+    expected, expectedFaces = dense.meshes["Sphere_Voronoi"]
+    assert len(faces) == len(expectedFaces)
+    assert np.allclose(np.sort(verts, axis=0), np.sort(expected, axis=0))
+    #The band has to hold the whole shell.
+    assert run_pipeline(replace(config, NARROW_BAND=2)) is None
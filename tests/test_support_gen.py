@@ -0,0 +1,88 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from app.voronizer import PipelineConfig, backend, run_pipeline, supportGen
+from app.voronizer import Frep as f
+from app.voronizer.pointGen import explode, genRandPoints, pointGrid, poissonPoints
+
+
+@pytest.fixture
+def model():
+    backend.set_backend("cpu")
+    x = np.linspace(-10, 10, 21)
+    u = f.union(f.sphere(x, x - 3, x, 6), f.sphere(x + 4, x + 3, x, 4))
+    yield u, f.projection(u)
+    backend.set_backend("auto")
+
+
+def chained(u, projected, voronoi, seeds, shape=None):
+    #The Frep chain the pipeline ran before supportGen.
+    support = f.subtract(f.thicken(u, 1), projected)
+    support = f.intersection(support, f.translate(support, -1, 0, 0))
+    table = f.subtract(
+        f.thicken(u, 1),
+        f.intersection(f.translate(f.subtract(u, f.translate(u, -3, 0, 0)), -1, 0, 0), projected),
+    )
+    explosion = explode(seeds, shape)
+    explosion = f.union(explosion, f.translate(explosion, -1, 0, 0))
+    explosion = f.union(explosion, f.translate(explosion, 0, 1, 0))
+    explosion = f.union(explosion, f.translate(explosion, 0, 0, 1))
+    return support, f.union(table, f.subtract(explosion, voronoi)), f.union(table, voronoi)
+
+
+def test_support_matches_frep_chain(model):
+    u, projected = model
+    np.random.seed(1)
+    seeds = genRandPoints(u, 2.0)
+    voronoi = np.random.default_rng(0).standard_normal(u.shape).astype(np.float32)
+    support, perforated, plain = chained(u, projected, voronoi, seeds)
+    assert np.array_equal(supportGen.supportSpace(u, projected), support)
+    profiles = supportGen.perforationProfiles(seeds)
+    assert np.array_equal(supportGen.finishSupport(voronoi, u, projected, profiles), perforated)
+    assert np.array_equal(supportGen.finishSupport(voronoi, u, projected), plain)
+
+
+def test_profiles_from_points_match_grid(model):
+    u, _ = model
+    points = poissonPoints(u, 2.0, seed=3)
+    grid = pointGrid(points, u.shape)
+    for a, b in zip(supportGen.perforationProfiles(points, u.shape), supportGen.perforationProfiles(grid)):
+        assert np.array_equal(a, b)
+    assert np.array_equal(explode(points, u.shape), explode(grid))
+
+
+def test_run_pipeline_with_perforated_supports():
+    config = PipelineConfig(PRIMITIVE_TYPE="Sphere", RESOLUTION=32, BACKEND="cpu", BATCH=True, SMOOTH=False, SUPPORT=True, PERFORATE=True, SEED=4)
+    result = run_pipeline(config)
+    backend.set_backend("auto")
+    assert result.volumes["Support"] > 0
+    assert result.grids["supportVoronoi"].shape == result.grids["origShape"].shape
+
+
+def test_cuda_support_matches_cpu_in_simulator():
+    script = (
+        "import numpy as np\n"
+        "from app.voronizer import backend, device, supportGen, Frep as f\n"
+        "from app.voronizer.pointGen import genRandPoints\n"
+        "backend.set_backend('cpu')\n"
+        "x = np.linspace(-10, 10, 12)\n"
+        "u = f.sphere(x, x - 2, x, 5)\n"
+        "projected = f.projection(u)\n"
+        "np.random.seed(1)\n"
+        "seeds = genRandPoints(u, 2.0)\n"
+        "voronoi = np.random.default_rng(0).standard_normal(u.shape).astype(np.float32)\n"
+        "expected = supportGen.supportSpace(u, projected), supportGen.finishSupport(voronoi, u, projected, supportGen.perforationProfiles(seeds))\n"
+        "backend.set_backend('cuda')\n"
+        "h = device.upload(u)\n"
+        "assert np.array_equal(device.download(supportGen.supportSpace(h, projected)), expected[0])\n"
+        "profiles = supportGen.perforationProfiles(device.upload(seeds))\n"
+        "assert np.array_equal(device.download(supportGen.finishSupport(voronoi, h, projected, profiles)), expected[1])\n"
+    )
+    env = dict(os.environ, NUMBA_ENABLE_CUDASIM="1")
+    root = Path(__file__).resolve().parents[1]
+    subprocess.run([sys.executable, "-c", script], check=True, timeout=600, cwd=str(root), env=env)
@@ -0,0 +1,54 @@
+from dataclasses import replace
+
+import numpy as np
+import pytest
+
+from app.voronizer import PipelineConfig, backend, run_pipeline
+from app.voronizer.pointGen import pointGrid
+from app.voronizer.SDF3D import jumpFlood
+from app.voronizer.voronize import labelCells, labelWalls, wallFinder
+
+
+@pytest.fixture(autouse=True)
+def cpu_backend():
+    backend.set_backend("cpu")
+    yield
+    backend.set_backend("auto")
+
+
+def test_label_cells_is_exact():
+    rng = np.random.default_rng(0)
+    points = np.unique(rng.integers(1, 24, (20, 3)), axis=0)
+    grid = pointGrid(points, (24, 24, 24))
+    labels = labelCells(points, grid.shape, block=1000)
+    assert labels.dtype == np.int32
+    assert np.array_equal(points[labelCells(grid)], points[labels])
+    voxels = np.indices(grid.shape).reshape(3, -1).T
+    brute = np.linalg.norm(voxels[:, None, :] - points[None, :, :], axis=-1).min(axis=1)
+    found = np.linalg.norm(voxels - points[labels.ravel()], axis=-1)
+    assert np.allclose(found, brute)
+    #Jump flood agrees away from the faces its probes skip.
+    flood = jumpFlood(grid, 2)
+    jfa = np.linalg.norm(voxels - flood[..., :3].reshape(-1, 3), axis=-1).reshape(grid.shape)
+    assert np.allclose(jfa[1:, 1:, 1:], found.reshape(grid.shape)[1:, 1:, 1:])
+
+
+def test_label_walls_matches_wall_finder():
+    i, j, k = np.indices((12, 13, 14))
+    labels = ((i // 4 + j // 5 + k // 3) % 3).astype(np.int32)
+    #wallFinder compares the seed coordinates stored by the jump flood.
+    flood = np.zeros(labels.shape + (4,), np.float32)
+    flood[..., 0] = labels
+    walls = labelWalls(labels)
+    assert walls.dtype == np.float32
+    expected = wallFinder(flood)
+    assert 0 < (walls < 0).mean() < 0.9
+    #wallFinder never looks at neighbours on the zero faces.
+    assert np.array_equal(walls[2:, 2:, 2:], expected[2:, 2:, 2:])
+
+
+def test_run_pipeline_with_kdtree_cells():
+    config = PipelineConfig(PRIMITIVE_TYPE="Sphere", RESOLUTION=32, BACKEND="cpu", BATCH=True, SMOOTH=False, SEED=2, MODEL_THRESH=0.5)
+    jfa = run_pipeline(config)
+    kdtree = run_pipeline(replace(config, CELL_ENGINE="kdtree"))
+    assert kdtree.volumes["Object"] == pytest.approx(jfa.volumes["Object"], rel=0.05)
@@ -11,3 +11,44 @@ def test_voronize_parse():
     assert opts.command == "voronize"
     assert opts.file_name == "sample.stl"
     assert opts.model is True
+
+
+def test_voronize_parse_direct_sdf():
+    opts = parse_args(["voronize", "--file-name", "sample.stl", "--direct-sdf"])
+    assert opts.direct_sdf is True
+    assert parse_args(["voronize"]).direct_sdf is False
+
+
+def test_voronize_parse_mesh_format():
+    assert parse_args(["voronize"]).mesh_format == "ply"
+    assert parse_args(["voronize", "--mesh-format", "stl"]).mesh_format == "stl"
+
+
+def test_voronize_parse_batch():
+    opts = parse_args(["voronize", "--primitive-type", "Cube", "--batch", "--out", "results"])
+    assert opts.batch is True
+    assert opts.out == "results"
+
+
+def test_voronize_batch_parse():
+    opts = parse_args(["voronize-batch", "--inputs", "catalog/*.stl", "--out", "results", "--jobs", "4", "--set", "RESOLUTION=100"])
+    assert opts.command == "voronize-batch"
+    assert opts.jobs == 4
+    assert opts.set == ["RESOLUTION=100"]
+
+
+def test_voronize_sweep_parse():
+    opts = parse_args(["voronize-sweep", "--primitive-type", "Sphere", "--out", "sweep", "--grid", "MODEL_CELL=0.9,1.2", "--grid", "MODEL_SHELL=0,3"])
+    assert opts.command == "voronize-sweep"
+    assert opts.grid == ["MODEL_CELL=0.9,1.2", "MODEL_SHELL=0,3"]
+
+
+def test_voronize_parse_seed_sampler():
+    opts = parse_args(["voronize", "--primitive-type", "Cube", "--seed-sampler", "poisson", "--seed", "3"])
+    assert opts.seed_sampler == "poisson"
+    assert opts.seed == 3
+
+
+def test_voronize_parse_cell_engine():
+    assert parse_args(["voronize", "--cell-engine", "kdtree"]).cell_engine == "kdtree"
+    assert parse_args(["voronize"]).cell_engine == "jfa"
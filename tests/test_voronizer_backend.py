@@ -0,0 +1,212 @@
+import os
+import subprocess
+import sys
+from dataclasses import replace
+from pathlib import Path
+
+import numpy as np
+import pytest
+from numba import cuda
+
+from app.voronizer import PipelineConfig, backend, run_pipeline
+from app.voronizer import Frep as f
+from app.voronizer.SDF3D import SDF3D, xHeight
+from app.voronizer.analysis import findVol
+
+
+@pytest.fixture
+def cpu_backend():
+    backend.set_backend("cpu")
+    yield
+    backend.set_backend("auto")
+
+
+def test_set_backend_rejects_unknown():
+    with pytest.raises(ValueError):
+        backend.set_backend("opencl")
+
+
+@pytest.mark.skipif(cuda.is_available(), reason="CUDA device present")
+def test_cuda_backend_requires_device():
+    with pytest.raises(RuntimeError):
+        backend.set_backend("cuda")
+    backend.set_backend("auto")
+    assert backend.get_backend() == "cpu"
+
+
+def test_cpu_boolean_ops(cpu_backend):
+    rng = np.random.default_rng(0)
+    u = rng.standard_normal((9, 10, 11)).astype(np.float32)
+    v = rng.standard_normal((9, 10, 11)).astype(np.float32)
+    assert np.array_equal(f.union(u, v), np.minimum(u, v))
+    assert np.array_equal(f.intersection(u, v), np.maximum(u, v))
+    assert np.array_equal(f.subtract(u, v), np.maximum(-u, v))
+    assert np.array_equal(f.translate(u, 2, -1, 3), np.roll(u, (2, -1, 3), axis=(0, 1, 2)))
+
+
+def test_cpu_sdf_matches_sphere(cpu_backend):
+    x = np.linspace(-20, 20, 41)
+    sphere = f.sphere(x, x, x, 10)
+    sdf = SDF3D(sphere)
+    assert sdf.shape == sphere.shape
+    assert np.array_equal(sdf < 0, sphere < 0)
+    assert abs(sdf[20, 20, 20] + 10) <= 1.5
+    assert abs(sdf[0, 20, 20] - 10) <= 1.5
+
+
+def test_cpu_xheight_and_volume(cpu_backend):
+    u = np.ones((6, 4, 4), dtype=np.float32)
+    u[1:5, 1:3, 1:3] = -1
+    heights = xHeight(u)
+    assert heights[1, 1, 1] < heights[4, 1, 1] < 0
+    assert findVol(u, [1, 1, 1], 1.0, "Test") == 16
+
+
+def test_cpu_projection_matches_scan(cpu_backend):
+    x = np.linspace(-10, 10, 16)
+    u = f.union(f.sphere(x, x - 4, x, 4), f.sphere(x + 3, x + 4, x, 3))
+    projected = f.projection(u)
+    #A voxel is filled when anything at or above the layer over it is solid.
+    minX = np.flatnonzero((u < 0).any(axis=(1, 2)))[0]
+    covered = np.logical_or.accumulate((u <= 0)[::-1], axis=0)[::-1]
+    expected = np.array(u)
+    expected[minX:-1][covered[minX + 1:]] = -1
+    assert np.array_equal(projected, expected)
+    assert np.array_equal(f.projection(np.ones((4, 4, 4))), np.ones((4, 4, 4)))
+
+
+def test_cuda_scans_match_cpu_in_simulator():
+    #The single launch column scans run under numba's CUDA simulator.
+    script = (
+        "import numpy as np\n"
+        "from app.voronizer import backend, device, Frep as f\n"
+        "from app.voronizer.SDF3D import xHeight\n"
+        "x = np.linspace(-10, 10, 12)\n"
+        "u = f.union(f.sphere(x, x - 3, x, 4), f.sphere(x + 3, x + 3, x, 3))\n"
+        "backend.set_backend('cpu')\n"
+        "expected = f.projection(u), xHeight(u), f.condense(u, 3, 4)\n"
+        "backend.set_backend('cuda')\n"
+        "assert np.array_equal(f.projection(u), expected[0])\n"
+        "assert np.array_equal(xHeight(u), expected[1])\n"
+        "assert np.array_equal(device.download(f.condense(device.upload(u), 3, 4)), expected[2])\n"
+    )
+    env = dict(os.environ, NUMBA_ENABLE_CUDASIM="1")
+    root = Path(__file__).resolve().parents[1]
+    subprocess.run([sys.executable, "-c", script], check=True, timeout=600, cwd=str(root), env=env)
+
+
+def boxMean(u, iteration, buffer, radius):
+    u = u.astype(np.float64)
+    m, n, p = u.shape
+    for _ in range(iteration):
+        v = u.copy()
+        for i in range(buffer, m - buffer):
+            for j in range(buffer, n - buffer):
+                for k in range(buffer, p - buffer):
+                    v[i, j, k] = u[max(i - radius, 0):i + radius + 1, max(j - radius, 0):j + radius + 1, max(k - radius, 0):k + radius + 1].mean()
+        u = v
+    return u
+
+
+@pytest.mark.parametrize("iteration,buffer,radius", [(1, 0, 1), (3, 0, 1), (2, 1, 1), (1, 0, 2)])
+def test_cpu_smooth_matches_box_mean(cpu_backend, iteration, buffer, radius):
+    u = np.random.default_rng(0).standard_normal((7, 9, 10)).astype(np.float32)
+    smoothed = f.smooth(u, iteration, buffer, radius=radius)
+    assert smoothed.dtype == np.float32
+    assert np.allclose(smoothed, boxMean(u, iteration, buffer, radius), atol=1e-6)
+
+
+def test_cuda_smooth_matches_cpu_in_simulator():
+    script = (
+        "import numpy as np\n"
+        "from app.voronizer import backend, Frep as f\n"
+        "u = np.random.default_rng(0).standard_normal((7, 9, 10)).astype(np.float32)\n"
+        "backend.set_backend('cpu')\n"
+        "expected = f.smooth(u, 3), f.smooth(u, 2, 1, radius=2)\n"
+        "backend.set_backend('cuda')\n"
+        "assert np.allclose(f.smooth(u, 3), expected[0], atol=1e-6)\n"
+        "assert np.allclose(f.smooth(u, 2, 1, radius=2), expected[1], atol=1e-6)\n"
+    )
+    env = dict(os.environ, NUMBA_ENABLE_CUDASIM="1")
+    root = Path(__file__).resolve().parents[1]
+    subprocess.run([sys.executable, "-c", script], check=True, timeout=600, cwd=str(root), env=env)
+
+
+def test_run_pipeline_on_cpu(monkeypatch):
+    monkeypatch.setattr("builtins.input", lambda *args: "N")
+    monkeypatch.setattr("matplotlib.pyplot.show", lambda *args, **kwargs: None)
+    run_pipeline(PipelineConfig(PRIMITIVE_TYPE="Sphere", RESOLUTION=24, BACKEND="cpu"))
+    backend.set_backend("auto")
+
+
+def test_run_pipeline_direct_sdf_on_cpu(tmp_path, monkeypatch):
+    import trimesh
+    import app.voronizer.main as main
+
+    path = tmp_path / "sphere.stl"
+    trimesh.creation.icosphere(2).export(path)
+
+    def no_sdf3d(*args, **kwargs):
+        raise AssertionError("SDF3D must be skipped for the direct mesh SDF")
+
+    monkeypatch.setattr("builtins.input", lambda *args: "N")
+    monkeypatch.setattr("matplotlib.pyplot.show", lambda *args, **kwargs: None)
+    monkeypatch.setattr(main, "SDF3D", no_sdf3d)
+    #voronize still runs its own SDF3D on the wall field.
+    monkeypatch.setattr("app.voronizer.voronize.SDF3D", SDF3D)
+    run_pipeline(PipelineConfig(FILE_NAME=str(path), RESOLUTION=24, BACKEND="cpu", DIRECT_SDF=True))
+    backend.set_backend("auto")
+
+
+def test_run_pipeline_batch_is_headless(tmp_path, monkeypatch):
+    def forbidden(*args, **kwargs):
+        raise AssertionError("batch runs must not prompt or plot")
+
+    monkeypatch.setattr("builtins.input", forbidden)
+    monkeypatch.setattr("matplotlib.pyplot.show", forbidden)
+    out = tmp_path / "out"
+    result = run_pipeline(
+        PipelineConfig(PRIMITIVE_TYPE="Sphere", RESOLUTION=24, BACKEND="cpu", BATCH=True, OUTPUT_DIR=str(out), MESH_FORMAT="stl")
+    )
+    backend.set_backend("auto")
+    assert set(result.grids) == {"origShape", "complete", "objectVoronoi"}
+    assert result.volumes["Object"] > 0
+    verts, faces = result.meshes["Sphere_Voronoi"]
+    assert len(verts) and len(faces)
+    assert (out / "Sphere_Voronoi.stl").exists()
+
+
+def test_run_pipeline_batch_image_stack_needs_output_dir(tmp_path, monkeypatch):
+    import app.voronizer.main as main
+
+    def forbidden(*args, **kwargs):
+        raise AssertionError("batch runs without OUTPUT_DIR must not write files")
+
+    monkeypatch.setattr(main, "generateImageStack", forbidden)
+    config = PipelineConfig(PRIMITIVE_TYPE="Sphere", RESOLUTION=24, BACKEND="cpu", BATCH=True, IMG_STACK=True, SMOOTH=False)
+    assert run_pipeline(config).volumes["Object"] > 0
+    monkeypatch.undo()
+    out = tmp_path / "out"
+    run_pipeline(replace(config, OUTPUT_DIR=str(out)))
+    backend.set_backend("auto")
+    assert (out / "Sphere image stack" / "0Sphere.png").exists()
+
+
+def test_cpu_condense_crops_to_solid_bounds(cpu_backend):
+    u = np.ones((40, 36, 44), dtype=np.float32)
+    u[10:19, 12:15, 20:31] = -1
+    cropped = f.condense(u, 2, 4)
+    #The rounded box fits inside u, so the crop is a view.
+    assert np.shares_memory(cropped, u)
+    assert cropped.shape == (12, 8, 16)
+    assert np.array_equal(cropped, u[8:20, 10:18, 18:34])
+    assert [np.flatnonzero(flags).tolist() for flags in f.solidProfiles(u)] == [list(range(10, 19)), [12, 13, 14], list(range(20, 31))]
+    #Near the edge the box is padded with the edge voxels instead.
+    u[:3] = -1
+    padded = f.condense(u, 2, 4)
+    assert not np.shares_memory(padded, u)
+    assert padded.shape == (24, 40, 48)
+    assert np.array_equal(padded[2:, 2:38, 2:46], u[:22])
+    assert np.array_equal(padded[:2], padded[2:4])
+    with pytest.raises(ValueError):
+        f.condense(np.ones((4, 4, 4), np.float32), 1)
@@ -0,0 +1,35 @@
+import json
+
+import pytest
+import trimesh
+
+from app.voronizer import PipelineConfig
+from app.voronizer.batch import expandInputs, parseOverrides, runBatch
+
+
+def test_parse_overrides_uses_field_types():
+    overrides = parseOverrides(["resolution=64", "MODEL_CELL=1.5", "support=true", "backend=cpu"])
+    assert overrides == {"RESOLUTION": 64, "MODEL_CELL": 1.5, "SUPPORT": True, "BACKEND": "cpu"}
+    with pytest.raises(ValueError):
+        parseOverrides(["NOT_A_FIELD=1"])
+
+
+def test_run_batch_over_manifest(tmp_path):
+    trimesh.creation.icosphere(2).export(tmp_path / "sphere.stl")
+    trimesh.creation.box((1, 1, 2)).export(tmp_path / "box.stl")
+    manifest = tmp_path / "manifest.json"
+    manifest.write_text(json.dumps([
+        {"FILE_NAME": "sphere.stl", "MODEL_THRESH": 0.2},
+        {"FILE_NAME": "box.stl"},
+        {"FILE_NAME": "missing.stl"},
+    ]))
+    assert [overrides for path, overrides in expandInputs(str(manifest))][0] == {"MODEL_THRESH": 0.2}
+    out = tmp_path / "out"
+    config = PipelineConfig(RESOLUTION=24, BACKEND="cpu", SMOOTH=False)
+    report = runBatch(str(manifest), str(out), config, jobs=2)
+    assert [entry["status"] for entry in report] == ["ok", "ok", "failed"]
+    assert report[0]["volumes"]["Object"] > 0
+    assert "FileNotFoundError" in report[2]["error"]
+    assert (out / "sphere" / "sphere_Voronoi.ply").exists()
+    saved = json.loads((out / "report.json").read_text())
+    assert saved["jobs"] == report
@@ -0,0 +1,68 @@
+import os
+
+import numpy as np
+import trimesh
+
+from app.voronizer import PipelineConfig, backend, run_pipeline
+from app.voronizer import main as pipeline
+from app.voronizer.cache import StageCache, fileHash
+
+
+def test_stage_cache_round_trip(tmp_path):
+    cache = StageCache(str(tmp_path))
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return np.arange(6, dtype=np.float32).reshape(2, 3), np.array([1, 2, 3])
+
+    first = cache.fetch("voxelize", {"source": "a", "RESOLUTION": 10}, compute)
+    second = cache.fetch("voxelize", {"RESOLUTION": 10, "source": "a"}, compute)
+    assert len(calls) == 1
+    for expected, loaded in zip(first, second):
+        assert loaded.dtype == expected.dtype
+        assert np.array_equal(loaded, expected)
+    #Hits are copy-on-write, editing them leaves the cache untouched.
+    second[0][:] = -1
+    third = cache.fetch("voxelize", {"source": "a", "RESOLUTION": 10}, compute)
+    assert np.array_equal(third[0], first[0])
+    single = cache.fetch("sdf", {"source": "a"}, lambda: np.ones(4))
+    assert isinstance(cache.fetch("sdf", {"source": "a"}, compute), np.ndarray)
+    assert np.array_equal(single, np.ones(4))
+
+
+def test_stage_cache_evicts_least_recently_used(tmp_path):
+    cache = StageCache(str(tmp_path), maxBytes=3 * 8000 + 1000)
+    for index in range(3):
+        cache.fetch("sdf", {"index": index}, lambda: np.zeros(1000))
+        past = 1000 + index
+        for name in os.listdir(tmp_path):
+            if cache.key("sdf", {"index": index}) in name:
+                os.utime(tmp_path / name, (past, past))
+    assert cache.get(cache.key("sdf", {"index": 0})) is not None
+    cache.fetch("sdf", {"index": 3}, lambda: np.zeros(1000))
+    assert cache.get(cache.key("sdf", {"index": 1})) is None
+    for index in (0, 2, 3):
+        assert cache.get(cache.key("sdf", {"index": index})) is not None
+
+
+def test_run_pipeline_reuses_cached_stages(tmp_path, monkeypatch):
+    path = tmp_path / "sphere.stl"
+    trimesh.creation.icosphere(3).export(path)
+    assert fileHash(str(path)) == fileHash(str(path))
+    config = PipelineConfig(
+        FILE_NAME=str(path), RESOLUTION=24, BACKEND="cpu", BATCH=True, SMOOTH=False,
+        SUPPORT=True, SEPARATE_SUPPORTS=False, CACHE_DIR=str(tmp_path / "cache"),
+    )
+    first = run_pipeline(config)
+
+    def forbidden(*args, **kwargs):
+        raise AssertionError("cached stages must not be recomputed")
+
+    for name in ("voxelize", "SDF3D", "xHeight"):
+        monkeypatch.setattr(pipeline, name, forbidden)
+    monkeypatch.setattr(pipeline.f, "projection", forbidden)
+    second = run_pipeline(config)
+    backend.set_backend("auto")
+    assert np.array_equal(first.grids["origShape"], second.grids["origShape"])
+    assert first.grids["complete"].shape == second.grids["complete"].shape
@@ -0,0 +1,60 @@
+import json
+
+import numpy as np
+import pytest
+
+from app.voronizer import PipelineConfig, backend, run_pipeline
+from app.voronizer import sweep
+from app.voronizer.sweep import parseGrid, runSweep
+
+
+@pytest.fixture(autouse=True)
+def reset_backend():
+    yield
+    backend.set_backend("auto")
+
+
+def test_parse_grid():
+    assert parseGrid(["model_cell=0.9,1.2", "MODEL_SHELL=0,3"]) == {"MODEL_CELL": [0.9, 1.2], "MODEL_SHELL": [0, 3]}
+    with pytest.raises(ValueError):
+        parseGrid(["RESOLUTION=10,20"])
+
+
+def test_sweep_shares_seeds_and_matches_pipeline(tmp_path, monkeypatch):
+    config = PipelineConfig(PRIMITIVE_TYPE="Sphere", RESOLUTION=40, BACKEND="cpu", BATCH=True, SMOOTH=False, MESH_FORMAT="stl", MODEL_THRESH=0.5)
+    calls = []
+    voronoiField = sweep.voronoiField
+
+    def counted(*args, **kwargs):
+        calls.append(1)
+        return voronoiField(*args, **kwargs)
+
+    monkeypatch.setattr(sweep, "voronoiField", counted)
+    np.random.seed(3)
+    report = runSweep(config, {"MODEL_CELL": [1.0, 4.0], "MODEL_SHELL": [0, 3]}, str(tmp_path))
+    assert len(calls) == 1
+    assert [entry["params"] for entry in report] == [
+        {"MODEL_CELL": 1.0, "MODEL_SHELL": 0},
+        {"MODEL_CELL": 1.0, "MODEL_SHELL": 3},
+        {"MODEL_CELL": 4.0, "MODEL_SHELL": 0},
+        {"MODEL_CELL": 4.0, "MODEL_SHELL": 3},
+    ]
+    volumes = [entry["volumes"]["Object"] for entry in report]
+    assert volumes[0] < volumes[2] and volumes[0] < volumes[1]
+    assert all(entry["masses"]["Object"] == pytest.approx(1.25 * entry["volumes"]["Object"] / 1000) for entry in report)
+    assert (tmp_path / "Sphere_Voronoi_3.stl").exists()
+    summary = json.loads((tmp_path / "sweep.json").read_text())
+    assert [entry["volumes"] for entry in summary["variants"]] == [entry["volumes"] for entry in report]
+
+    #Same seeds, same result as a full pipeline run of that variant.
+    np.random.seed(3)
+    single = run_pipeline(PipelineConfig(PRIMITIVE_TYPE="Sphere", RESOLUTION=40, BACKEND="cpu", BATCH=True, SMOOTH=False, MODEL_THRESH=0.5, MODEL_CELL=4.0, MODEL_SHELL=3))
+    assert single.volumes["Object"] == pytest.approx(volumes[3])
+
+
+def test_sweep_with_supports(tmp_path):
+    config = PipelineConfig(PRIMITIVE_TYPE="Sphere", RESOLUTION=40, BACKEND="cpu", BATCH=True, SMOOTH=False, SUPPORT=True, SUPPORT_THRESH=1.0)
+    report = runSweep(config, {"SUPPORT_CELL": [1.0, 4.0], "MODEL_THRESH": [0.1]})
+    assert len(report) == 2
+    assert set(report[0]["meshes"]) == {"Sphere_Voronoi_0", "Sphere_Voronoi_0Support"}
+    assert report[0]["volumes"]["Support"] < report[1]["volumes"]["Support"]
@@ -0,0 +1,97 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+import trimesh
+
+from app.voronizer import voxelize as vx
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+def _legacy_rasterize(mesh, bounding_box):
+    vol = np.zeros((bounding_box[2], bounding_box[0], bounding_box[1]), dtype=bool)
+    for height in range(bounding_box[2]):
+        pixels = np.zeros((bounding_box[0], bounding_box[1]), dtype=bool)
+        vx.linesToVoxels(vx.toIntersectingLines(mesh, height), pixels)
+        vol[height] = pixels
+    return vol
+
+
+@pytest.mark.parametrize("file_type", ["stl", "stl_ascii"])
+@pytest.mark.parametrize(
+    "mesh",
+    [trimesh.creation.icosphere(2), trimesh.creation.box((1, 2, 3)), trimesh.creation.torus(2, 0.7)],
+)
+def test_rasterize_matches_layer_loop(tmp_path, mesh, file_type):
+    path = tmp_path / "model.stl"
+    mesh.export(path, file_type=file_type)
+    triangles = list(vx.read_stl_verticies(str(path)))
+    scale, shift, bounding_box = vx.calculateScaleAndShift(triangles, 24)
+    triangles = list(vx.scaleAndShiftMesh(triangles, scale, shift))
+    expected = _legacy_rasterize(triangles, bounding_box)
+    result = vx.rasterizeMesh(np.array(triangles, dtype=np.float64), bounding_box)
+    assert expected.any()
+    assert np.array_equal(result, expected)
+
+
+def test_pad_voxel_array():
+    voxels = np.ones((2, 3, 4), dtype=bool)
+    padded = vx.padVoxelArray(voxels, 2)
+    assert padded.shape == (6, 7, 8)
+    assert padded.sum() == voxels.sum()
+    assert padded[2:4, 2:5, 2:6].all()
+
+
+def test_rasterize_slabs_in_process_pool(tmp_path):
+    path = tmp_path / "capsule.stl"
+    trimesh.creation.capsule(2, 1).export(path)
+    triangles = list(vx.read_stl_verticies(str(path)))
+    scale, shift, bounding_box = vx.calculateScaleAndShift(triangles, 32)
+    triangles = np.array(list(vx.scaleAndShiftMesh(triangles, scale, shift)))
+    expected = vx.rasterizeMesh(triangles, bounding_box)
+    assert np.array_equal(vx.rasterizeMesh(triangles, bounding_box, workers=3), expected)
+
+
+def test_slab_pool_after_parallel_kernel(tmp_path):
+    #A forked pool hangs the interpreter once numba's thread pool is running,
+    #so run a parallel kernel first and check the process still exits.
+    path = tmp_path / "sphere.stl"
+    trimesh.creation.icosphere(2).export(path)
+    script = (
+        "import numpy as np\n"
+        "from app.voronizer import backend\n"
+        "from app.voronizer.SDF3D import squaredEDT\n"
+        "from app.voronizer import voxelize as vx\n"
+        "backend.set_backend('cpu')\n"
+        "squaredEDT(np.ones((4, 4, 4), np.float32))\n"
+        "triangles = list(vx.read_stl_verticies(%r))\n" % str(path)
+        + "scale, shift, box = vx.calculateScaleAndShift(triangles, 16)\n"
+        "triangles = np.array(list(vx.scaleAndShiftMesh(triangles, scale, shift)))\n"
+        "assert np.array_equal(vx.rasterizeMesh(triangles, box, 2), vx.rasterizeMesh(triangles, box))\n"
+    )
+    subprocess.run([sys.executable, "-c", script], check=True, timeout=300, cwd=str(ROOT))
+
+
+@pytest.mark.parametrize("file_type", ["stl", "stl_ascii"])
+def test_read_stl_matches_tuple_reader(tmp_path, file_type):
+    path = tmp_path / "model.stl"
+    trimesh.creation.torus(2, 0.7).export(path, file_type=file_type)
+    triangles = vx.readSTL(str(path), chunkSize=4096)
+    #ASCII coordinates are rounded to float32 like the binary ones.
+    expected = np.array(list(vx.read_stl_verticies(str(path))), dtype=np.float32)
+    assert triangles.dtype == np.float32
+    assert np.array_equal(triangles, expected)
+    expected = [tuple(map(tuple, tri)) for tri in expected.tolist()]
+    scale, shift, bounding_box = vx.calculateScaleAndShift(triangles, 24)
+    assert (scale, shift, bounding_box) == vx.calculateScaleAndShift(expected, 24)
+    assert np.array_equal(vx.scaleAndShiftMesh(triangles, scale, shift), vx.scaleAndShiftMesh(expected, scale, shift))
+
+
+def test_binary_stl_with_solid_header(tmp_path):
+    path = tmp_path / "model.stl"
+    data = trimesh.creation.box((1, 2, 3)).export(file_type="stl")
+    path.write_bytes(b"solid" + data[5:])
+    assert vx.readSTL(str(path)).shape == (12, 3, 3)